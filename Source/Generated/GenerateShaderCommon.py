@@ -22,7 +22,10 @@
 
 import sys
 import os
+import io
 import re
+import hashlib
+import collections
 from math import log2
 
 
@@ -82,28 +85,6 @@ TYPE_ACTUAL_SIZES = {
     (TYPE_FLOAT32, 44): 64,
 }
 
-GLSL_TYPE_SIZES_STD_430 = {
-    TYPE_FLOAT32:   4,
-    TYPE_INT32:     4,
-    TYPE_UINT32:    4,
-    (TYPE_FLOAT32,  2): 8,
-    (TYPE_FLOAT32,  3): 16,
-    (TYPE_FLOAT32,  4): 16,
-    (TYPE_INT32,    2): 8,
-    (TYPE_INT32,    3): 16,
-    (TYPE_INT32,    4): 16,
-    (TYPE_UINT32,   2): 8,
-    (TYPE_UINT32,   3): 16,
-    (TYPE_UINT32,   4): 16,
-    (TYPE_FLOAT32, 22): 16,
-    (TYPE_FLOAT32, 23): 24,
-    (TYPE_FLOAT32, 32): 24,
-    (TYPE_FLOAT32, 33): 36,
-    (TYPE_FLOAT32, 34): 48,
-    (TYPE_FLOAT32, 43): 48,
-    (TYPE_FLOAT32, 44): 64,
-}
-
 
 # These types are only for image format use!
 TYPE_UNORM8     = 3
@@ -661,7 +642,8 @@ STRUCT_BREAK_TYPE_COMPLEX   = 1
 STRUCT_BREAK_TYPE_ONLY_C    = 2
 
 # (structTypeName): (structDefinition, onlyForGLSL, alignmentFlags, breakComplex)
-# alignmentFlags    -- if using a struct in dynamic array, it must be aligned with 16 bytes
+# alignmentFlags    -- std140 or std430 layout of the struct in GLSL; then C struct gets
+#                      explicit pads for the same member offsets, and static_assert-s in ShaderCommonC.h
 # breakType         -- if member's type is not primitive and its count>0 then
 #                      it'll be represented as an array of primitive types
 STRUCTS = {
@@ -675,11 +657,16 @@ STRUCTS = {
     "ShLightPolygonal":         (LIGHT_POLYGONAL_STRUCT,        False,  STRUCT_ALIGNMENT_STD430,    0),
     "ShVertPreprocessing":      (VERT_PREPROC_PUSH_STRUCT,      False,  0,                          0),
     "ShIndirectDrawCommand":    (INDIRECT_DRAW_CMD_STRUCT,      False,  STRUCT_ALIGNMENT_STD430,    0),
-    # TODO: should be STRUCT_ALIGNMENT_STD430, but current generator is not great as it just adds pads at the end, so it's 0
-    "ShLensFlareInstance":      (LENS_FLARES_INSTANCE_STRUCT,   False,  0,                          0),
+    "ShLensFlareInstance":      (LENS_FLARES_INSTANCE_STRUCT,   False,  STRUCT_ALIGNMENT_STD430,    0),
     "ShDecalInstance":          (DECAL_INSTANCE_STRUCT,         False,  STRUCT_ALIGNMENT_STD430,    0),
 }
 
+# Structs with std140 or std430 layout, which members are reordered to minimize padding,
+# the declaration order is kept if it's already minimal. Only for structs which
+# members are accessed by name, e.g. not ShIndirectDrawCommand, as Vulkan reads its
+# first members as VkDrawIndexedIndirectCommand. See "--layout" to check the padding.
+STRUCTS_TO_REORDER = set()
+
 # --------------------------------------------------------------------------------------------- #
 # User defined buffers: uniform, storage buffer
 # --------------------------------------------------------------------------------------------- #
@@ -824,20 +811,110 @@ def getAllConstDefs(constDict):
     ]) + "\n\n"
 
 
-def getMemberSizeStd430(baseType, dim, count):
-    if dim == 1:
-        return GLSL_TYPE_SIZES_STD_430[baseType] * count
-    elif count == 1:
-        return GLSL_TYPE_SIZES_STD_430[(baseType, dim)]
-    else:
-        return GLSL_TYPE_SIZES_STD_430[baseType] * dim * count
+# If member's count>1, it can be represented as an array of scalars, see breakType
+def isMemberBroken(count, breakType, isC):
+    return count > 1 and (breakType == STRUCT_BREAK_TYPE_COMPLEX or (isC and breakType == STRUCT_BREAK_TYPE_ONLY_C))
 
 
-def getMemberActualSize(baseType, dim, count):
-    if dim == 1:
-        return TYPE_ACTUAL_SIZES[baseType] * count
+# Count of scalars in a member, as it's declared by getStruct
+def getMemberScalarCount(baseType, dim, count, isBroken):
+    scalarCount = 1 if dim == 1 else TYPE_ACTUAL_SIZES[(baseType, dim)] // 4
+    return align4(count * scalarCount) if isBroken else count * scalarCount
+
+
+def getVectorAlignment(componentCount):
+    return 4 if componentCount == 1 else 8 if componentCount == 2 else 16
+
+
+# Base alignment and size of a GLSL struct member in bytes, by the rules of std140 or std430
+def getMemberLayout(baseType, dim, count, alignmentType, isBroken):
+    if isBroken:
+        dim, count = 1, getMemberScalarCount(baseType, dim, count, True)
+
+    if dim < 10:
+        alignment = getVectorAlignment(dim)
+        size = 4 * dim
     else:
-        return TYPE_ACTUAL_SIZES[(baseType, dim)] * count
+        # matrix is an array of column vectors
+        columnCount, rowCount = dim // 10, dim % 10
+        alignment = getVectorAlignment(rowCount)
+        if alignmentType == STRUCT_ALIGNMENT_STD140:
+            alignment = align(alignment, 16)
+        size = columnCount * align(4 * rowCount, alignment)
+
+    if count > 1:
+        # array stride is rounded up to vec4 in std140
+        if alignmentType == STRUCT_ALIGNMENT_STD140:
+            alignment = align(alignment, 16)
+        size = count * align(size, alignment)
+
+    return alignment, size
+
+
+# Offsets of GLSL struct members in bytes, and the size of the struct,
+# that is a multiple of its alignment, as the struct can be an array element.
+# Returns (list of offsets, struct size).
+def getStructLayout(definition, alignmentType, breakType):
+    offsets = []
+    offset = 0
+    structAlignment = 16 if alignmentType == STRUCT_ALIGNMENT_STD140 else 4
+
+    for baseType, dim, mname, count in definition:
+        alignment, size = getMemberLayout(baseType, dim, count, alignmentType, isMemberBroken(count, breakType, False))
+        offset = align(offset, alignment)
+        offsets.append(offset)
+        offset += size
+        structAlignment = max(structAlignment, alignment)
+
+    return offsets, align(offset, structAlignment)
+
+
+# Greedily take a member with the largest alignment, that doesn't need a pad at the current
+# offset, e.g. vec3 is followed by a scalar. Returns definition in the new member order,
+# or the declared one, if reordering doesn't make the struct smaller.
+def getReorderedDefinition(definition, alignmentType, breakType):
+    layouts = [ getMemberLayout(baseType, dim, count, alignmentType, isMemberBroken(count, breakType, False))
+                for baseType, dim, mname, count in definition ]
+    remaining = sorted(range(len(definition)), key=lambda i: -layouts[i][0])
+
+    reordered = []
+    offset = 0
+    while len(remaining) > 0:
+        fitting = [ i for i in remaining if offset % layouts[i][0] == 0 ]
+        i = fitting[0] if len(fitting) > 0 else remaining[0]
+        remaining.remove(i)
+        reordered.append(definition[i])
+        offset = align(offset, layouts[i][0]) + layouts[i][1]
+
+    if getStructLayout(reordered, alignmentType, breakType)[1] < getStructLayout(definition, alignmentType, breakType)[1]:
+        return reordered
+    return definition
+
+
+def getLayoutName(alignmentType):
+    return "std140" if alignmentType == STRUCT_ALIGNMENT_STD140 else "std430"
+
+
+# Print size and padding of structs with std140 or std430 layout,
+# and their size if members were reordered, see STRUCTS_TO_REORDER
+def printStructLayouts():
+    for name, (structDef, _, alignmentType, breakType) in STRUCTS.items():
+        if alignmentType == STRUCT_ALIGNMENT_NONE:
+            continue
+        _, size = getStructLayout(getStructDefinition(name, structDef, alignmentType, breakType), alignmentType, breakType)
+        _, reorderedSize = getStructLayout(getReorderedDefinition(structDef, alignmentType, breakType), alignmentType, breakType)
+        memberSize = sum(getMemberLayout(baseType, dim, count, alignmentType, isMemberBroken(count, breakType, False))[1]
+                         for baseType, dim, mname, count in structDef)
+        print("%-24s %s: %5d bytes, %4d of padding, %5d if reordered%s" % (
+            name, getLayoutName(alignmentType), size, size - memberSize, reorderedSize,
+            " (reordered)" if name in STRUCTS_TO_REORDER else ""))
+
+
+def getStructDefinition(name, definition, alignmentType, breakType):
+    if alignmentType != STRUCT_ALIGNMENT_NONE and name in STRUCTS_TO_REORDER:
+        return getReorderedDefinition(definition, alignmentType, breakType)
+    return definition
+
 
 CURRENT_PAD_INDEX = 0
 
@@ -855,17 +932,27 @@ def getPadsForStruct(typeNames, uint32ToAdd):
 def getStruct(name, definition, typeNames, alignmentType, breakType):
     r = "struct " + name + "\n{\n"
 
-    if alignmentType == STRUCT_ALIGNMENT_STD140 and typeNames == C_TYPE_NAMES:
-        print("Struct \"" + name + "\" is using std140, alignment must be set manually.")
-
     global CURRENT_PAD_INDEX
     CURRENT_PAD_INDEX = 0
 
-    curSize = 0
+    definition = getStructDefinition(name, definition, alignmentType, breakType)
+    if alignmentType != STRUCT_ALIGNMENT_NONE:
+        offsets, structSize = getStructLayout(definition, alignmentType, breakType)
+
+    # members of C struct are 4-byte aligned, so GLSL alignment is set by explicit pads
     curOffset = 0
 
-    for baseType, dim, mname, count in definition:
+    for i, (baseType, dim, mname, count) in enumerate(definition):
         assert(count > 0)
+
+        if alignmentType != STRUCT_ALIGNMENT_NONE:
+            r += getPadsForStruct(typeNames, (offsets[i] - curOffset) // 4)
+            cSize = 4 * getMemberScalarCount(baseType, dim, count, isMemberBroken(count, breakType, True))
+            _, glslSize = getMemberLayout(baseType, dim, count, alignmentType, isMemberBroken(count, breakType, False))
+            if cSize != glslSize:
+                raise Exception("Member %s of struct %s has a different size in C and GLSL, %d and %d bytes" % (mname, name, cSize, glslSize))
+            curOffset = offsets[i] + cSize
+
         r += "    "
 
         if count == 1:
@@ -883,7 +970,7 @@ def getStruct(name, definition, typeNames, alignmentType, breakType):
         else:
             #if dim > 4 and typeNames == C_TYPE_NAMES:
             #    raise Exception("If count > 1, dimensions must be in [1..4]")
-            if breakType == STRUCT_BREAK_TYPE_COMPLEX or (typeNames == C_TYPE_NAMES and breakType == STRUCT_BREAK_TYPE_ONLY_C):
+            if isMemberBroken(count, breakType, typeNames == C_TYPE_NAMES):
                 if dim <= 4:
                     r += "%s %s[%d]" % (typeNames[baseType], mname, align4(count * dim))
                 else:
@@ -898,27 +985,17 @@ def getStruct(name, definition, typeNames, alignmentType, breakType):
 
         r += ";\n"
 
-        if (alignmentType == STRUCT_ALIGNMENT_STD430):
-            for i in range(count):
-                memberSize = getMemberActualSize(baseType, dim, 1)
-                memberAlignment = getMemberSizeStd430(baseType, dim, 1)
+    if alignmentType != STRUCT_ALIGNMENT_NONE:
+        r += getPadsForStruct(typeNames, (structSize - curOffset) // 4)
 
-                alignedOffset = align(curOffset, memberAlignment)
-                diff = alignedOffset - curOffset
-
-                if diff > 0:
-                    assert (diff) % 4 == 0
-                    r += getPadsForStruct(typeNames, diff // 4)
-
-                curSize += curOffset + memberSize
+    r += "};\n"
 
-    if (alignmentType == STRUCT_ALIGNMENT_STD430) and curSize % 16 != 0:
-        if (curSize % 16) % 4 != 0:
-            raise Exception("Size of struct %s is not 4-byte aligned!" % name)
-        uint32ToAdd = (align(curSize, 16) - curSize) // 4
-        r += getPadsForStruct(typeNames, uint32ToAdd)
+    if alignmentType != STRUCT_ALIGNMENT_NONE and typeNames == C_TYPE_NAMES:
+        layoutName = getLayoutName(alignmentType)
+        for (baseType, dim, mname, count), offset in zip(definition, offsets):
+            r += "static_assert(offsetof(%s, %s) == %d, \"%s::%s must have the same offset as in GLSL %s\");\n" % (name, mname, offset, name, mname, layoutName)
+        r += "static_assert(sizeof(%s) == %d, \"%s must have the same size as in GLSL %s\");\n" % (name, structSize, name, layoutName)
 
-    r += "};\n"
     return r
 
 
@@ -1233,11 +1310,14 @@ def getAllVulkanFramebufDefinitions():
 
 
 FILE_HEADER = "// This file was generated by GenerateShaderCommon.py\n\n"
+SYMBOL_MANIFEST_NAME = "ShaderCommonGLSLSymbols.txt"
 
 
 def writeToC(commonHeaderFile, fbHeaderFile, fbSourceFile):
     commonHeaderFile.write(FILE_HEADER)
     commonHeaderFile.write("#pragma once\n\n")
+    # for offsetof in static_assert-s of struct layouts
+    commonHeaderFile.write("#include <stddef.h>\n\n")
     commonHeaderFile.write("namespace RTGL1\n{\n\n")
     commonHeaderFile.write("#include <stdint.h>\n\n")
     commonHeaderFile.write(getAllConstDefs(CONST))
@@ -1268,6 +1348,130 @@ def writeToGLSL(f, generateGetSet):
     f.write(getAllGLSLFramebufDeclarations())
 
 
+# Each CONST, struct and framebuffer of the GLSL header as a symbol:
+# its lines in the header, and the identifiers that shaders can use to reference it.
+# Returns a dict: (kind, name) -> (list of lines, list of identifiers).
+def getAllGLSLSymbols(generateGetSet):
+    symbols = {}
+
+    for constDict in (CONST, CONST_GLSL_ONLY):
+        for name, value in constDict.items():
+            symbols[("CONST", name)] = (getAllConstDefs({ name: value }).splitlines(), [ name ])
+
+    for name, (structDef, _, alignmentType, breakType) in STRUCTS.items():
+        lines = getStruct(name, structDef, GLSL_TYPE_NAMES, alignmentType, breakType).splitlines()
+        identifiers = [ name ]
+        if generateGetSet and name in GETTERS:
+            baseMember = GETTERS[name]
+            for baseType, dim, mname, count in structDef:
+                if count > 1 and dim > 1:
+                    lines += getGLSLGetter(baseMember, baseType, dim, mname).splitlines()
+                    lines += getGLSLSetter(baseMember, baseType, dim, mname).splitlines()
+                    identifiers += [ prefix + capitalizeFirstLetter(baseMember) + capitalizeFirstLetter(mname) for prefix in ("get", "set") ]
+        symbols[("STRUCT", name)] = (lines, identifiers)
+
+    # bindings are assigned in the same order as in getAllGLSLFramebufDeclarations
+    global CURRENT_FRAMEBUF_BINDING_COUNT
+    CURRENT_FRAMEBUF_BINDING_COUNT = 0
+    declarations = { name: getGLSLFramebufDeclaration(FRAMEBUF_PREFIX + name, baseFormat, components, flags)
+                     for name, (baseFormat, components, flags) in FRAMEBUFFERS.items() }
+    samplerDeclarations = { name: getGLSLFramebufSamplerDeclaration(FRAMEBUF_PREFIX + name, baseFormat, components, flags)
+                            for name, (baseFormat, components, flags) in FRAMEBUFFERS.items()
+                            if not (flags & FRAMEBUF_FLAGS_NO_SAMPLER) }
+    enumIndices = dict(getAllFramebufEnumTuples())
+
+    for name, (baseFormat, components, flags) in FRAMEBUFFERS.items():
+        names = [ name ] + ([ name + FRAMEBUF_STORE_PREV_POSTFIX ] if flags & FRAMEBUF_FLAGS_STORE_PREV else [])
+
+        lines = [ "#define FB_IMAGE_INDEX_%s %d" % (capitalizeForEnum(n), enumIndices[capitalizeForEnum(n)]) for n in names ]
+        lines += declarations[name].splitlines()
+        if name in samplerDeclarations:
+            lines += samplerDeclarations[name].splitlines()
+            if baseFormat == TYPE_PACK_E5:
+                lines += getGLSLFramebufPackUnpackE5(name, flags & FRAMEBUF_FLAGS_STORE_PREV).splitlines()
+
+        identifiers = []
+        for n in names:
+            identifiers += [ FRAMEBUF_PREFIX + n, FRAMEBUF_PREFIX + n + FRAMEBUF_SAMPLER_POSTFIX,
+                             "FB_IMAGE_INDEX_" + capitalizeForEnum(n), "texelFetch" + n ]
+        identifiers.append("imageStore" + name)
+        symbols[("FRAMEBUF", name)] = (lines, identifiers)
+
+    # blank lines only separate declarations
+    return { key: ([ line for line in lines if line.strip() != "" ], identifiers) for key, (lines, identifiers) in symbols.items() }
+
+
+def getHash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# Write fingerprints of the GLSL header symbols, so GenerateShaders.py can rebuild
+# only the shaders that reference the changed ones:
+#   HEADER <SHA-256 of the GLSL header text>
+#   LAYOUT <fingerprint of the lines that don't belong to any symbol>
+#   SYMBOL <kind>:<name> <fingerprint> <identifier> [<identifier> ...]
+# A fingerprint includes fingerprints of the symbols that are referenced in its lines,
+# e.g. a struct that uses a CONST for an array size is changed with that CONST.
+def getGLSLSymbolManifest(glslHeader, generateGetSet):
+    symbols = getAllGLSLSymbols(generateGetSet)
+
+    # the rest of the header, e.g. "#ifdef" around the framebuffers
+    symbolLines = collections.Counter(line for lines, _ in symbols.values() for line in lines)
+    layoutLines = []
+    for line in glslHeader.splitlines():
+        if line.strip() == "":
+            continue
+        if symbolLines[line] > 0:
+            symbolLines[line] -= 1
+        else:
+            layoutLines.append(line)
+    assert sum(symbolLines.values()) == 0, "All symbol lines must be in the GLSL header"
+
+    ownFingerprints = { key: getHash("\n".join(lines)) for key, (lines, _) in symbols.items() }
+    owners = { identifier: key for key, (_, identifiers) in symbols.items() for identifier in identifiers }
+
+    def getReferenced(key, visited):
+        for token in set(re.findall(r"\w+", "\n".join(symbols[key][0]))):
+            other = owners.get(token)
+            if other is not None and other not in visited:
+                visited.add(other)
+                getReferenced(other, visited)
+        return visited
+
+    r = "HEADER " + getHash(glslHeader) + "\n"
+    r += "LAYOUT " + getHash("\n".join(layoutLines)) + "\n"
+    for key in sorted(symbols):
+        referenced = sorted(getReferenced(key, { key }))
+        fingerprint = getHash(" ".join(ownFingerprints[k] for k in referenced))
+        r += "SYMBOL %s:%s %s %s\n" % (key[0], key[1], fingerprint, " ".join(symbols[key][1]))
+    return r
+
+
+# Same as open(path, "w"), but on closing, the file is written only if its content
+# is different, so its mtime is not changed, and dependents are not rebuilt
+class FileIfChanged(io.StringIO):
+    def __init__(self, path):
+        super().__init__()
+        self.name = path
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            writeIfChanged(self.name, self.getvalue())
+        return super().__exit__(excType, excValue, traceback)
+
+
+def writeIfChanged(path, content):
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return
+    except (OSError, UnicodeDecodeError):
+        pass
+    with open(path, "w") as f:
+        f.write(content)
+    print("Updated \"" + path + "\"")
+
+
 def main():
     generateGetSet = False
     basePath = ""
@@ -1276,6 +1480,7 @@ def main():
         if "--help" == sys.argv[i] or "-help" == sys.argv[i]:
             print("--getset   : generate getters and setters for non-trivial members")
             print("--path     : specify path to target folder in the next argument")
+            print("--layout   : print size and padding of std140 / std430 structs, don't generate files")
             return
         if "--getset" == sys.argv[i]:
             generateGetSet = True
@@ -1290,13 +1495,20 @@ def main():
                 return
 
     evalConst()
+    if "--layout" in sys.argv:
+        printStructLayouts()
+        return
     # with open('ShaderConfig.csv', newline='') as csvfile:
-    with open(basePath + "ShaderCommonC.h", "w") as commonHeaderFile:
-        with open(basePath + "ShaderCommonCFramebuf.h", "w") as fbHeaderFile:
-            with open(basePath + "ShaderCommonCFramebuf.cpp", "w") as fbSourceFile:
+    with FileIfChanged(basePath + "ShaderCommonC.h") as commonHeaderFile:
+        with FileIfChanged(basePath + "ShaderCommonCFramebuf.h") as fbHeaderFile:
+            with FileIfChanged(basePath + "ShaderCommonCFramebuf.cpp") as fbSourceFile:
                 writeToC(commonHeaderFile, fbHeaderFile, fbSourceFile)
-    with open(basePath + "ShaderCommonGLSL.h", "w") as f:
+    with io.StringIO() as f:
         writeToGLSL(f, generateGetSet)
+        glslHeader = f.getvalue()
+    # manifest is written first, so it's already up-to-date, when the header change is noticed
+    writeIfChanged(basePath + SYMBOL_MANIFEST_NAME, getGLSLSymbolManifest(glslHeader, generateGetSet))
+    writeIfChanged(basePath + "ShaderCommonGLSL.h", glslHeader)
 
 # main
 if __name__ == "__main__":
@@ -2,6 +2,8 @@
 
 #pragma once
 
+#include <stddef.h>
+
 namespace RTGL1
 {
 
@@ -269,6 +271,109 @@ struct ShGlobalUniform
     float viewProjCubemap[96];
     float skyCubemapRotationTransform[16];
 };
+static_assert(offsetof(ShGlobalUniform, view) == 0, "ShGlobalUniform::view must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, invView) == 64, "ShGlobalUniform::invView must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, viewPrev) == 128, "ShGlobalUniform::viewPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, projection) == 192, "ShGlobalUniform::projection must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, invProjection) == 256, "ShGlobalUniform::invProjection must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, projectionPrev) == 320, "ShGlobalUniform::projectionPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, positionsStride) == 384, "ShGlobalUniform::positionsStride must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, normalsStride) == 388, "ShGlobalUniform::normalsStride must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, texCoordsStride) == 392, "ShGlobalUniform::texCoordsStride must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, renderWidth) == 396, "ShGlobalUniform::renderWidth must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, renderHeight) == 400, "ShGlobalUniform::renderHeight must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, frameId) == 404, "ShGlobalUniform::frameId must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, timeDelta) == 408, "ShGlobalUniform::timeDelta must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, minLogLuminance) == 412, "ShGlobalUniform::minLogLuminance must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, maxLogLuminance) == 416, "ShGlobalUniform::maxLogLuminance must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, luminanceWhitePoint) == 420, "ShGlobalUniform::luminanceWhitePoint must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, stopEyeAdaptation) == 424, "ShGlobalUniform::stopEyeAdaptation must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountSpherical) == 428, "ShGlobalUniform::lightCountSpherical must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountDirectional) == 432, "ShGlobalUniform::lightCountDirectional must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyType) == 436, "ShGlobalUniform::skyType must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyColorMultiplier) == 440, "ShGlobalUniform::skyColorMultiplier must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyCubemapIndex) == 444, "ShGlobalUniform::skyCubemapIndex must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyColorDefault) == 448, "ShGlobalUniform::skyColorDefault must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyViewerPosition) == 464, "ShGlobalUniform::skyViewerPosition must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, cameraPosition) == 480, "ShGlobalUniform::cameraPosition must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, debugShowFlags) == 496, "ShGlobalUniform::debugShowFlags must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, firefliesClamp) == 500, "ShGlobalUniform::firefliesClamp must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountSphericalPrev) == 504, "ShGlobalUniform::lightCountSphericalPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountDirectionalPrev) == 508, "ShGlobalUniform::lightCountDirectionalPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, emissionMapBoost) == 512, "ShGlobalUniform::emissionMapBoost must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, emissionMaxScreenColor) == 516, "ShGlobalUniform::emissionMaxScreenColor must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, normalMapStrength) == 520, "ShGlobalUniform::normalMapStrength must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyColorSaturation) == 524, "ShGlobalUniform::skyColorSaturation must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightPosition) == 528, "ShGlobalUniform::spotlightPosition must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightPositionPrev) == 544, "ShGlobalUniform::spotlightPositionPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightDirection) == 560, "ShGlobalUniform::spotlightDirection must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightDirectionPrev) == 576, "ShGlobalUniform::spotlightDirectionPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightUpVector) == 592, "ShGlobalUniform::spotlightUpVector must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightUpVectorPrev) == 608, "ShGlobalUniform::spotlightUpVectorPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightColor) == 624, "ShGlobalUniform::spotlightColor must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightRadius) == 640, "ShGlobalUniform::spotlightRadius must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightCosAngleOuter) == 644, "ShGlobalUniform::spotlightCosAngleOuter must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightCosAngleInner) == 648, "ShGlobalUniform::spotlightCosAngleInner must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, spotlightFalloffDistance) == 652, "ShGlobalUniform::spotlightFalloffDistance must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, maxBounceShadowsDirectionalLights) == 656, "ShGlobalUniform::maxBounceShadowsDirectionalLights must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, maxBounceShadowsSphereLights) == 660, "ShGlobalUniform::maxBounceShadowsSphereLights must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, maxBounceShadowsSpotlights) == 664, "ShGlobalUniform::maxBounceShadowsSpotlights must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, rayCullMaskWorld) == 668, "ShGlobalUniform::rayCullMaskWorld must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomThreshold) == 672, "ShGlobalUniform::bloomThreshold must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomThresholdLength) == 676, "ShGlobalUniform::bloomThresholdLength must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomUpsampleRadius) == 680, "ShGlobalUniform::bloomUpsampleRadius must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomIntensity) == 684, "ShGlobalUniform::bloomIntensity must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomEmissionMultiplier) == 688, "ShGlobalUniform::bloomEmissionMultiplier must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, bloomSkyMultiplier) == 692, "ShGlobalUniform::bloomSkyMultiplier must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, rayLength) == 696, "ShGlobalUniform::rayLength must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, reflectRefractMaxDepth) == 700, "ShGlobalUniform::reflectRefractMaxDepth must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, cameraMediaType) == 704, "ShGlobalUniform::cameraMediaType must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, indexOfRefractionWater) == 708, "ShGlobalUniform::indexOfRefractionWater must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, indexOfRefractionGlass) == 712, "ShGlobalUniform::indexOfRefractionGlass must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterTextureDerivativesMultiplier) == 716, "ShGlobalUniform::waterTextureDerivativesMultiplier must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, enableShadowsFromReflRefr) == 720, "ShGlobalUniform::enableShadowsFromReflRefr must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, enableIndirectFromReflRefr) == 724, "ShGlobalUniform::enableIndirectFromReflRefr must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, forceNoWaterRefraction) == 728, "ShGlobalUniform::forceNoWaterRefraction must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterNormalTextureIndex) == 732, "ShGlobalUniform::waterNormalTextureIndex must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, noBackfaceReflForNoMediaChange) == 736, "ShGlobalUniform::noBackfaceReflForNoMediaChange must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, time) == 740, "ShGlobalUniform::time must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterWaveSpeed) == 744, "ShGlobalUniform::waterWaveSpeed must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterWaveStrength) == 748, "ShGlobalUniform::waterWaveStrength must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterExtinction) == 752, "ShGlobalUniform::waterExtinction must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, portalInputToOutputTransform0) == 768, "ShGlobalUniform::portalInputToOutputTransform0 must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, portalInputToOutputTransform1) == 784, "ShGlobalUniform::portalInputToOutputTransform1 must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, portalInputToOutputTransform2) == 800, "ShGlobalUniform::portalInputToOutputTransform2 must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, portalInputPosition) == 816, "ShGlobalUniform::portalInputPosition must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, cameraRayConeSpreadAngle) == 832, "ShGlobalUniform::cameraRayConeSpreadAngle must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, waterTextureAreaScale) == 836, "ShGlobalUniform::waterTextureAreaScale must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, useSqrtRoughnessForIndirect) == 840, "ShGlobalUniform::useSqrtRoughnessForIndirect must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, upscaledRenderWidth) == 844, "ShGlobalUniform::upscaledRenderWidth must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, worldUpVector) == 848, "ShGlobalUniform::worldUpVector must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, upscaledRenderHeight) == 864, "ShGlobalUniform::upscaledRenderHeight must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, jitterX) == 868, "ShGlobalUniform::jitterX must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, jitterY) == 872, "ShGlobalUniform::jitterY must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, primaryRayMinDist) == 876, "ShGlobalUniform::primaryRayMinDist must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, rayCullBackFaces) == 880, "ShGlobalUniform::rayCullBackFaces must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, maxBounceShadowsPolygonalLights) == 884, "ShGlobalUniform::maxBounceShadowsPolygonalLights must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, polyLightSpotlightFactor) == 888, "ShGlobalUniform::polyLightSpotlightFactor must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, directionalLightTanAngularRadius) == 892, "ShGlobalUniform::directionalLightTanAngularRadius must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, directionalLightDirection) == 896, "ShGlobalUniform::directionalLightDirection must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, directionalLightDirectionPrev) == 912, "ShGlobalUniform::directionalLightDirectionPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, directionalLightColor) == 928, "ShGlobalUniform::directionalLightColor must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountSpotlight) == 944, "ShGlobalUniform::lightCountSpotlight must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountSpotlightPrev) == 948, "ShGlobalUniform::lightCountSpotlightPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountPolygonal) == 952, "ShGlobalUniform::lightCountPolygonal must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lightCountPolygonalPrev) == 956, "ShGlobalUniform::lightCountPolygonalPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, rayCullMaskWorld_Shadow) == 960, "ShGlobalUniform::rayCullMaskWorld_Shadow must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, lensFlareCullingInputCount) == 964, "ShGlobalUniform::lensFlareCullingInputCount must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, applyViewProjToLensFlares) == 968, "ShGlobalUniform::applyViewProjToLensFlares must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, areFramebufsInitedByRT) == 972, "ShGlobalUniform::areFramebufsInitedByRT must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, instanceGeomInfoOffset) == 976, "ShGlobalUniform::instanceGeomInfoOffset must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, instanceGeomInfoOffsetPrev) == 1168, "ShGlobalUniform::instanceGeomInfoOffsetPrev must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, instanceGeomCount) == 1360, "ShGlobalUniform::instanceGeomCount must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, viewProjCubemap) == 1552, "ShGlobalUniform::viewProjCubemap must have the same offset as in GLSL std140");
+static_assert(offsetof(ShGlobalUniform, skyCubemapRotationTransform) == 1936, "ShGlobalUniform::skyCubemapRotationTransform must have the same offset as in GLSL std140");
+static_assert(sizeof(ShGlobalUniform) == 2000, "ShGlobalUniform must have the same size as in GLSL std140");
 
 struct ShGeometryInstance
 {
@@ -296,6 +401,30 @@ struct ShGeometryInstance
     float defaultEmission;
     uint32_t triangleArrayIndex;
 };
+static_assert(offsetof(ShGeometryInstance, model) == 0, "ShGeometryInstance::model must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, prevModel) == 64, "ShGeometryInstance::prevModel must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materialColors) == 128, "ShGeometryInstance::materialColors must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials0A) == 176, "ShGeometryInstance::materials0A must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials0B) == 180, "ShGeometryInstance::materials0B must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials0C) == 184, "ShGeometryInstance::materials0C must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials1A) == 188, "ShGeometryInstance::materials1A must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials1B) == 192, "ShGeometryInstance::materials1B must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials1C) == 196, "ShGeometryInstance::materials1C must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials2A) == 200, "ShGeometryInstance::materials2A must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, materials2B) == 204, "ShGeometryInstance::materials2B must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, sectorArrayIndex) == 208, "ShGeometryInstance::sectorArrayIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, flags) == 212, "ShGeometryInstance::flags must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, baseVertexIndex) == 216, "ShGeometryInstance::baseVertexIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, baseIndexIndex) == 220, "ShGeometryInstance::baseIndexIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, prevBaseVertexIndex) == 224, "ShGeometryInstance::prevBaseVertexIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, prevBaseIndexIndex) == 228, "ShGeometryInstance::prevBaseIndexIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, vertexCount) == 232, "ShGeometryInstance::vertexCount must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, indexCount) == 236, "ShGeometryInstance::indexCount must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, defaultRoughness) == 240, "ShGeometryInstance::defaultRoughness must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, defaultMetallicity) == 244, "ShGeometryInstance::defaultMetallicity must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, defaultEmission) == 248, "ShGeometryInstance::defaultEmission must have the same offset as in GLSL std430");
+static_assert(offsetof(ShGeometryInstance, triangleArrayIndex) == 252, "ShGeometryInstance::triangleArrayIndex must have the same offset as in GLSL std430");
+static_assert(sizeof(ShGeometryInstance) == 256, "ShGeometryInstance must have the same size as in GLSL std430");
 
 struct ShTonemapping
 {
@@ -310,6 +439,11 @@ struct ShLightSpherical
     float color[3];
     float falloff;
 };
+static_assert(offsetof(ShLightSpherical, position) == 0, "ShLightSpherical::position must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightSpherical, radius) == 12, "ShLightSpherical::radius must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightSpherical, color) == 16, "ShLightSpherical::color must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightSpherical, falloff) == 28, "ShLightSpherical::falloff must have the same offset as in GLSL std430");
+static_assert(sizeof(ShLightSpherical) == 32, "ShLightSpherical must have the same size as in GLSL std430");
 
 struct ShLightPolygonal
 {
@@ -319,6 +453,11 @@ struct ShLightPolygonal
     float color[3];
     uint32_t __pad0;
 };
+static_assert(offsetof(ShLightPolygonal, position_0) == 0, "ShLightPolygonal::position_0 must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightPolygonal, position_1) == 16, "ShLightPolygonal::position_1 must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightPolygonal, position_2) == 32, "ShLightPolygonal::position_2 must have the same offset as in GLSL std430");
+static_assert(offsetof(ShLightPolygonal, color) == 48, "ShLightPolygonal::color must have the same offset as in GLSL std430");
+static_assert(sizeof(ShLightPolygonal) == 64, "ShLightPolygonal must have the same size as in GLSL std430");
 
 struct ShVertPreprocessing
 {
@@ -337,11 +476,22 @@ struct ShIndirectDrawCommand
     float positionToCheck_Y;
     float positionToCheck_Z;
 };
+static_assert(offsetof(ShIndirectDrawCommand, indexCount) == 0, "ShIndirectDrawCommand::indexCount must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, instanceCount) == 4, "ShIndirectDrawCommand::instanceCount must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, firstIndex) == 8, "ShIndirectDrawCommand::firstIndex must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, vertexOffset) == 12, "ShIndirectDrawCommand::vertexOffset must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, firstInstance) == 16, "ShIndirectDrawCommand::firstInstance must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, positionToCheck_X) == 20, "ShIndirectDrawCommand::positionToCheck_X must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, positionToCheck_Y) == 24, "ShIndirectDrawCommand::positionToCheck_Y must have the same offset as in GLSL std430");
+static_assert(offsetof(ShIndirectDrawCommand, positionToCheck_Z) == 28, "ShIndirectDrawCommand::positionToCheck_Z must have the same offset as in GLSL std430");
+static_assert(sizeof(ShIndirectDrawCommand) == 32, "ShIndirectDrawCommand must have the same size as in GLSL std430");
 
 struct ShLensFlareInstance
 {
     uint32_t textureIndex;
 };
+static_assert(offsetof(ShLensFlareInstance, textureIndex) == 0, "ShLensFlareInstance::textureIndex must have the same offset as in GLSL std430");
+static_assert(sizeof(ShLensFlareInstance) == 4, "ShLensFlareInstance must have the same size as in GLSL std430");
 
 struct ShDecalInstance
 {
@@ -351,5 +501,10 @@ struct ShDecalInstance
     uint32_t textureNormals;
     uint32_t __pad0;
 };
+static_assert(offsetof(ShDecalInstance, transform) == 0, "ShDecalInstance::transform must have the same offset as in GLSL std430");
+static_assert(offsetof(ShDecalInstance, textureAlbedoAlpha) == 64, "ShDecalInstance::textureAlbedoAlpha must have the same offset as in GLSL std430");
+static_assert(offsetof(ShDecalInstance, textureRougnessMetallic) == 68, "ShDecalInstance::textureRougnessMetallic must have the same offset as in GLSL std430");
+static_assert(offsetof(ShDecalInstance, textureNormals) == 72, "ShDecalInstance::textureNormals must have the same offset as in GLSL std430");
+static_assert(sizeof(ShDecalInstance) == 80, "ShDecalInstance must have the same size as in GLSL std430");
 
 }
\ No newline at end of file
@@ -0,0 +1,452 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmark of GenerateShaders.py on a synthetic shader tree, to compare
+# the build script between commits, e.g. its scanner, cache and scheduler.
+#
+# Generates a tree of shaders and headers in a temporary folder, with the same
+# layout as "Source/Shaders" and "Source/Generated", and runs GenerateShaders.py
+# that is next to this script with a stub glslc, so the real toolchain is not needed.
+# The stub resolves includes, writes depfiles and SPIR-V-like output, and sleeps
+# for a time that grows with the size of the preprocessed source, like glslc.
+#
+# Header tree: headers are split into "depth" layers, each header includes
+# "fan-out" headers of the next layer, each shader includes "fan-out" headers
+# of the first layer and a generated header, like ShaderCommonGLSL.h.
+#
+# Measured scenarios, median of the runs:
+#   full    : GenerateShaders.py -rebuild
+#   no-op   : nothing was changed since the last build
+#   cold    : all files were touched, but not changed, so each is read and hashed,
+#             e.g. after a checkout, or when file times are not preserved by a copy
+#   touch   : a header with the most dependent shaders was changed
+#
+# Rows can be appended to a CSV file with "--csv", to keep numbers of several commits in one table.
+
+import sys
+import os
+import stat
+import time
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+
+GENERATE_SHADERS_SCRIPT     = "GenerateShaders.py"
+GENERATED_HEADER_NAME       = "ShaderCommonGLSL.h"
+REPORT_FILE_NAME            = "BenchmarkReport.json"
+
+DEFAULT_SHADER_COUNT        = 100
+DEFAULT_HEADER_COUNT        = 40
+DEFAULT_INCLUDE_DEPTH       = 4
+DEFAULT_FANOUT              = 3
+DEFAULT_HEADER_LINES        = 40
+DEFAULT_RUN_COUNT           = 3
+DEFAULT_COMPILE_MS          = 20    # stub glslc time for each compilation
+DEFAULT_LINE_US             = 20    # additional stub glslc time for each preprocessed line
+DEFAULT_SEED                = 1
+
+CSV_COLUMNS = [ "label", "shaders", "headers", "depth", "fanout", "jobs",
+                "full_s", "noop_s", "cold_s", "touch_s", "touch_rebuilt" ]
+
+
+# Stand-in for glslc, that supports the arguments used by GenerateShaders.py,
+# including several sources in one invocation.
+# Its sleep time is set with BENCHMARK_COMPILE_MS and BENCHMARK_LINE_US.
+STUB_GLSLC_SOURCE = '''
+import sys, os, re, time, struct, hashlib
+
+args = sys.argv[1:]
+if "--version" in args:
+    print("shaderc benchmark stub\\nspirv-tools benchmark stub\\nglslang benchmark stub\\nTarget: SPIR-V 1.5")
+    sys.exit(0)
+
+includeFolders = []; defines = []; flags = []; inputs = []
+outputPath = None; depfilePath = None; preprocessOnly = False; writeDepfile = False
+i = 0
+while i < len(args):
+    a = args[i]
+    if a in ("-I", "-o", "-MF"):
+        value = args[i + 1]
+        if a == "-I": includeFolders.append(value)
+        elif a == "-o": outputPath = value
+        else: depfilePath = value
+        i += 2
+        continue
+    if a.startswith("-D"): defines.append(a[2:])
+    elif a == "-E": preprocessOnly = True
+    elif a == "-MD": writeDepfile = True
+    elif a == "-c": pass
+    elif a.startswith("-"): flags.append(a)
+    else: inputs.append(a)
+    i += 1
+
+INCLUDE = re.compile(r'\\s*#include\\s*[<"](.*)[>"]')
+
+def preprocess(path, deps, lines):
+    with open(path) as f:
+        for line in f:
+            m = INCLUDE.match(line)
+            if m is None:
+                lines.append(line.rstrip("\\n"))
+                continue
+            for folder in [ os.path.dirname(path) ] + includeFolders:
+                candidate = os.path.abspath(os.path.join(folder, m.group(1)))
+                if os.path.exists(candidate):
+                    break
+            else:
+                print(path + ": error: could not find " + m.group(1))
+                sys.exit(1)
+            # include guards are not evaluated, so headers are expanded only once
+            if candidate not in deps:
+                deps.append(candidate)
+                preprocess(candidate, deps, lines)
+
+def compile(source, outputPath, depfilePath):
+    deps = []
+    lines = [ "#define " + d for d in defines ]
+    preprocess(source, deps, lines)
+    text = "\\n".join(lines) + "\\n"
+
+    if depfilePath is not None:
+        with open(depfilePath, "w") as f:
+            f.write((outputPath or "-") + ": " + " ".join([ os.path.abspath(source) ] + deps) + "\\n")
+
+    if preprocessOnly:
+        sys.stdout.write(text)
+        return
+
+    time.sleep(float(os.environ.get("BENCHMARK_COMPILE_MS", "0")) / 1000.0 +
+               float(os.environ.get("BENCHMARK_LINE_US", "0")) * len(lines) / 1000000.0)
+
+    digest = hashlib.sha256((text + " ".join(flags)).encode()).digest()
+    words = [ 0x07230203, 0x00010500, 0, 100, 0 ] + list(struct.unpack("<8I", digest))
+    with open(outputPath, "wb") as f:
+        f.write(struct.pack("<%dI" % len(words), *words))
+
+# with several sources, outputs are "<source name>.spv" in the working directory
+for source in inputs:
+    if len(inputs) == 1 and (outputPath is not None or preprocessOnly):
+        compile(source, outputPath, depfilePath)
+    else:
+        output = os.path.basename(source) + ".spv"
+        compile(source, output, output + ".d" if writeDepfile else None)
+'''
+
+
+def getArgValue(names, default):
+    for i in range(len(sys.argv) - 1):
+        if sys.argv[i] in names:
+            return sys.argv[i + 1]
+    return default
+
+
+def getIntArg(names, default):
+    value = getArgValue(names, str(default))
+    if not value.isdigit():
+        print("> \"" + names[0] + "\" expects a non-negative integer")
+        sys.exit(1)
+    return int(value)
+
+
+class TreeConfig:
+    def __init__(self):
+        self.shaderCount = DEFAULT_SHADER_COUNT
+        self.headerCount = DEFAULT_HEADER_COUNT
+        self.depth = DEFAULT_INCLUDE_DEPTH
+        self.fanout = DEFAULT_FANOUT
+        self.headerLines = DEFAULT_HEADER_LINES
+        self.seed = DEFAULT_SEED
+
+
+def getHeaderName(index):
+    return "Header" + str(index) + ".h"
+
+
+# Returns (header name -> included header names, shader name -> included header names)
+def generateIncludeGraph(config):
+    rnd = random.Random(config.seed)
+    depth = max(1, min(config.depth, config.headerCount))
+
+    layers = [ [] for _ in range(depth) ]
+    for index in range(config.headerCount):
+        layers[index * depth // config.headerCount].append(getHeaderName(index))
+
+    headers = {}
+    for level, layer in enumerate(layers):
+        for name in layer:
+            nextLayer = layers[level + 1] if level + 1 < depth else []
+            headers[name] = rnd.sample(nextLayer, min(config.fanout, len(nextLayer)))
+
+    shaders = {}
+    for index in range(config.shaderCount):
+        shaders["Shader" + str(index) + ".comp"] = rnd.sample(layers[0], min(config.fanout, len(layers[0])))
+
+    return headers, shaders
+
+
+def getIncludeLines(includes):
+    return [ "#include \"" + name + "\"" for name in includes ]
+
+
+def getFunctionLines(prefix, lineCount):
+    lines = []
+    for i in range(lineCount):
+        lines.append("float " + prefix + "_" + str(i) + "(float x) { return x * " + str(i + 1) + ".0 + 0.5; }")
+    return lines
+
+
+def writeLines(path, lines):
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def generateTree(rootFolder, config, scriptFolder):
+    shadersFolder = os.path.join(rootFolder, "Source", "Shaders")
+    generatedFolder = os.path.join(rootFolder, "Source", "Generated")
+    os.makedirs(shadersFolder)
+    os.makedirs(generatedFolder)
+    os.makedirs(os.path.join(rootFolder, "Build"))
+
+    # build script and the modules it imports
+    for name in os.listdir(scriptFolder):
+        if name.endswith(".py") and name != os.path.basename(__file__):
+            shutil.copy(os.path.join(scriptFolder, name), shadersFolder)
+
+    headers, shaders = generateIncludeGraph(config)
+
+    writeLines(os.path.join(generatedFolder, GENERATED_HEADER_NAME),
+        [ "#define BENCHMARK_CONSTANT 1" ] + getFunctionLines("generated", config.headerLines))
+
+    for name, includes in headers.items():
+        guard = os.path.splitext(name)[0].upper() + "_H"
+        writeLines(os.path.join(shadersFolder, name),
+            [ "#ifndef " + guard, "#define " + guard ] +
+            getIncludeLines(includes) +
+            getFunctionLines(os.path.splitext(name)[0], config.headerLines) +
+            [ "#endif // " + guard ])
+
+    for name, includes in shaders.items():
+        writeLines(os.path.join(shadersFolder, name),
+            [ "#version 460", "#include \"" + GENERATED_HEADER_NAME + "\"" ] +
+            getIncludeLines(includes) +
+            [ "layout(local_size_x = 8, local_size_y = 8) in;", "void main() {}" ])
+
+    return shadersFolder, headers, shaders
+
+
+# Header that is included, directly or not, by the most shaders.
+# Returns (header name, count of shaders that depend on it).
+def getMostIncludedHeader(headers, shaders):
+    reachable = {}
+
+    def getReachable(name):
+        if name not in reachable:
+            reachable[name] = { name }.union(*(getReachable(h) for h in headers[name]))
+        return reachable[name]
+
+    counts = { name: 0 for name in headers }
+    for includes in shaders.values():
+        for name in set().union(*(getReachable(h) for h in includes)):
+            counts[name] += 1
+
+    return max(sorted(counts.items()), key=lambda c: c[1])
+
+
+def createStubGlslc(binFolder):
+    os.makedirs(binFolder)
+    path = os.path.join(binFolder, "glslc")
+    with open(path, "w") as f:
+        f.write("#!" + sys.executable + "\n" + STUB_GLSLC_SOURCE)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+# Set modification time of all sources and headers to now, without changing them
+def touchAllFiles(rootFolder):
+    now = time.time_ns()
+    for folder, _, files in os.walk(os.path.join(rootFolder, "Source")):
+        for name in files:
+            if os.path.splitext(name)[1] in (".h", ".inl", ".comp", ".vert", ".frag", ".rgen", ".rchit", ".rahit", ".rmiss"):
+                os.utime(os.path.join(folder, name), ns=(now, now))
+
+
+# Returns (wall time in seconds, count of compiled shaders)
+def runBuild(shadersFolder, env, extraArgs):
+    reportPath = os.path.join(shadersFolder, REPORT_FILE_NAME)
+    start = time.perf_counter()
+    r = subprocess.run([ sys.executable, GENERATE_SHADERS_SCRIPT, "-report", reportPath ] + extraArgs,
+                       cwd=shadersFolder, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    seconds = time.perf_counter() - start
+
+    if r.returncode != 0 or "failed" in r.stdout:
+        print(r.stdout)
+        print("> " + GENERATE_SHADERS_SCRIPT + " failed on the synthetic tree")
+        sys.exit(1)
+
+    try:
+        with open(reportPath) as f:
+            compiledCount = json.load(f)["counters"].get("shadersCompiled", 0)
+    except (OSError, ValueError, KeyError):
+        # the script doesn't write reports
+        compiledCount = -1
+    return seconds, compiledCount
+
+
+def getDefaultLabel(scriptFolder):
+    try:
+        r = subprocess.run([ "git", "describe", "--always", "--dirty" ],
+                           cwd=scriptFolder, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return "-"
+    return r.stdout.strip() or "-"
+
+
+def printTable(rows):
+    widths = [ max(len(c), *(len(str(row[c])) for row in rows)) for c in CSV_COLUMNS ]
+    print(" | ".join(c.ljust(w) for c, w in zip(CSV_COLUMNS, widths)))
+    print("-|-".join("-" * w for w in widths))
+    for row in rows:
+        print(" | ".join(str(row[c]).ljust(w) for c, w in zip(CSV_COLUMNS, widths)))
+
+
+def appendCsv(path, row):
+    isNew = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a") as f:
+        if isNew:
+            f.write(",".join(CSV_COLUMNS) + "\n")
+        f.write(",".join(str(row[c]) for c in CSV_COLUMNS) + "\n")
+
+
+def main():
+    if "--help" in sys.argv or "-help" in sys.argv or "-h" in sys.argv or "--h" in sys.argv:
+        print("Usage: BenchmarkGenerateShaders.py [options]")
+        print("")
+        print("  Runs GenerateShaders.py on a synthetic shader tree with a stub glslc,")
+        print("  and prints full rebuild, no-op build, cold no-op build and single header touch times.")
+        print("")
+        print("--shaders N      : count of shaders, default is " + str(DEFAULT_SHADER_COUNT))
+        print("--headers N      : count of headers, default is " + str(DEFAULT_HEADER_COUNT))
+        print("--depth N        : count of header include levels, default is " + str(DEFAULT_INCLUDE_DEPTH))
+        print("--fanout N       : count of headers included by each shader and header, default is " + str(DEFAULT_FANOUT))
+        print("--header-lines N : count of function lines in each header, default is " + str(DEFAULT_HEADER_LINES))
+        print("--seed N         : seed of the include graph, default is " + str(DEFAULT_SEED))
+        print("--runs N         : runs of each scenario, the median is reported, default is " + str(DEFAULT_RUN_COUNT))
+        print("--jobs N         : passed to GenerateShaders.py as \"-j N\", default is the CPU count")
+        print("--compile-ms N   : stub glslc time for each compilation, default is " + str(DEFAULT_COMPILE_MS))
+        print("--line-us N      : additional stub glslc time for each preprocessed line, default is " + str(DEFAULT_LINE_US))
+        print("--label <text>   : name of the row, default is \"git describe\" of this script")
+        print("--csv <file>     : append the row to a CSV file")
+        print("--keep           : don't remove the synthetic tree")
+        return
+
+    if os.name == "nt":
+        print("> Stub glslc is a script with a shebang line, it can't be found in PATH on Windows")
+        return
+
+    config = TreeConfig()
+    config.shaderCount = getIntArg(("--shaders", "-shaders"), DEFAULT_SHADER_COUNT)
+    config.headerCount = getIntArg(("--headers", "-headers"), DEFAULT_HEADER_COUNT)
+    config.depth = getIntArg(("--depth", "-depth"), DEFAULT_INCLUDE_DEPTH)
+    config.fanout = getIntArg(("--fanout", "-fanout"), DEFAULT_FANOUT)
+    config.headerLines = getIntArg(("--header-lines", "-header-lines"), DEFAULT_HEADER_LINES)
+    config.seed = getIntArg(("--seed", "-seed"), DEFAULT_SEED)
+    runCount = max(1, getIntArg(("--runs", "-runs"), DEFAULT_RUN_COUNT))
+    jobCount = getIntArg(("--jobs", "-jobs", "-j"), os.cpu_count() or 1)
+    compileMs = getIntArg(("--compile-ms", "-compile-ms"), DEFAULT_COMPILE_MS)
+    lineUs = getIntArg(("--line-us", "-line-us"), DEFAULT_LINE_US)
+    csvPath = getArgValue(("--csv", "-csv"), None)
+    keep = "--keep" in sys.argv or "-keep" in sys.argv
+
+    if config.shaderCount < 1 or config.headerCount < 1:
+        print("> At least one shader and one header are required")
+        return
+
+    scriptFolder = os.path.dirname(os.path.abspath(__file__))
+    if not os.path.exists(os.path.join(scriptFolder, GENERATE_SHADERS_SCRIPT)):
+        print("> " + GENERATE_SHADERS_SCRIPT + " must be in the same folder as this script")
+        return
+    label = getArgValue(("--label", "-label"), None) or getDefaultLabel(scriptFolder)
+
+    rootFolder = tempfile.mkdtemp(prefix="ShaderBenchmark")
+    try:
+        shadersFolder, headers, shaders = generateTree(rootFolder, config, scriptFolder)
+        touchedHeader, _ = getMostIncludedHeader(headers, shaders)
+
+        binFolder = os.path.join(rootFolder, "bin")
+        createStubGlslc(binFolder)
+        env = dict(os.environ,
+                   PATH=binFolder + os.pathsep + os.environ.get("PATH", ""),
+                   BENCHMARK_COMPILE_MS=str(compileMs),
+                   BENCHMARK_LINE_US=str(lineUs))
+        buildArgs = [ "-j", str(jobCount) ]
+
+        print("> Synthetic tree in \"" + rootFolder + "\", touched header is " + touchedHeader)
+
+        fullTimes = []
+        for _ in range(runCount):
+            fullTimes.append(runBuild(shadersFolder, env, buildArgs + [ "-rebuild" ])[0])
+
+        noopTimes = []
+        for _ in range(runCount):
+            noopTimes.append(runBuild(shadersFolder, env, buildArgs)[0])
+
+        coldTimes = []
+        for _ in range(runCount):
+            touchAllFiles(rootFolder)
+            coldTimes.append(runBuild(shadersFolder, env, buildArgs)[0])
+
+        touchTimes = []
+        touchRebuilt = 0
+        for i in range(runCount):
+            # size is changed too, so the change is not hidden by a coarse mtime
+            with open(os.path.join(shadersFolder, touchedHeader), "a") as f:
+                f.write("// touch " + str(i) + "\n")
+            seconds, touchRebuilt = runBuild(shadersFolder, env, buildArgs)
+            touchTimes.append(seconds)
+
+        row = {
+            "label": label,
+            "shaders": config.shaderCount,
+            "headers": config.headerCount,
+            "depth": config.depth,
+            "fanout": config.fanout,
+            "jobs": jobCount,
+            "full_s": "%.3f" % statistics.median(fullTimes),
+            "noop_s": "%.3f" % statistics.median(noopTimes),
+            "cold_s": "%.3f" % statistics.median(coldTimes),
+            "touch_s": "%.3f" % statistics.median(touchTimes),
+            "touch_rebuilt": touchRebuilt,
+        }
+    finally:
+        if keep:
+            print("> Synthetic tree is kept in \"" + rootFolder + "\"")
+        else:
+            shutil.rmtree(rootFolder, ignore_errors=True)
+
+    printTable([ row ])
+    if csvPath is not None:
+        appendCsv(csvPath, row)
+
+
+if __name__ == "__main__":
+    main()
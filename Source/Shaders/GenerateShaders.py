@@ -21,271 +21,2518 @@
 
 import sys
 import os
+import re
 import subprocess
-import pathlib
+import time
+import struct
+import select
+import hashlib
+import collections
+import contextlib
+import threading
+import json
+import zlib
+import fnmatch
+import shutil
+import tempfile
+import ctypes
+import ctypes.util
+import concurrent.futures
+
+import ShaderArtifactCache
+import ShaderArchive
+import ShaderCompileWorker
+import ShaderReflection
 
 
 CACHE_FOLDER_PATH           = "Build/"
 CACHE_FILE_NAME             = "GenerateShadersCache.txt"
+CACHE_JOURNAL_NAME          = "GenerateShadersCache.journal"
+SPIRV_FOLDER_PATH           = "../../Build/"
 EXTENSIONS                  = [ ".comp", ".vert", "frag", ".rgen", ".rahit", ".rchit", ".rmiss" ]
-DEPENDENCY_EXTENSIONS       = [ ".h", ".inl" ]
+DEPFILE_FOLDER_PATH         = CACHE_FOLDER_PATH + "Deps/"
+VARIANT_FOLDER_PATH         = CACHE_FOLDER_PATH + "Variants/"
+UNOPTIMIZED_FOLDER_PATH     = CACHE_FOLDER_PATH + "Unoptimized/"
+PERMUTATION_MANIFEST_NAME   = "ShaderPermutations.txt"
+ARCHIVE_NAME                = "Shaders.spva"
+RELOAD_MANIFEST_NAME        = "ShaderReload.txt"
+STATS_FILE_NAME             = "ShaderStats.json"
+GENERATED_GLSL_HEADER_PATH  = "../Generated/ShaderCommonGLSL.h"
+GENERATED_SYMBOLS_PATH      = "../Generated/ShaderCommonGLSLSymbols.txt"
 DEPENDENCY_FOLDERS          = { "", "../Generated/" }
-DEPENDENCY_FOLDERS_IGNORE   = [ CACHE_FOLDER_PATH, ".vscode/" ]
-DEPENDENCY_IGNORE           = [ "BlueNoiseFileNames.h", "ShaderCommonC.h", "ShaderCommonCFramebuf.h" ]
+DEPENDENCY_FOLDERS_IGNORE   = [ CACHE_FOLDER_PATH, ".vscode/", "__pycache__/", "Tests/" ]     # a folder name without a path is ignored at any depth
+TARGET_ENV                  = "--target-env=vulkan1.2"
+COMPILE_BATCH_MAX_SIZE      = 16    # max count of shaders compiled by one glslc process, see "-batch"
+FILE_READ_THREAD_COUNT      = 16    # max count of files that are read at once, see mapFilesConcurrently
 
 
-CACHE_FILE_DEPENDENCY_MAP_SEPARATOR_LINE = "DEPENDENCY\n"
+# Cache file is a snapshot of records, that starts with "SHADERCACHE <version> <generation>"
+# and ends with "END". During a build, records are appended to the journal, which starts with
+# "JOURNAL <generation>", and each its line is prefixed with CRC-32 of the rest of the line.
+# Journal is applied to the snapshot of the same generation, so an interrupted build resumes
+# with everything that was compiled before the interruption.
+CACHE_FILE_VERSION          = 3
+CACHE_RECORD_HEADER         = "SHADERCACHE"
+CACHE_RECORD_JOURNAL_HEADER = "JOURNAL"
+CACHE_RECORD_END            = "END"
+CACHE_RECORD_TOOLCHAIN      = "TOOLCHAIN"   # toolchain fingerprint
+CACHE_RECORD_OPTIMIZER      = "OPTIMIZER"   # optimizer fingerprint
+CACHE_RECORD_FILE           = "FILE"        # file, st_mtime_ns, st_size, content hash
+CACHE_RECORD_UNIT           = "UNIT"        # successfully built unit, preprocessed key or "-", files it depends on
+CACHE_RECORD_OPTIMIZED      = "OPTIMIZED"   # unit, key of its last spirv-opt run
+CACHE_RECORD_STALE          = "STALE"       # unit that must be built again, e.g. it failed or wasn't targeted
+CACHE_RECORD_COMPILE        = "COMPILE"     # unit, glslc time in seconds of its last compilation, 1 if it failed or 0
+CACHE_RECORD_SYMBOLS        = "SYMBOLS"     # content hash of the generated GLSL header, its layout fingerprint
+CACHE_RECORD_SYMBOL         = "SYMBOL"      # symbol of the generated GLSL header, its fingerprint, identifiers
 
 
-MARKED_FILES = []
-def wereDependentModified(dependencyMap, modifiedDependent, cache, baseFile, firstTime=True):
-    global MARKED_FILES
-    if firstTime:
-        MARKED_FILES = []
+# Values for "-opt" that are expanded to spirv-opt arguments,
+# other values are passed to spirv-opt as is, e.g. -opt "--merge-blocks --eliminate-dead-code-aggressive"
+OPTIMIZATION_PRESETS = {
+    "O"     : [ "-O" ],     # performance
+    "Os"    : [ "-Os" ],    # size
+}
 
-    for dpd in dependencyMap[baseFile]:
-        if dpd in modifiedDependent or dpd not in cache:
-            return True
-        elif dpd not in MARKED_FILES:
-            MARKED_FILES.append(dpd)
-            if wereDependentModified(dependencyMap, modifiedDependent, cache, dpd, firstTime=False):
-                return True
 
-    return False
+# Shader permutations. Each variant of a source file is compiled with its own
+# defines to "<name>_<variant>.<ext>.spv", in addition to the source file itself,
+# which is compiled without them. Variants that give byte-identical SPIR-V
+# share one file, see PERMUTATION_MANIFEST_NAME in SPIRV_FOLDER_PATH.
+#   source file name : { variant name : { define : value or None } }
+PERMUTATIONS = {
+    # e.g. a 3x3 box filter instead of the wavelet kernel, CmSVGFAtrous.comp checks "#ifdef ATROUS_BOX3"
+    # "CmSVGFAtrous.comp": {
+    #     "Box3": { "ATROUS_BOX3": None },
+    # },
+}
 
+# Separates source file path and variant name in a build unit
+UNIT_VARIANT_SEPARATOR = "@"
 
-def printInPowerShell(msg, color):
-    p = subprocess.run([
-        "PowerShell",
-        "Write-Host",
-        "\"" + msg + "\"",
-        "-ForegroundColor", color
-    ])
+# Flags that are followed by a value, other arguments that don't start with "-" are shader name patterns
+ARGS_WITH_VALUE = {
+    "-j", "--j", "-jobs", "--jobs",
+    "-artifacts", "--artifacts",
+    "-artifacts-size", "--artifacts-size",
+    "-opt", "--opt",
+    "-report", "--report",
+    "-trace", "--trace",
+    "-assume-changed", "--assume-changed",
+    "-batch", "--batch",
+    "-workers", "--workers",
+    "-include-graph", "--include-graph",
+}
 
 
-def getDependentFoldersProcArg():
-    return [a for p in DEPENDENCY_FOLDERS if p != "" for a in ("-I", p)]
+# --------------------------------------------------------------------------------------------- #
+# Build timings
+# --------------------------------------------------------------------------------------------- #
 
+# Collects durations of build phases and of each glslc / spirv-opt invocation,
+# counters (e.g. cache hits), and why each shader was rebuilt.
+# Written as a JSON report with "-report", and as a Chrome trace with "-trace",
+# which can be opened in about:tracing or ui.perfetto.dev.
+class BuildProfiler:
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        # (name, category, start, duration, thread index, args)
+        self.events = []
+        self.counters = collections.Counter()
+        # shader name -> dict, e.g. { "reason": "new", "status": "compiled" }
+        self.shaders = {}
+        self.threadIndices = {}
+        self.lock = threading.Lock()
+        # compile jobs of the worker that finished last, see getCriticalPath
+        self.criticalPath = []
 
-def abspath(filename):
-    return os.path.abspath(filename).replace('\\','/')
+    @contextlib.contextmanager
+    def measure(self, name, category, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                threadIndex = self.threadIndices.setdefault(threading.get_ident(), len(self.threadIndices))
+                self.events.append((name, category, start, duration, threadIndex, args))
 
+    # Measure one step of building a shader, e.g. "glslc" or "spirv-opt"
+    def measureShader(self, step, shaderName):
+        return self.measure(step + " " + shaderName, "shader", shader=shaderName, step=step)
 
-def getAllSubfolders(folder):
-    folder = folder if folder != "" else "."
-    return {os.path.relpath(root).replace('\\','/') + '/' for root, _, _ in os.walk(folder) if abspath(root) != abspath(folder)}
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
 
+    def setShaderInfo(self, shaderName, **info):
+        with self.lock:
+            self.shaders.setdefault(shaderName, {}).update(info)
 
-def fillDependencyFolders():
-    global DEPENDENCY_FOLDERS
+    def getReport(self):
+        phases = {}
+        shaders = { name: dict(info, seconds=0.0, steps={}) for name, info in self.shaders.items() }
 
-    fs = DEPENDENCY_FOLDERS
-    for f in DEPENDENCY_FOLDERS:
-        fs = fs.union(getAllSubfolders(f))
+        for name, category, _, duration, _, args in self.events:
+            if category == "shader":
+                shader = shaders.setdefault(args["shader"], { "seconds": 0.0, "steps": {} })
+                shader["seconds"] += duration
+                shader["steps"][args["step"]] = shader["steps"].get(args["step"], 0.0) + duration
+            else:
+                phases[name] = phases.get(name, 0.0) + duration
 
-    for i in DEPENDENCY_FOLDERS_IGNORE:
-        fs.discard(i)
+        return {
+            "totalSeconds": time.perf_counter() - self.startTime,
+            "phases": phases,
+            "counters": dict(sorted(self.counters.items())),
+            "shaders": dict(sorted(shaders.items())),
+            "criticalPath": self.criticalPath,
+        }
 
-    DEPENDENCY_FOLDERS = fs
+    def getTraceEvents(self):
+        traceEvents = [
+            { "name": "thread_name", "ph": "M", "pid": 0, "tid": index,
+              "args": { "name": "main" if index == 0 else "worker " + str(index) } }
+            for index in sorted(self.threadIndices.values())
+        ]
+        for name, category, start, duration, threadIndex, args in self.events:
+            traceEvents.append({
+                "name": name, "cat": category, "ph": "X", "pid": 0, "tid": threadIndex,
+                # in microseconds
+                "ts": (start - self.startTime) * 1000000, "dur": duration * 1000000,
+                "args": args,
+            })
+        return traceEvents
 
+    def write(self, reportPath, tracePath):
+        if reportPath is not None:
+            with open(reportPath, "w") as f:
+                json.dump(self.getReport(), f, indent=4)
+        if tracePath is not None:
+            with open(tracePath, "w") as f:
+                json.dump({ "traceEvents": self.getTraceEvents(), "displayTimeUnit": "ms" }, f)
 
-def main():
-    if "--help" in sys.argv or "-help" in sys.argv or "-h" in sys.argv or "--h" in sys.argv:
-        print("-rebuild  : clear cache and rebuild all shaders")
-        print("-gencomm  : invoke GenerateShaderCommon.py script")
-        print("-psout    : use PowerShell for printing colored output")
-        print("-r        : same as \"-rebuild\"")
-        print("-g        : same as \"-gencomm\"")
-        print("-ps       : same as \"-psout\"")
+
+# Reset at the start of each build, including each build in watch mode
+PROFILER = BuildProfiler()
+
+
+def resetProfiler():
+    global PROFILER
+    PROFILER = BuildProfiler()
+
+
+def writeBuildTimings(options):
+    try:
+        PROFILER.write(options.reportPath, options.tracePath)
+    except OSError:
+        print("> Couldn't write build timings")
+
+
+# Invert dependency map, so for each file there's a set of files that depend on it
+def getReverseDependencyMap(dependencyMap):
+    reverseMap = {}
+    for name, dpds in dependencyMap.items():
+        for dpd in dpds:
+            reverseMap.setdefault(dpd, set()).add(name)
+    return reverseMap
+
+
+# Propagate dirtiness from modified files to all their dependents in one pass:
+# each file is queued at most once, so it's linear in the size of the graph.
+# Returns a dict: dirty file -> modified file that caused it to be dirty.
+def propagateModification(reverseMap, modifiedFiles):
+    dirtyFiles = { f: f for f in modifiedFiles }
+    queue = collections.deque(sorted(modifiedFiles))
+
+    while queue:
+        f = queue.popleft()
+        for dependent in reverseMap.get(f, ()):
+            if dependent not in dirtyFiles:
+                dirtyFiles[dependent] = dirtyFiles[f]
+                queue.append(dependent)
+
+    return dirtyFiles
+
+
+# Colors for printMessage, named as in PowerShell's Write-Host
+ANSI_COLORS = {
+    "Red"       : "\033[91m",
+    "DarkRed"   : "\033[31m",
+    "Yellow"    : "\033[93m",
+    "Green"     : "\033[92m",
+    "Cyan"      : "\033[96m",
+}
+ANSI_RESET = "\033[0m"
+
+
+# Windows console interprets ANSI escape codes only if it's enabled for the process
+def enableAnsiColors():
+    if os.name != "nt":
         return
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+    try:
+        kernel32 = ctypes.windll.kernel32
+        # STD_OUTPUT_HANDLE, STD_ERROR_HANDLE
+        for stdHandle in (-11, -12):
+            handle = kernel32.GetStdHandle(stdHandle)
+            mode = ctypes.c_uint32()
+            if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+                kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING)
+    except (AttributeError, OSError):
+        pass
 
-    forceRebuild = False
-    powerShellOutput = False
-    if "-rebuild" in sys.argv or "--rebuild" in sys.argv or "-r" in sys.argv or "--r" in sys.argv:
-        forceRebuild = True
-    if "-gencomm" in sys.argv or "--gencomm" in sys.argv or "-g" in sys.argv or "--g" in sys.argv:
-        subprocess.run(["python", "../Generated/GenerateShaderCommon.py", "--path", "../Generated/"])
-    if "-psout" in sys.argv or "--psout" in sys.argv or "-ps" in sys.argv or "--ps" in sys.argv:
-        powerShellOutput = True
-    #elif len(sys.argv) > 1:
-    #    print("> Couldn't parse arguments")
-    #    return
 
-    fillDependencyFolders()
+def getDependentFoldersProcArg(absolutePaths=False):
+    return [a for p in sorted(DEPENDENCY_FOLDERS) if p != "" for a in ("-I", abspath(p) if absolutePaths else p)]
 
-    if not os.path.exists(CACHE_FOLDER_PATH):
-        try:
-            os.mkdir(CACHE_FOLDER_PATH)
-        except OSError:
-            print("> Coudn't create cache folder")
-            return
 
-    if not os.path.exists(CACHE_FOLDER_PATH + CACHE_FILE_NAME):
-        try:
-            with open(CACHE_FOLDER_PATH + CACHE_FILE_NAME, "w"): pass
-        except OSError:
-            print("> Coudn't create cache file")
-            return
-    with open(CACHE_FOLDER_PATH + CACHE_FILE_NAME, "r+") as cacheFile:
-        cache = {}
-        dependencyMap = {}
+def getCompileFlags():
+    return [TARGET_ENV] + getDependentFoldersProcArg()
 
-        if not forceRebuild:
-            try:
-                parsingDpdncy = False
-                for line in cacheFile:
-                    if line == CACHE_FILE_DEPENDENCY_MAP_SEPARATOR_LINE:
-                        parsingDpdncy = True
-                    else:
-                        words = line.split()
-                        if not parsingDpdncy and len(words) >= 2:
-                            # filename + st_mtime
-                            cache[words[0]] = int(words[1])
-
-                        if parsingDpdncy:
-                            if len(words) >= 2:
-                                # filename + (list of files it dependent on)
-                                checkedDpds = set()
-                                dpds = set(words[1:])
-                                for dpd in dpds:
-                                    if os.path.exists(dpd):
-                                        checkedDpds.add(dpd)
-                                dependencyMap[words[0]] = checkedDpds
-                            else:
-                                dependencyMap[words[0]] = set()
-            except:
-                cache = {}
-                dependencyMap = {}
-    
-    modifiedDependent = set()
 
-    msgWasAnyShaderRebuilt = False
-    msgErrorCount = 0
+# Hash of glslc version and command line flags,
+# if it's changed, all shaders must be rebuilt
+def getToolchainFingerprint():
+    try:
+        r = subprocess.run(["glslc", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        version = r.stdout
+    except OSError:
+        version = ""
+    return hashlib.sha256((version + "\n" + " ".join(getCompileFlags())).encode()).hexdigest()
+
+
+def getFileHash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Call fn for each file on a thread pool, as on a cold cache, or on a network or
+# virtualized filesystem, reading a file is mostly waiting, and hashlib releases the GIL.
+# Returns a dict: file -> result of fn, exceptions of fn are propagated.
+def mapFilesConcurrently(fn, filenames):
+    filenames = sorted(filenames)
+    if len(filenames) <= 1:
+        return { f: fn(f) for f in filenames }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(FILE_READ_THREAD_COUNT, len(filenames))) as executor:
+        return dict(zip(filenames, executor.map(fn, filenames)))
+
+
+# Returns a dict: file -> (st_mtime_ns, st_size, content hash).
+# mtime and size are only a fast pre-check: if they are the same as in
+# the cache, file is not read again; otherwise, content is hashed, so
+# touched but not modified files are not considered outdated.
+# stats -- dict: file -> (st_mtime_ns, st_size), e.g. from FileIndex
+def getCacheEntries(stats, cache):
+    entries = {}
+    filesToHash = []
+    for filename, st in stats.items():
+        cached = cache.get(filename)
+        if cached is not None and cached[0] == st[0] and cached[1] == st[1]:
+            entries[filename] = cached
+        else:
+            filesToHash.append(filename)
+
+    hashes = mapFilesConcurrently(getFileHash, filesToHash)
+    for filename in filesToHash:
+        entries[filename] = (stats[filename][0], stats[filename][1], hashes[filename])
+
+    PROFILER.count("filesCheckedByStat", len(stats) - len(filesToHash))
+    PROFILER.count("filesHashed", len(filesToHash))
+    return entries
+
+
+# Same as getCacheEntries, but for one file.
+# st -- (st_mtime_ns, st_size), if it's already known
+def getCacheEntry(filename, cache, st=None):
+    if st is None:
+        st = getStat(filename)
+        if st is None:
+            raise FileNotFoundError(filename)
+    return getCacheEntries({ filename: st }, cache)[filename]
+
+
+def getJobCount():
+    for i in range(len(sys.argv)):
+        arg = sys.argv[i]
+        if arg in ("-j", "--j", "-jobs", "--jobs"):
+            value = sys.argv[i + 1] if i + 1 < len(sys.argv) else ""
+        elif arg.startswith("-j") and arg[2:].isdigit():
+            value = arg[2:]
+        else:
+            continue
+        if not value.isdigit() or int(value) < 1:
+            print("> \"" + arg + "\" expects a positive number of jobs. Using 1.")
+            return 1
+        return int(value)
+    return os.cpu_count() or 1
+
+
+# A build unit is a source file compiled with specific defines. Unit of
+# a source without defines is its absolute path, and a variant is
+# "<absolute path>@<variant name>", so the cache file stays compatible.
+def getUnit(filename, variant=None):
+    return filename if variant is None else filename + UNIT_VARIANT_SEPARATOR + variant
+
 
-    for folder in DEPENDENCY_FOLDERS:
-        if not forceRebuild:
-            print("> Checking dependency files in " + ("current folder" if folder == "" else folder))
+def getUnitSource(unit):
+    return unit.partition(UNIT_VARIANT_SEPARATOR)[0]
 
-        fileList = os.listdir() if folder == "" else os.listdir(folder)
-        for otherFolderFilename in fileList:
-            if otherFolderFilename in DEPENDENCY_IGNORE:
+
+def getUnitVariant(unit):
+    _, separator, variant = unit.partition(UNIT_VARIANT_SEPARATOR)
+    return variant if separator != "" else None
+
+
+# Returns file name of a unit as if it was a separate source file, e.g. "CmSVGFAtrous_Box3.comp"
+def getUnitName(unit):
+    name = os.path.basename(getUnitSource(unit))
+    variant = getUnitVariant(unit)
+    if variant is None:
+        return name
+    stem, ext = os.path.splitext(name)
+    return stem + "_" + variant + ext
+
+
+def getUnitDefineArgs(unit):
+    variant = getUnitVariant(unit)
+    if variant is None:
+        return []
+    defines = PERMUTATIONS[os.path.basename(getUnitSource(unit))][variant]
+    return [ "-D" + name + ("=" + str(value) if value is not None else "") for name, value in sorted(defines.items()) ]
+
+
+def getShaderUnits(shaderFiles):
+    units = set()
+    for filename in shaderFiles:
+        units.add(getUnit(filename))
+        for variant in PERMUTATIONS.get(os.path.basename(filename), {}):
+            unit = getUnit(filename, variant)
+            if abspath(getUnitName(unit)) in shaderFiles:
+                print("> Variant \"" + variant + "\" of " + os.path.basename(filename) + " has the same name as a shader file. Skipping.")
                 continue
+            units.add(unit)
+    return units
+
+
+def getDepfilePath(unit):
+    return DEPFILE_FOLDER_PATH + getUnitName(unit) + ".d"
+
+
+# Parse a Makefile-style depfile, written by glslc with -MD:
+#   target.spv: source.comp header0.h header1.h \
+#     header2.h
+# Returns a set of absolute paths that the unit depends on, including its source file.
+def parseDepfile(unit):
+    with open(getDepfilePath(unit), "r") as f:
+        content = f.read().replace("\\\n", " ")
+
+    # target can contain a drive letter, so find a colon followed by a whitespace
+    _, separator, dpds = content.partition(": ")
+    if separator == "":
+        raise ValueError("Depfile of \"" + getUnitName(unit) + "\" is malformed")
+
+    return { abspath(d) for d in dpds.split() } | { getUnitSource(unit) }
+
+
+# Variants are compiled to the cache folder first, and only distinct
+# ones are copied to SPIRV_FOLDER_PATH, see writePermutationOutputs
+def getSpirvPath(unit):
+    folder = SPIRV_FOLDER_PATH if getUnitVariant(unit) is None else VARIANT_FOLDER_PATH
+    return folder + getUnitName(unit) + ".spv"
+
+
+def getUnoptimizedPath(unit):
+    return UNOPTIMIZED_FOLDER_PATH + getUnitName(unit) + ".spv"
+
+
+# If optimization is enabled, glslc output is kept in the cache folder as
+# an input for spirv-opt, so changing the passes doesn't require recompilation
+def getCompileOutputPath(unit, options):
+    return getUnoptimizedPath(unit) if options.optimizerArgs is not None else getSpirvPath(unit)
+
+
+# Returns a value that follows one of the given arguments, or None
+def getArgValue(names):
+    for i in range(len(sys.argv) - 1):
+        if sys.argv[i] in names:
+            return sys.argv[i + 1]
+    return None
+
+
+def getArgValues(names):
+    return [ sys.argv[i + 1] for i in range(len(sys.argv) - 1) if sys.argv[i] in names ]
+
+
+# Arguments that are not flags or their values, e.g. "RtRaygen*" in "-j 4 RtRaygen*"
+def getPositionalArgs():
+    args = []
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] in ARGS_WITH_VALUE:
+            i += 1
+        elif not sys.argv[i].startswith("-"):
+            args.append(sys.argv[i])
+        i += 1
+    return args
+
+
+# Remove "#line" directives, indentation and empty lines,
+# so the text doesn't depend on the paths and formatting
+def normalizePreprocessed(text):
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line != "" and not line.startswith("#line"))
+
+
+# Run only preprocessor on a unit, depfile is written too.
+# Returns preprocessed text as glslc printed it, or None if it failed.
+def preprocessShader(unit):
+    with PROFILER.measureShader("glslc -E", getUnitName(unit)):
+        r = subprocess.run([
+            "glslc", "-E"
+            ] + getCompileFlags() + getUnitDefineArgs(unit) + [
+            getUnitSource(unit),
+            "-MD", "-MF", getDepfilePath(unit)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if r.returncode != 0:
+        return None
+    return r.stdout
+
+
+# The same preprocessed source, compiled by the same glslc with the same flags
+# gives the same SPIR-V. So this hash is used as a key for a shared artifact store,
+# and to skip compilation if only comments or whitespaces were changed.
+def getPreprocessedKey(unit, preprocessed, toolchainFingerprint):
+    # shader stage is defined by the extension
+    _, stage = os.path.splitext(getUnitSource(unit))
+    defines = " ".join(getUnitDefineArgs(unit))
+    return hashlib.sha256((toolchainFingerprint + "\n" + stage + "\n" + defines + "\n" + preprocessed).encode()).hexdigest()
 
-            filename = abspath(folder + otherFolderFilename)
-            isDependentOn = any([filename.endswith(ext) for ext in DEPENDENCY_EXTENSIONS])
 
-            if not isDependentOn:
+# SPIR-V compiled by a worker from preprocessed text may differ from the one
+# that is compiled locally from the original source, so it has its own key
+def getRemoteArtifactKey(preprocessedKey):
+    return hashlib.sha256(("remote\n" + preprocessedKey).encode()).hexdigest()
+
+
+COMPILE_STATUS_COMPILED             = 0
+COMPILE_STATUS_FROM_ARTIFACT_STORE  = 1
+COMPILE_STATUS_UNCHANGED            = 2
+COMPILE_STATUS_NAMES                = [ "compiled", "fromArtifactStore", "unchanged" ]
+
+# diagnostics is a list of Diagnostic, the unit failed if there are errors;
+# preprocessedKey is None, if preprocessing stage wasn't enabled or it failed;
+# seconds is glslc time of the unit, None if glslc wasn't invoked
+CompileResult = collections.namedtuple("CompileResult", [ "diagnostics", "status", "preprocessedKey", "seconds" ], defaults=[ None ])
+
+
+# Check if glslc can be skipped, because preprocessed source is the same
+# as in the last build, or the SPIR-V is in the artifact store.
+# lastPreprocessedKey -- key of the last successful compilation, if it's known
+# Returns (CompileResult, or None if unit must be compiled; preprocessed key; preprocessed source),
+# preprocessed source is None, if it's not needed for the options, or preprocessing failed.
+# If workers are used, SPIR-V that was compiled remotely can be taken from the artifact store too.
+def lookUpCompiledShader(unit, options, toolchainFingerprint, lastPreprocessedKey):
+    preprocessedKey = None
+    preprocessed = None
+
+    if options.artifactStore is not None or options.checkPreprocessed or options.workerPool is not None:
+        preprocessed = preprocessShader(unit)
+        # if preprocessing failed, compile anyway to get the errors
+        if preprocessed is not None:
+            preprocessedKey = getPreprocessedKey(unit, normalizePreprocessed(preprocessed), toolchainFingerprint)
+
+    if preprocessedKey is not None:
+        if options.checkPreprocessed and preprocessedKey == lastPreprocessedKey and os.path.exists(getCompileOutputPath(unit, options)):
+            return CompileResult([], COMPILE_STATUS_UNCHANGED, preprocessedKey), preprocessedKey, preprocessed
+
+        if options.artifactStore is not None:
+            with PROFILER.measureShader("artifact store get", getUnitName(unit)):
+                data = options.artifactStore.get(preprocessedKey)
+                if data is None and options.workerPool is not None:
+                    data = options.artifactStore.get(getRemoteArtifactKey(preprocessedKey))
+            PROFILER.count("artifactStoreHits" if data is not None else "artifactStoreMisses")
+            if data is not None:
+                with open(getCompileOutputPath(unit, options), "wb") as f:
+                    f.write(data)
+                return CompileResult([], COMPILE_STATUS_FROM_ARTIFACT_STORE, preprocessedKey), preprocessedKey, preprocessed
+
+    return None, preprocessedKey, preprocessed
+
+
+# Returns (list of Diagnostic, glslc time in seconds)
+def runCompiler(unit, options):
+    start = time.perf_counter()
+    with PROFILER.measureShader("glslc", getUnitName(unit)):
+        r = subprocess.run([
+            "glslc"
+            ] + getCompileFlags() + getUnitDefineArgs(unit) + [
+            getUnitSource(unit), 
+            "-MD", "-MF", getDepfilePath(unit),
+            "-o", getCompileOutputPath(unit, options)], 
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    seconds = time.perf_counter() - start
+
+    diagnostics = parseDiagnostics(r.stdout, getUnitName(unit))
+    # e.g. if glslc was interrupted, its output may be incomplete
+    if r.returncode != 0 and not hasErrors(diagnostics):
+        diagnostics.append(Diagnostic(None, None, "error", "glslc exited with code " + str(r.returncode), getUnitName(unit)))
+    return diagnostics, seconds
+
+
+# Compile a preprocessed unit on a remote worker, if there's a free one,
+# otherwise, or if the worker failed, it's compiled locally.
+# Returns (list of Diagnostic, glslc time in seconds, True if compiled remotely).
+def runCompilerOnWorkers(unit, options, preprocessed):
+    worker = options.workerPool.acquire(allowRemote=preprocessed is not None)
+    if worker is not None:
+        start = time.perf_counter()
+        try:
+            with PROFILER.measureShader("remote glslc", getUnitName(unit)):
+                _, stage = os.path.splitext(getUnitSource(unit))
+                data = options.workerPool.compile(worker, stage, TARGET_ENV, preprocessed)
+        finally:
+            options.workerPool.release(worker)
+
+        if data is not None:
+            with open(getCompileOutputPath(unit, options), "wb") as f:
+                f.write(data)
+            PROFILER.count("remoteCompilations")
+            return [], time.perf_counter() - start, True
+
+        # e.g. compilation errors, which are reported by the local glslc with the original file names
+        PROFILER.count("remoteFallbacks")
+        worker = options.workerPool.acquire(allowRemote=False)
+
+    try:
+        diagnostics, seconds = runCompiler(unit, options)
+        return diagnostics, seconds, False
+    finally:
+        options.workerPool.release(worker)
+
+
+# Compile units with the same defines by one glslc process, as starting a process
+# can take longer than compiling a small shader. glslc writes "<source name>.spv"
+# and "<source name>.spv.d" of each source to its working directory, so it's
+# a temporary folder, and the files are moved to the unit's paths.
+# Sources are compiled one after another, and each output is written when
+# its source is compiled, so glslc time of a unit is a difference of output mtimes.
+# Returns a dict: unit -> (list of Diagnostic, glslc time in seconds), for units that were
+# compiled, and their messages are known, see getBatchDiagnostics. Other units, e.g. with
+# errors, must be compiled separately.
+def runCompilerBatch(units, options):
+    folder = tempfile.mkdtemp(prefix="Batch", dir=CACHE_FOLDER_PATH)
+    try:
+        lastTime = time.time_ns()
+        with PROFILER.measure("glslc batch", "batch", shaders=[ getUnitName(unit) for unit in units ]):
+            r = subprocess.run([
+                "glslc", "-c", TARGET_ENV
+                ] + getDependentFoldersProcArg(absolutePaths=True) + getUnitDefineArgs(units[0]) + [
+                getUnitSource(unit) for unit in units
+                ] + [ "-MD" ],
+                cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        PROFILER.count("compileBatches")
+
+        compiledUnits = {}
+        for unit in units:
+            outputPath = os.path.join(folder, os.path.basename(getUnitSource(unit)) + ".spv")
+            st = getStat(outputPath)
+            if st is not None and os.path.exists(outputPath + ".d"):
+                compiledUnits[unit] = max(st[0] - lastTime, 0) / 1000000000
+                lastTime = max(st[0], lastTime)
+                shutil.move(outputPath + ".d", getDepfilePath(unit))
+                shutil.move(outputPath, getCompileOutputPath(unit, options))
+
+        diagnostics = getBatchDiagnostics(units, compiledUnits, r.stdout, r.returncode != 0)
+        if len(compiledUnits) < len(units):
+            PROFILER.count("compileBatchFallbacks", len(units) - len(compiledUnits))
+        return { unit: (diagnostics[unit], seconds) for unit, seconds in compiledUnits.items() }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# glslc prints messages of each source of a batch when it's compiled, but with a file
+# name of a header, if it's in a header, so a message is attributed by the depfiles:
+# the same message is printed once for each unit that includes the file. If it's not,
+# e.g. because of an #ifdef, the units that include the file are removed from
+# compiledUnits, so they're compiled separately. If the batch failed, the units
+# without output could print the message too, so its count can be larger.
+# compiledUnits -- dict: unit -> glslc time, of units that have output and depfile
+# Returns a dict: unit -> list of Diagnostic, for units in compiledUnits.
+def getBatchDiagnostics(units, compiledUnits, output, hasFailed):
+    result = { unit: [] for unit in compiledUnits }
+    if output.strip() == "":
+        return result
+
+    dependencies = {}
+    for unit in compiledUnits:
+        try:
+            dependencies[unit] = parseDepfile(unit)
+        except (OSError, ValueError):
+            dependencies[unit] = None
+
+    # the same messages of different units, in the order of compilation
+    occurrences = {}
+    for d in parseDiagnostics(output, None):
+        if d.file is None or d.severity == "error":
+            # e.g. "glslc: error: ...", it belongs to a unit without output
+            if hasFailed:
                 continue
+            compiledUnits.clear()
+            return {}
+        occurrences.setdefault(d._replace(file=abspath(d.file)), []).append(d)
+
+    separateUnits = set()
+    for key, diagnostics in occurrences.items():
+        candidates = [ unit for unit in units if unit in compiledUnits and (dependencies[unit] is None or key.file in dependencies[unit]) ]
+        if any(dependencies[unit] is None for unit in candidates) or \
+           len(diagnostics) < len(candidates) or (len(diagnostics) > len(candidates) and not hasFailed):
+            separateUnits.update(candidates)
+            continue
+        for unit, d in zip(candidates, diagnostics):
+            result[unit].append(d._replace(shader=getUnitName(unit)))
 
-            if ' ' in folder + filename:
-                print("> File \"" + folder + filename + "\" has spaces in its path. Skipping.")
+    for unit in separateUnits:
+        del compiledUnits[unit]
+        del result[unit]
+    return result
+
+
+# Compile units that have the same defines, see getCompileBatches.
+# lastPreprocessedKeys -- dict: unit -> key of its last successful compilation
+# Returns a list of CompileResult, in the same order as units.
+def compileShaders(units, options, toolchainFingerprint, lastPreprocessedKeys):
+    results = {}
+    preprocessedKeys = {}
+    preprocessedSources = {}
+    unitsToCompile = []
+
+    for unit in units:
+        result, preprocessedKeys[unit], preprocessedSources[unit] = lookUpCompiledShader(unit, options, toolchainFingerprint, lastPreprocessedKeys.get(unit))
+        if result is not None:
+            results[unit] = result
+        else:
+            unitsToCompile.append(unit)
+
+    batchedUnits = runCompilerBatch(unitsToCompile, options) if len(unitsToCompile) > 1 else {}
+
+    for unit in unitsToCompile:
+        isRemote = False
+        if unit in batchedUnits:
+            diagnostics, seconds = batchedUnits[unit]
+        elif options.workerPool is not None:
+            diagnostics, seconds, isRemote = runCompilerOnWorkers(unit, options, preprocessedSources[unit])
+        else:
+            diagnostics, seconds = runCompiler(unit, options)
+        preprocessedKey = preprocessedKeys[unit]
+
+        if not hasErrors(diagnostics) and preprocessedKey is not None and options.artifactStore is not None:
+            artifactKey = getRemoteArtifactKey(preprocessedKey) if isRemote else preprocessedKey
+            with PROFILER.measureShader("artifact store put", getUnitName(unit)):
+                with open(getCompileOutputPath(unit, options), "rb") as f:
+                    options.artifactStore.put(artifactKey, f.read())
+
+        results[unit] = CompileResult(diagnostics, COMPILE_STATUS_COMPILED, preprocessedKey, seconds)
+
+    return [ results[unit] for unit in units ]
+
+
+# Job of a worker thread, compiles a batch.
+# Returns (list of CompileResult, thread id, start and end time).
+def runCompileJob(units, options, toolchainFingerprint, lastPreprocessedKeys):
+    start = time.perf_counter()
+    results = compileShaders(units, options, toolchainFingerprint, lastPreprocessedKeys)
+    return results, threading.get_ident(), start, time.perf_counter()
+
+
+# Expected glslc time of each unit: its last compile time, or, if it's unknown,
+# an estimate from the size of its files, as glslc time grows with the preprocessed size.
+# Returns a dict: unit -> seconds, all values are positive.
+def getExpectedDurations(state, units):
+    sizes = {}
+    for unit in units:
+        size = 0
+        for f in state.dependencyMap.get(unit, { getUnitSource(unit) }):
+            st = state.cache[f][:2] if f in state.cache else getStat(f)
+            size += st[1] if st is not None else 0
+        sizes[unit] = max(size, 1)
+
+    knownUnits = [ unit for unit in units if unit in state.compileHistory ]
+    knownSize = sum(sizes[unit] for unit in knownUnits)
+    # without history, only the relative values matter
+    secondsPerByte = sum(state.compileHistory[unit][0] for unit in knownUnits) / knownSize if knownSize > 0 else 0.000001
+
+    return {
+        unit: max(state.compileHistory[unit][0] if unit in state.compileHistory else sizes[unit] * secondsPerByte, 0.0001)
+        for unit in units
+    }
+
+
+# Split units to batches for compileShaders: units in a batch have the same defines,
+# and their sources are different, as glslc names outputs by the source file.
+# Expected time of a batch is a fraction of an even share of a job, so expensive shaders,
+# e.g. ray tracing stages, are compiled alone, and small ones are batched.
+# Batches are sorted by expected time, the longest first, so the build doesn't wait
+# for a long shader that was started last, and small batches fill the gaps at the end.
+# If "-failed-first", units that failed last time are compiled before others,
+# to show their errors as soon as possible.
+def getCompileBatches(state, units, options, expectedDurations):
+    targetDuration = sum(expectedDurations.values()) / (options.jobCount * 4)
+
+    failedUnits = []
+    groups = {}
+    sourceCounts = collections.Counter()
+    for unit in sorted(units, key=lambda u: -expectedDurations[u]):
+        if options.failedFirst and state.compileHistory.get(unit, (0.0, False))[1]:
+            failedUnits.append(unit)
+            continue
+        defines = tuple(getUnitDefineArgs(unit))
+        # e.g. variants with the same defines
+        occurrence = sourceCounts[(defines, getUnitSource(unit))]
+        sourceCounts[(defines, getUnitSource(unit))] += 1
+        groups.setdefault((defines, occurrence), []).append(unit)
+
+    batches = []
+    for group in groups.values():
+        batch = []
+        batchDuration = 0.0
+        for unit in group:
+            if len(batch) > 0 and (len(batch) >= options.batchSize or batchDuration + expectedDurations[unit] > targetDuration):
+                batches.append(batch)
+                batch = []
+                batchDuration = 0.0
+            batch.append(unit)
+            batchDuration += expectedDurations[unit]
+        if len(batch) > 0:
+            batches.append(batch)
+    batches.sort(key=lambda batch: -sum(expectedDurations[unit] for unit in batch))
+
+    return [ [ unit ] for unit in failedUnits ] + batches
+
+
+# Compile jobs of the worker that finished last: the compile phase can't be shorter,
+# unless they're scheduled differently or the longest of them become faster.
+# jobs -- list of (units, thread id, start time, end time)
+# Returns a list of dicts, for the JSON report.
+def getCriticalPath(jobs):
+    if len(jobs) == 0:
+        return []
+    lastThreadId = max(jobs, key=lambda job: job[3])[1]
+    return [
+        { "shaders": [ getUnitName(unit) for unit in units ], "seconds": end - start }
+        for units, threadId, start, end in sorted(jobs, key=lambda job: job[2])
+        if threadId == lastThreadId
+    ]
+
+
+def printCriticalPath(criticalPath):
+    jobNames = []
+    for job in criticalPath:
+        name = job["shaders"][0] if len(job["shaders"]) == 1 else str(len(job["shaders"])) + " shaders"
+        jobNames.append(name + " %.2fs" % job["seconds"])
+    print("> Critical path %.2fs: " % sum(job["seconds"] for job in criticalPath) + ", ".join(jobNames))
+
+
+# Hash of spirv-opt version and arguments, or None if spirv-opt is not found
+def getOptimizerFingerprint(optimizerArgs):
+    try:
+        r = subprocess.run(["spirv-opt", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError:
+        return None
+    return hashlib.sha256((r.stdout + "\n" + " ".join(optimizerArgs)).encode()).hexdigest()
+
+
+def getWordCount(path):
+    return os.path.getsize(path) // 4
+
+
+# wordCount is a tuple (before, after), if spirv-opt was invoked
+OptimizeResult = collections.namedtuple("OptimizeResult", [ "output", "optimizedKey", "wordCount" ])
+
+
+# Run spirv-opt on glslc output, if it or the passes were changed since the last run.
+# lastOptimizedKey -- key of the last successful optimization, if it's known
+def optimizeShader(unit, options, lastOptimizedKey):
+    optimizedKey = hashlib.sha256((options.optimizerFingerprint + "\n" + getFileHash(getUnoptimizedPath(unit))).encode()).hexdigest()
+
+    if optimizedKey == lastOptimizedKey and os.path.exists(getSpirvPath(unit)):
+        PROFILER.count("optimizerSkips")
+        return OptimizeResult("", optimizedKey, None)
+
+    PROFILER.count("optimizerRuns")
+    with PROFILER.measureShader("spirv-opt", getUnitName(unit)):
+        r = subprocess.run([
+            "spirv-opt", TARGET_ENV
+            ] + options.optimizerArgs + [
+            getUnoptimizedPath(unit),
+            "-o", getSpirvPath(unit)],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    if r.returncode != 0:
+        return OptimizeResult(r.stdout if len(r.stdout) > 0 else "spirv-opt failed on " + getUnitName(unit), None, None)
+
+    return OptimizeResult("", optimizedKey, (getWordCount(getUnoptimizedPath(unit)), getWordCount(getSpirvPath(unit))))
+
+
+def abspath(filename):
+    return os.path.abspath(filename).replace('\\','/')
+
+
+# Returns (st_mtime_ns, st_size), or None if file doesn't exist
+def getStat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+# One os.scandir pass over the dependency folders, that collects the folder
+# tree and (st_mtime_ns, st_size) of each file. The result is reused by
+# everything that checks files during a build, instead of separate
+# listdir / walk / exists / stat calls for the same files.
+class FileIndex:
+    def __init__(self, folders, ignoredFolders):
+        # absolute path -> (st_mtime_ns, st_size)
+        self.files = {}
+        # relative paths of scanned folders in the same format as DEPENDENCY_FOLDERS
+        self.folders = set()
+        self.absoluteFolders = set()
+
+        pending = list(folders)
+        while pending:
+            folder = pending.pop()
+            if folder in self.folders:
                 continue
+            self.folders.add(folder)
+            self.absoluteFolders.add(abspath(folder if folder != "" else "."))
+
+            try:
+                with os.scandir(folder if folder != "" else ".") as it:
+                    for entry in it:
+                        if entry.is_dir():
+                            subfolder = folder + entry.name + "/"
+                            # ignored folders are not even scanned, e.g. the cache folder, or
+                            # "__pycache__" of the build scripts, so they don't become "-I" paths
+                            if not any(subfolder.startswith(i) or entry.name + "/" == i for i in ignoredFolders):
+                                pending.append(subfolder)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            self.files[abspath(entry.path)] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+
+    # Same as getStat, but files in the scanned folders are just looked up
+    def getStat(self, filename):
+        if os.path.dirname(filename) in self.absoluteFolders:
+            return self.files.get(filename)
+        return getStat(filename)
+
+    def getFilesInFolder(self, folder):
+        folder = abspath(folder)
+        return [ f for f in self.files if os.path.dirname(f) == folder ]
+
 
-            lastModifTime = int(pathlib.Path(filename).stat().st_mtime)
+def fillDependencyFolders(fileIndex):
+    global DEPENDENCY_FOLDERS
+    DEPENDENCY_FOLDERS = set(fileIndex.folders)
 
-            isOutdated = filename in cache and lastModifTime != cache[filename]
 
-            if filename not in cache or isOutdated:
-                modifiedDependent.add(filename)
+class BuildOptions:
+    def __init__(self):
+        self.jobCount = 1
+        self.coloredOutput = False
+        # stream for "-json" diagnostics, None if they're printed as text
+        self.jsonOutput = None
+        self.artifactStore = None
+        self.checkPreprocessed = False
+        # spirv-opt arguments, None if optimization is disabled
+        self.optimizerArgs = None
+        self.optimizerFingerprint = None
+        # paths for BuildProfiler output, None if not requested
+        self.reportPath = None
+        self.tracePath = None
+        # shader name patterns to build, all shaders if empty
+        self.targets = []
+        self.batchSize = COMPILE_BATCH_MAX_SIZE
+        self.failedFirst = False
+        # ShaderCompileWorker.WorkerPool, None if there are no remote workers
+        self.workerPool = None
 
-            cache[filename] = lastModifTime
 
-            if filename not in dependencyMap or isOutdated:
-                dependencyMap[filename] = set()
+class BuildState:
+    def __init__(self, toolchainFingerprint):
+        # file -> (st_mtime_ns, st_size, content hash), for source files and their dependencies
+        self.cache = {}
+        # unit -> set of files it depends on, including its source file
+        self.dependencyMap = {}
+        self.reverseDependencyMap = {}
+        # unit -> preprocessed key of its last successful compilation
+        self.preprocessedKeys = {}
+        # unit -> key of its last spirv-opt run, see optimizeShader
+        self.optimizedKeys = {}
+        self.shaderFiles = set()
+        self.shaderUnits = set()
+        # units that must be built again: they failed to compile, or were outdated but
+        # not targeted; their last known dependencies are kept to catch the fix in watch mode
+        self.staleUnits = set()
+        # unit -> (glslc time in seconds of its last compilation, True if it failed)
+        self.compileHistory = {}
+        # SymbolManifest of the generated GLSL header that shaders were built with, None if it's unknown
+        self.symbolManifest = None
+        self.toolchainFingerprint = toolchainFingerprint
+        self.cachedToolchainFingerprint = None
+        self.cachedOptimizerFingerprint = None
+        # generation of the cache file snapshot, and the journal opened for it
+        self.cacheGeneration = 0
+        self.journalFile = None
 
-                with open(filename, "r") as dpd:
-                    for line in dpd:
-                        if "#include" in line:
-                            dpdFile = line.split("\"")[1]
-                            for dpdFolder in DEPENDENCY_FOLDERS:
-                                dpd = abspath(dpdFolder + dpdFile)
-                                if os.path.exists(dpd) and dpd != filename:
-                                    dependencyMap[filename].add(dpd)
 
-    #if wereDependentModified and not forceRebuild:
-    #    print("> Dependency files were modified. Rebuilding all...")
-    # print()
+def isShaderFile(filename):
+    return any(filename.endswith(ext) for ext in EXTENSIONS)
 
-    for filenameRelative in os.listdir():
-        filename = abspath(filenameRelative)
-        isShader = any([filename.endswith(ext) for ext in EXTENSIONS])
 
-        if not isShader:
+def getShaderFiles(fileIndex):
+    shaderFiles = set()
+    for filename in fileIndex.getFilesInFolder("."):
+        if not isShaderFile(filename):
             continue
 
         if ' ' in filename:
             print("> File \"" + filename + "\" has spaces in its name. Skipping.")
             continue
 
-        lastModifTime = int(pathlib.Path(filename).stat().st_mtime)
-        isOutdated = filename in cache and lastModifTime != cache[filename]
+        shaderFiles.add(filename)
 
-        if filename not in dependencyMap or isOutdated:
-            dependencyMap[filename] = set()
+    for name in PERMUTATIONS:
+        if abspath(name) not in shaderFiles:
+            print("> Permutations are specified for \"" + name + "\", but there's no such shader file")
 
-            with open(filename, "r") as dpd:
-                for line in dpd:
-                    if "#include" in line:
-                        dpdFile = line.split("\"")[1]
-                        for dpdFolder in DEPENDENCY_FOLDERS:
-                            dpd = abspath(dpdFolder + dpdFile)
-                            if os.path.exists(dpd):
-                                dependencyMap[filename].add(dpd)
+    return shaderFiles
 
-        if filename not in cache or isOutdated or wereDependentModified(dependencyMap, modifiedDependent, cache, filename):
-            print("> Building " + os.path.basename(filename))
 
-            r = subprocess.run([
-                "glslc", "--target-env=vulkan1.2"
-                ] + getDependentFoldersProcArg() + [
-                filename, 
-                "-o", "../../Build/" + os.path.basename(filename) + ".spv"], 
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-
-            if len(r.stdout) > 0:
-                if powerShellOutput:
-                    printInPowerShell(r.stdout, "Red")
+# Apply one cache record to the state. Returns False if the record is malformed.
+def applyCacheRecord(state, words):
+    kind, args = words[0], words[1:]
+
+    try:
+        if kind == CACHE_RECORD_TOOLCHAIN and len(args) == 1:
+            state.cachedToolchainFingerprint = args[0]
+        elif kind == CACHE_RECORD_OPTIMIZER and len(args) == 1:
+            state.cachedOptimizerFingerprint = args[0]
+        elif kind == CACHE_RECORD_FILE and len(args) == 4:
+            state.cache[args[0]] = (int(args[1]), int(args[2]), args[3])
+        elif kind == CACHE_RECORD_UNIT and len(args) >= 2:
+            state.dependencyMap[args[0]] = set(args[2:]) | { getUnitSource(args[0]) }
+            state.staleUnits.discard(args[0])
+            if args[1] != "-":
+                state.preprocessedKeys[args[0]] = args[1]
+            else:
+                state.preprocessedKeys.pop(args[0], None)
+        elif kind == CACHE_RECORD_OPTIMIZED and len(args) == 2:
+            state.optimizedKeys[args[0]] = args[1]
+        elif kind == CACHE_RECORD_STALE and len(args) == 1:
+            state.dependencyMap.setdefault(args[0], { getUnitSource(args[0]) })
+            state.staleUnits.add(args[0])
+            state.preprocessedKeys.pop(args[0], None)
+            state.optimizedKeys.pop(args[0], None)
+        elif kind == CACHE_RECORD_COMPILE and len(args) == 3 and args[2] in ("0", "1"):
+            state.compileHistory[args[0]] = (float(args[1]), args[2] == "1")
+        elif kind == CACHE_RECORD_SYMBOLS and len(args) == 2:
+            state.symbolManifest = SymbolManifest(args[0], args[1], {})
+        elif kind == CACHE_RECORD_SYMBOL and len(args) >= 3 and state.symbolManifest is not None:
+            state.symbolManifest.symbols[args[0]] = (args[1], args[2:])
+        else:
+            return False
+    except ValueError:
+        return False
+
+    return True
+
+
+def getCacheRecordFile(name, cacheEntry):
+    mtime, size, contentHash = cacheEntry
+    return [ CACHE_RECORD_FILE, name, str(mtime), str(size), contentHash ]
+
+
+def getCacheRecordUnit(state, unit):
+    return [ CACHE_RECORD_UNIT, unit, state.preprocessedKeys.get(unit, "-") ] + sorted(state.dependencyMap[unit])
+
+
+def getCacheRecordCompile(state, unit):
+    seconds, failed = state.compileHistory[unit]
+    return [ CACHE_RECORD_COMPILE, unit, "%.4f" % seconds, "1" if failed else "0" ]
+
+
+def getCacheRecordsSymbols(state):
+    if state.symbolManifest is None:
+        return []
+    headerHash, layout, symbols = state.symbolManifest
+    return [ [ CACHE_RECORD_SYMBOLS, headerHash, layout ] ] + [
+        [ CACHE_RECORD_SYMBOL, name, fingerprint ] + identifiers
+        for name, (fingerprint, identifiers) in sorted(symbols.items())
+    ]
+
+
+def formatJournalLine(words):
+    payload = " ".join(words)
+    return "%08x %s\n" % (zlib.crc32(payload.encode()), payload)
+
+
+# Returns words of a journal line, or None if it's damaged, e.g. partially written
+def parseJournalLine(line):
+    if not line.endswith("\n"):
+        return None
+    crc, _, payload = line[:-1].partition(" ")
+    if crc != "%08x" % zlib.crc32(payload.encode()):
+        return None
+    words = payload.split()
+    return words if len(words) > 0 else None
+
+
+# readOnly -- if True, the journal file is not changed, e.g. for "-dry-run"
+# Returns count of applied journal records
+def replayJournal(state, readOnly=False):
+    try:
+        with open(CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME, "r") as journalFile:
+            lines = journalFile.readlines()
+    except OSError:
+        return 0
+
+    header = parseJournalLine(lines[0]) if len(lines) > 0 else None
+    # journal of other generation was already compacted into the snapshot
+    if header != [ CACHE_RECORD_JOURNAL_HEADER, str(state.cacheGeneration) ]:
+        return 0
+
+    appliedCount = 0
+    for line in lines[1:]:
+        words = parseJournalLine(line)
+        # the rest was written when the build was interrupted
+        if words is None or not applyCacheRecord(state, words):
+            break
+        appliedCount += 1
+
+    if readOnly:
+        return appliedCount
+
+    # new records are appended to the applied ones, so they're not lost
+    # if this build is interrupted too; a partially written line is dropped
+    tmpPath = CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME + ".tmp"
+    with open(tmpPath, "w") as journalFile:
+        journalFile.write("".join(lines[:1 + appliedCount]))
+    os.replace(tmpPath, CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME)
+    state.journalFile = open(CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME, "a")
+
+    return appliedCount
+
+
+# forceRebuild -- if True, only compile times are loaded, to schedule the rebuild,
+#                 and the snapshot is replaced with one that has only them
+# readOnly -- if True, files in the cache folder are not changed
+def loadCache(state, forceRebuild, readOnly=False):
+    try:
+        with open(CACHE_FOLDER_PATH + CACHE_FILE_NAME, "r") as cacheFile:
+            lines = cacheFile.readlines()
+    except OSError:
+        lines = []
+
+    header = lines[0].split() if len(lines) > 0 else []
+    isKnownFormat = len(header) == 3 and header[0] == CACHE_RECORD_HEADER and header[1] == str(CACHE_FILE_VERSION) and header[2].isdigit()
+
+    if forceRebuild:
+        if isKnownFormat:
+            state.cacheGeneration = int(header[2])
+            for line in lines[1:]:
+                words = line.split()
+                if len(words) > 0 and words[0] == CACHE_RECORD_COMPILE:
+                    applyCacheRecord(state, words)
+        # if the rebuild is interrupted, its journal is replayed on this snapshot,
+        # so the next build continues the rebuild instead of using the old snapshot
+        if not readOnly:
+            writeSnapshot(state, [ getCacheRecordCompile(state, unit) for unit in state.compileHistory ])
+        return
+
+    if isKnownFormat:
+        state.cacheGeneration = int(header[2])
+
+        damagedCount = 0
+        isComplete = False
+        for line in lines[1:]:
+            words = line.split()
+            if words == [ CACHE_RECORD_END ]:
+                isComplete = True
+                break
+            if len(words) == 0 or not applyCacheRecord(state, words):
+                damagedCount += 1
+
+        # missing records are safe: files that are not in the cache are treated as
+        # modified, and units without dependencies as new, so they're rebuilt
+        if damagedCount > 0 or not isComplete:
+            print("> Cache file is damaged, " + ("some records are missing" if not isComplete else str(damagedCount) + (" record was ignored" if damagedCount == 1 else " records were ignored")) + ". Affected shaders will be rebuilt.")
+    elif len(lines) > 0:
+        print("> Cache file has an unknown format. Rebuilding all...")
+
+    # without a snapshot, e.g. the first build was interrupted, the journal
+    # was written for an empty snapshot of generation 0
+    resumedCount = replayJournal(state, readOnly)
+    if resumedCount > 0:
+        print("> Resuming an interrupted build")
+
+    state.reverseDependencyMap = getReverseDependencyMap(state.dependencyMap)
+
+
+# Append records to the journal, so they're not lost, if the build is interrupted
+def writeJournal(state, records):
+    if len(records) == 0:
+        return
+    if state.journalFile is None:
+        state.journalFile = open(CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME, "w")
+        state.journalFile.write(formatJournalLine([ CACHE_RECORD_JOURNAL_HEADER, str(state.cacheGeneration) ]))
+    state.journalFile.write("".join(formatJournalLine(words) for words in records))
+    state.journalFile.flush()
+
+
+# Write the whole state to a new snapshot and atomically replace the cache file with it,
+# then the journal is not needed anymore
+def saveCache(state):
+    # forget removed shaders and headers that are not included anymore
+    state.dependencyMap = { unit: dpds for unit, dpds in state.dependencyMap.items() if unit in state.shaderUnits }
+    state.staleUnits.intersection_update(state.shaderUnits)
+    liveFiles = state.shaderFiles.union(*state.dependencyMap.values())
+    state.cache = { name: entry for name, entry in state.cache.items() if name in liveFiles }
+    state.preprocessedKeys = { unit: key for unit, key in state.preprocessedKeys.items() if unit in state.dependencyMap }
+    state.optimizedKeys = { unit: key for unit, key in state.optimizedKeys.items() if unit in state.dependencyMap }
+    state.compileHistory = { unit: entry for unit, entry in state.compileHistory.items() if unit in state.dependencyMap }
+
+    records = [ [ CACHE_RECORD_TOOLCHAIN, state.toolchainFingerprint ] ]
+    if state.cachedOptimizerFingerprint is not None:
+        records.append([ CACHE_RECORD_OPTIMIZER, state.cachedOptimizerFingerprint ])
+    for name, cacheEntry in state.cache.items():
+        records.append(getCacheRecordFile(name, cacheEntry))
+    for unit in state.dependencyMap:
+        records.append(getCacheRecordUnit(state, unit))
+    for unit in state.staleUnits:
+        records.append([ CACHE_RECORD_STALE, unit ])
+    for unit, key in state.optimizedKeys.items():
+        records.append([ CACHE_RECORD_OPTIMIZED, unit, key ])
+    for unit in state.compileHistory:
+        records.append(getCacheRecordCompile(state, unit))
+    records += getCacheRecordsSymbols(state)
+
+    writeSnapshot(state, records)
+
+
+# Atomically replace the cache file with a snapshot of the next generation
+# that consists of the records, the journal is removed
+def writeSnapshot(state, records):
+    records = [ [ CACHE_RECORD_HEADER, str(CACHE_FILE_VERSION), str(state.cacheGeneration + 1) ] ] + records + [ [ CACHE_RECORD_END ] ]
+
+    tmpPath = CACHE_FOLDER_PATH + CACHE_FILE_NAME + ".tmp"
+    with open(tmpPath, "w") as cacheFile:
+        cacheFile.write("".join(" ".join(words) + "\n" for words in records))
+        cacheFile.flush()
+        os.fsync(cacheFile.fileno())
+    os.replace(tmpPath, CACHE_FOLDER_PATH + CACHE_FILE_NAME)
+    state.cacheGeneration += 1
+
+    # journal of the previous generation is ignored even if it's not removed
+    if state.journalFile is not None:
+        state.journalFile.close()
+        state.journalFile = None
+    if os.path.exists(CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME):
+        os.remove(CACHE_FOLDER_PATH + CACHE_JOURNAL_NAME)
+
+
+def printMessage(msg, color, coloredOutput):
+    if coloredOutput:
+        print(ANSI_COLORS[color] + msg + ANSI_RESET)
+    else:
+        print(msg)
+
+
+# file and line are None, if they're unknown
+Diagnostic = collections.namedtuple("Diagnostic", [ "file", "line", "severity", "message", "shader" ])
+
+# e.g. "C:/RTGL1/Source/Shaders/CmCas.comp:12: error: 'x' : undeclared identifier",
+# "glslc: error: cannot open input file", "error: line 0: Invalid SPIR-V magic number."
+DIAGNOSTIC_PATTERN          = re.compile(r"^(?:(?P<file>.+?):(?:(?P<line>\d+):)? )?(?P<severity>error|warning|note): (?P<message>.*)$")
+# e.g. "1 error generated.", "2 warnings and 1 error generated."
+DIAGNOSTIC_SUMMARY_PATTERN  = re.compile(r"^\d+ (errors?|warnings?)( and \d+ (errors?|warnings?))? generated\.$")
+DIAGNOSTIC_TOOLS            = ( "glslc", "spirv-opt" )
+DIAGNOSTIC_COLORS           = { "error": "Red", "warning": "Yellow", "note": "Cyan" }
+
+
+# Parse glslc or spirv-opt output to a list of Diagnostic
+def parseDiagnostics(output, shaderName):
+    diagnostics = []
+    for line in output.splitlines():
+        line = line.rstrip()
+        if line == "" or DIAGNOSTIC_SUMMARY_PATTERN.match(line):
+            continue
+
+        m = DIAGNOSTIC_PATTERN.match(line)
+        if m is None:
+            # e.g. a continuation of a message
+            if len(diagnostics) > 0:
+                diagnostics[-1] = diagnostics[-1]._replace(message=diagnostics[-1].message + "\n" + line)
+            else:
+                diagnostics.append(Diagnostic(None, None, "error", line, shaderName))
+            continue
+
+        filename = m.group("file")
+        if filename in DIAGNOSTIC_TOOLS:
+            filename = None
+        diagnostics.append(Diagnostic(
+            filename.replace('\\', '/') if filename is not None else None,
+            int(m.group("line")) if m.group("line") is not None else None,
+            m.group("severity"), m.group("message"), shaderName))
+    return diagnostics
+
+
+def hasErrors(diagnostics):
+    return any(d.severity == "error" for d in diagnostics)
+
+
+# With "-json", each diagnostic is a JSON object on its own line of stdout,
+# otherwise, it's printed in the same format as glslc prints it
+def printDiagnostics(diagnostics, options):
+    for d in diagnostics:
+        if options.jsonOutput is not None:
+            options.jsonOutput.write(json.dumps(d._asdict()) + "\n")
+            options.jsonOutput.flush()
+            continue
+        location = ""
+        if d.file is not None:
+            location = d.file + ":" + (str(d.line) + ":" if d.line is not None else "") + " "
+        printMessage(location + d.severity + ": " + d.message, DIAGNOSTIC_COLORS[d.severity], options.coloredOutput)
+
+
+# Returns a set of dependency files which content was changed.
+# fileIndex -- if None, files are stat-ed one by one
+def checkDependencies(state, filenames, fileIndex=None):
+    modifiedDependent = set()
+    stats = {}
+
+    for filename in sorted(filenames):
+        st = fileIndex.getStat(filename) if fileIndex is not None else getStat(filename)
+
+        if st is None:
+            # dependents must be rebuilt, so glslc reports an error or a new depfile
+            modifiedDependent.add(filename)
+            state.cache.pop(filename, None)
+            continue
+
+        stats[filename] = st
+
+    # files are hashed concurrently, but merged in the same order
+    cacheEntries = getCacheEntries(stats, state.cache)
+
+    for filename in sorted(cacheEntries):
+        cacheEntry = cacheEntries[filename]
+
+        isOutdated = filename in state.cache and cacheEntry[2] != state.cache[filename][2]
+
+        if filename not in state.cache or isOutdated:
+            modifiedDependent.add(filename)
+
+        state.cache[filename] = cacheEntry
+
+    return modifiedDependent
+
+
+def readPermutationManifest():
+    manifest = {}
+    try:
+        with open(SPIRV_FOLDER_PATH + PERMUTATION_MANIFEST_NAME, "r") as f:
+            for line in f:
+                words = line.split()
+                if len(words) == 2:
+                    manifest[words[0]] = words[1]
+    except OSError:
+        pass
+    return manifest
+
+
+# Copy compiled variants to SPIRV_FOLDER_PATH, but only one file for
+# byte-identical variants of a shader, e.g. if a define doesn't affect
+# the code. The manifest maps each variant to the file that should be
+# loaded for it:
+#   CmSVGFAtrous_Box3.comp.spv CmSVGFAtrous.comp.spv
+def writePermutationOutputs(state):
+    oldManifest = readPermutationManifest()
+    manifest = {}
+
+    isBuilt = lambda unit: unit in state.dependencyMap and unit not in state.staleUnits
+
+    for filename in sorted(state.shaderFiles):
+        variants = PERMUTATIONS.get(os.path.basename(filename), {})
+        if len(variants) == 0:
+            continue
+
+        # content hash -> file name in SPIRV_FOLDER_PATH
+        blobs = {}
+        if isBuilt(getUnit(filename)) and os.path.exists(getSpirvPath(getUnit(filename))):
+            blobs[getFileHash(getSpirvPath(getUnit(filename)))] = getUnitName(getUnit(filename)) + ".spv"
+
+        for variant in sorted(variants):
+            unit = getUnit(filename, variant)
+            name = getUnitName(unit) + ".spv"
+
+            if not isBuilt(unit) or not os.path.exists(getSpirvPath(unit)):
+                # keep the last successful output, as for shaders without variants
+                if name in oldManifest and os.path.exists(SPIRV_FOLDER_PATH + oldManifest[name]):
+                    manifest[name] = oldManifest[name]
+                continue
+
+            with open(getSpirvPath(unit), "rb") as f:
+                data = f.read()
+            contentHash = hashlib.sha256(data).hexdigest()
+
+            if contentHash not in blobs:
+                blobPath = SPIRV_FOLDER_PATH + name
+                # don't touch the file if it's the same, so it's not reloaded
+                if not os.path.exists(blobPath) or getFileHash(blobPath) != contentHash:
+                    with open(blobPath, "wb") as f:
+                        f.write(data)
+                blobs[contentHash] = name
+
+            manifest[name] = blobs[contentHash]
+
+    # remove variant files that are not referenced anymore,
+    # files of shaders without defines are never removed
+    for blobName in set(oldManifest.values()) - set(manifest.values()):
+        if blobName in oldManifest and os.path.exists(SPIRV_FOLDER_PATH + blobName):
+            os.remove(SPIRV_FOLDER_PATH + blobName)
+
+    if manifest != oldManifest:
+        if len(manifest) > 0:
+            with open(SPIRV_FOLDER_PATH + PERMUTATION_MANIFEST_NAME, "w") as f:
+                for name, blobName in sorted(manifest.items()):
+                    f.write(name + " " + blobName + "\n")
+        elif os.path.exists(SPIRV_FOLDER_PATH + PERMUTATION_MANIFEST_NAME):
+            os.remove(SPIRV_FOLDER_PATH + PERMUTATION_MANIFEST_NAME)
+
+        distinctCount = len(set(manifest.values()))
+        if distinctCount < len(manifest):
+            print("> " + str(len(manifest)) + " shader variants share " + str(distinctCount) + " SPIR-V files")
+
+
+# Returns a dict: name of a module -> SPIR-V bytes, for all shader outputs.
+# Variants are under their own names, even if they share a file.
+def readShaderOutputs(state):
+    paths = {}
+    for unit in state.shaderUnits:
+        if getUnitVariant(unit) is None:
+            paths[getUnitName(unit) + ".spv"] = getSpirvPath(unit)
+    for name, blobName in readPermutationManifest().items():
+        paths[name] = SPIRV_FOLDER_PATH + blobName
+
+    blobs = {}
+    for name, path in paths.items():
+        try:
+            with open(path, "rb") as f:
+                blobs[name] = f.read()
+        except OSError:
+            # e.g. new shader failed to compile
+            pass
+    return blobs
+
+
+# Pack all shader outputs into one file, see ShaderArchive.py
+def writeShaderArchive(blobs):
+    try:
+        writtenCount = ShaderArchive.updateArchive(SPIRV_FOLDER_PATH + ARCHIVE_NAME, blobs)
+    except OSError:
+        print("> Couldn't write " + ARCHIVE_NAME)
+        return
+
+    if writtenCount > 0:
+        print("> Updated " + ARCHIVE_NAME + " (" + str(writtenCount) + " changed of " + str(len(blobs)) + " shaders)")
+
+
+# Returns (generation, dict: module name -> (generation it was changed in, SHA-256),
+# dict: removed module name -> generation it was removed in), generation is 0 if there's no manifest.
+def readReloadManifest():
+    generation = 0
+    modules = {}
+    removedModules = {}
+    try:
+        with open(SPIRV_FOLDER_PATH + RELOAD_MANIFEST_NAME, "r") as f:
+            for line in f:
+                words = line.split()
+                if len(words) == 2 and words[0] == "GENERATION" and words[1].isdigit():
+                    generation = int(words[1])
+                elif len(words) == 3 and words[0] == "REMOVED" and words[2].isdigit():
+                    removedModules[words[1]] = int(words[2])
+                elif len(words) == 3 and words[1].isdigit():
+                    modules[words[0]] = (int(words[1]), words[2])
+    except OSError:
+        pass
+    return generation, modules, removedModules
+
+
+# Write a manifest, so a running engine can reload only the modules that were changed:
+#   GENERATION 12
+#   CmSVGFAtrous.comp.spv 12 <SHA-256 of the module>
+#   RtRaygenPrimary.rgen.spv 3 <SHA-256 of the module>
+#   REMOVED RsOldPass.frag.spv 11
+# Generation is incremented by each build that changes, adds or removes any module, and each
+# module is listed with the generation it was changed in, and each removed one with the
+# generation it was removed in. So the modules changed since the previous generation are
+# the ones with the current generation, and an engine that loaded generation N needs to
+# reload only the modules with a generation greater than N, and drop the removed ones.
+def writeReloadManifest(blobs):
+    oldGeneration, oldModules, oldRemovedModules = readReloadManifest()
+    hashes = { name: hashlib.sha256(data).hexdigest() for name, data in blobs.items() }
+
+    changed = [ name for name, h in hashes.items() if name not in oldModules or oldModules[name][1] != h ]
+    removed = [ name for name in oldModules if name not in hashes ]
+    if len(changed) == 0 and len(removed) == 0 and os.path.exists(SPIRV_FOLDER_PATH + RELOAD_MANIFEST_NAME):
+        return
+
+    generation = oldGeneration + 1
+    lines = [ "GENERATION " + str(generation) ]
+    for name in sorted(hashes):
+        changedIn = generation if name in changed else oldModules[name][0]
+        lines.append(name + " " + str(changedIn) + " " + hashes[name])
+    # a module that is added again is listed as changed instead
+    removedModules = { name: g for name, g in oldRemovedModules.items() if name not in hashes }
+    removedModules.update({ name: generation for name in removed })
+    for name in sorted(removedModules):
+        lines.append("REMOVED " + name + " " + str(removedModules[name]))
+
+    # the engine could read it at any moment, so it's replaced at once
+    fd, tmpPath = tempfile.mkstemp(dir=SPIRV_FOLDER_PATH, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, SPIRV_FOLDER_PATH + RELOAD_MANIFEST_NAME)
+    except OSError:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        print("> Couldn't write " + RELOAD_MANIFEST_NAME)
+        return
+
+    if oldGeneration > 0:
+        message = str(len(changed)) + (" module changed" if len(changed) == 1 else " modules changed")
+        if len(removed) > 0:
+            message += ", " + str(len(removed)) + " removed"
+        print("> Reload generation " + str(generation) + ": " + message)
+
+
+# Reflect all modules, see ShaderReflection.py, and write their statistics with the
+# changes since the previous build. The changes are printed, so a shader that became
+# much heavier is noticed when it's changed. Also, bindings of the framebuffers are
+# checked against the ones that GenerateShaderCommon.py assigned.
+# Returns a list of Diagnostic.
+def writeShaderStats(blobs, options):
+    try:
+        with open(CACHE_FOLDER_PATH + STATS_FILE_NAME, "r") as f:
+            oldModules = json.load(f)["modules"]
+    except (OSError, ValueError, KeyError):
+        oldModules = None
+
+    # the same content is reflected once, e.g. for variants that share a file
+    reflected = {}
+    for name, stats in (oldModules or {}).items():
+        # statistics of older builds don't tell if bindings are used, so they're reflected again
+        if all("used" in b for b in stats.get("bindings", [])):
+            reflected[stats.get("sha256")] = stats
+
+    modules = {}
+    for name, data in sorted(blobs.items()):
+        contentHash = hashlib.sha256(data).hexdigest()
+        if contentHash not in reflected:
+            with PROFILER.measureShader("reflect", name):
+                stats = ShaderReflection.reflect(data)
+            if stats is None:
+                continue
+            stats["sha256"] = contentHash
+            reflected[contentHash] = stats
+        modules[name] = reflected[contentHash]
+
+    changes = {}
+    if oldModules is not None:
+        for name, stats in modules.items():
+            if name in oldModules and oldModules[name].get("sha256") != stats["sha256"]:
+                diff = ShaderReflection.getStatsDiff(oldModules[name], stats)
+                if len(diff) > 0:
+                    changes[name] = diff
+
+    try:
+        with open(CACHE_FOLDER_PATH + STATS_FILE_NAME, "w") as f:
+            json.dump({ "modules": modules, "changes": changes }, f, indent=1, sort_keys=True)
+    except OSError:
+        print("> Couldn't write " + STATS_FILE_NAME)
+
+    for name, diff in sorted(changes.items()):
+        desc = []
+        for metric, (old, new) in diff.items():
+            if metric == "bindings":
+                desc.append("bindings changed")
+            elif old is not None and old > 0:
+                desc.append("%s %d -> %d (%+d%%)" % (metric, old, new, round((new - old) * 100 / old)))
+            else:
+                desc.append("%s %s -> %d" % (metric, old, new))
+        print("> " + name + ": " + ", ".join(desc))
+
+    expectedBindings = ShaderReflection.readFramebufferBindings(GENERATED_GLSL_HEADER_PATH)
+    diagnostics = []
+    for name, stats in sorted(modules.items()):
+        for msg in ShaderReflection.checkFramebufferBindings(stats, expectedBindings):
+            diagnostics.append(Diagnostic(None, None, "warning", name + ": " + msg, name))
+    return diagnostics
+
+
+# Run spirv-opt on units that were compiled in this pass, or if the passes were changed.
+# Returns (count of optimized shaders, error count).
+def optimizeShaders(state, options, compiledUnits):
+    optimizerChanged = state.cachedOptimizerFingerprint != options.optimizerFingerprint
+
+    unitsToOptimize = []
+    for unit in sorted(state.shaderUnits):
+        if unit not in state.dependencyMap or unit in state.staleUnits:
+            continue
+        if not isTargeted(unit, options.targets):
+            # will be optimized, when it's targeted
+            if optimizerChanged:
+                state.optimizedKeys.pop(unit, None)
+            continue
+        if optimizerChanged or unit in compiledUnits or unit not in state.optimizedKeys:
+            unitsToOptimize.append(unit)
+
+    optimizedCount = 0
+    errorCount = 0
+    totalBefore = 0
+    totalAfter = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.jobCount) as executor:
+        futures = [
+            executor.submit(optimizeShader, unit, options, state.optimizedKeys.get(unit))
+            for unit in unitsToOptimize
+        ]
+
+        for unit, future in zip(unitsToOptimize, futures):
+            output, optimizedKey, wordCount = future.result()
+
+            if len(output) > 0:
+                print("> Optimizing " + getUnitName(unit))
+                diagnostics = parseDiagnostics(output, getUnitName(unit))
+                # spirv-opt fails on any message
+                printDiagnostics([ d._replace(severity="error") for d in diagnostics ], options)
+
+                errorCount += 1
+                # compile and optimize it again next time
+                state.staleUnits.add(unit)
+                state.optimizedKeys.pop(unit, None)
+                writeJournal(state, [ [ CACHE_RECORD_STALE, unit ] ])
+                continue
+
+            if state.optimizedKeys.get(unit) != optimizedKey:
+                state.optimizedKeys[unit] = optimizedKey
+                writeJournal(state, [ [ CACHE_RECORD_OPTIMIZED, unit, optimizedKey ] ])
+
+            if wordCount is not None:
+                before, after = wordCount
+                print("> Optimizing %s: %d -> %d words (%+.1f%%)" % (getUnitName(unit), before, after, 100.0 * (after - before) / max(before, 1)))
+                optimizedCount += 1
+                totalBefore += before
+                totalAfter += after
+
+    writeJournal(state, [ [ CACHE_RECORD_OPTIMIZER, options.optimizerFingerprint ] ])
+
+    if optimizedCount > 1:
+        print("> Optimized %d shaders: %d -> %d words (%+.1f%%)" % (optimizedCount, totalBefore, totalAfter, 100.0 * (totalAfter - totalBefore) / max(totalBefore, 1)))
+
+    return optimizedCount, errorCount
+
+
+# headerHash -- content hash of the generated GLSL header, as in BuildState.cache
+# symbols -- dict: symbol, e.g. "CONST:MAX_INSTANCE_COUNT" -> (fingerprint, list of its identifiers)
+SymbolManifest = collections.namedtuple("SymbolManifest", [ "headerHash", "layout", "symbols" ])
+
+
+# Read symbol fingerprints, written by GenerateShaderCommon.py with the GLSL header.
+# headerHash -- current content hash of the header
+# Returns SymbolManifest, or None if it's missing or was written for other header contents,
+# e.g. the header was edited manually.
+def readSymbolManifest(headerHash):
+    try:
+        with open(GENERATED_SYMBOLS_PATH, "r") as f:
+            lines = [ line.split() for line in f ]
+        with open(GENERATED_GLSL_HEADER_PATH, "r") as f:
+            headerText = f.read()
+    except OSError:
+        return None
+
+    if len(lines) < 2 or lines[0][:1] != [ "HEADER" ] or lines[1][:1] != [ "LAYOUT" ]:
+        return None
+    if lines[0][1:] != [ hashlib.sha256(headerText.encode()).hexdigest() ] or len(lines[1]) != 2:
+        return None
+
+    symbols = {}
+    for words in lines[2:]:
+        if len(words) < 4 or words[0] != "SYMBOL":
+            return None
+        symbols[words[1]] = (words[2], words[3:])
+    return SymbolManifest(headerHash, lines[1][1], symbols)
+
+
+# Find symbols of the generated GLSL header that were changed, added or removed since
+# the last build, so only shaders that reference them are rebuilt: e.g. changing a constant
+# or a framebuffer format doesn't rebuild every shader, that includes the header.
+# lastHeaderHash -- content hash of the header, before its modification was checked
+# Returns a dict: symbol -> set of identifiers, old and new ones;
+# or None, if the whole header must be treated as modified.
+def getChangedSymbols(state, lastHeaderHash):
+    headerPath = abspath(GENERATED_GLSL_HEADER_PATH)
+    lastManifest = state.symbolManifest
+    state.symbolManifest = readSymbolManifest(state.cache[headerPath][2]) if headerPath in state.cache else None
+
+    if lastManifest is None or state.symbolManifest is None:
+        return None
+    # e.g. the header was edited manually since the last build, or lines
+    # that don't belong to any symbol were changed
+    if lastManifest.headerHash != lastHeaderHash or lastManifest.layout != state.symbolManifest.layout:
+        return None
+
+    changedSymbols = {}
+    for name in set(lastManifest.symbols).union(state.symbolManifest.symbols):
+        last = lastManifest.symbols.get(name, (None, []))
+        current = state.symbolManifest.symbols.get(name, (None, []))
+        if last[0] != current[0]:
+            changedSymbols[name] = set(last[1]).union(current[1])
+    return changedSymbols
+
+
+PREPROCESSOR_CONDITION_PATTERN  = re.compile(r"^\s*#\s*(if|ifdef|ifndef|elif|else|endif)\b\s*(\w*)")
+PREPROCESSOR_DEFINE_PATTERN     = re.compile(r"^\s*#\s*define\s+(\w+)")
+
+
+# Read identifiers of a source file, grouped by "#ifdef" blocks they're in, as shared headers
+# declare e.g. descriptors in "#ifdef DESC_SET_..." blocks, that only some shaders enable.
+# Other conditions are unknown, so their blocks are treated as enabled, which is safe.
+# Returns (set of macros that are defined in the file, dict: frozenset of "#ifdef" macros -> set of identifiers),
+# or None if the file can't be read.
+def readConditionalTokens(filename):
+    try:
+        with open(filename, "r", errors="replace") as f:
+            text = f.read()
+    except OSError:
+        return None
+    text = re.sub(r"/\*.*?\*/", " ", text, flags=re.S)
+    text = re.sub(r"//[^\n]*", "", text).replace("\\\n", " ")
+
+    defined = set()
+    blocks = {}
+    # "#ifdef" macro of each nested block, None for other conditions
+    conditions = []
+    for line in text.splitlines():
+        m = PREPROCESSOR_CONDITION_PATTERN.match(line)
+        if m is not None:
+            directive = m.group(1)
+            if directive in ("elif", "else") and len(conditions) > 0:
+                conditions[-1] = None
+            elif directive == "endif" and len(conditions) > 0:
+                conditions.pop()
+        # e.g. identifiers in "#if" expressions are in the outer block
+        key = frozenset(c for c in conditions if c is not None)
+        blocks.setdefault(key, set()).update(re.findall(r"\w+", line))
+
+        if m is not None and m.group(1) in ("if", "ifdef", "ifndef"):
+            # e.g. "GL_EXT_..." macros are defined by "#extension"
+            isKnown = m.group(1) == "ifdef" and m.group(2) != "" and not m.group(2).startswith("GL_")
+            conditions.append(m.group(2) if isKnown else None)
+        m = PREPROCESSOR_DEFINE_PATTERN.match(line)
+        if m is not None:
+            defined.add(m.group(1))
+    return defined, blocks
+
+
+# Units that depend on the generated GLSL header, and reference its changed symbols:
+# in files they include, except the header itself, or in their defines. A reference
+# in an "#ifdef" block counts only if any file of the unit, or its defines, define
+# the macro, see readConditionalTokens. Identifiers are matched as tokens, so references
+# in disabled "#if" blocks rebuild a unit too, which is safe.
+# Returns a dict: unit -> sorted list of referenced changed symbols.
+def getUnitsReferencingSymbols(state, units, changedSymbols):
+    headerPath = abspath(GENERATED_GLSL_HEADER_PATH)
+
+    files = set().union(*(state.dependencyMap[unit] for unit in units))
+    tokens = mapFilesConcurrently(readConditionalTokens, files)
+
+    referencing = {}
+    for unit in units:
+        defineArgs = getUnitDefineArgs(unit)
+        unitTokens = set(re.findall(r"\w+", " ".join(defineArgs)))
+        # unreadable file, e.g. removed one, must be reported by glslc
+        if any(tokens[f] is None for f in state.dependencyMap[unit]):
+            unitTokens = None
+        else:
+            defined = { re.match(r"-D(\w+)", arg).group(1) for arg in defineArgs }
+            defined = defined.union(*(tokens[f][0] for f in state.dependencyMap[unit]))
+            for f in state.dependencyMap[unit] - { headerPath }:
+                for blockConditions, blockTokens in tokens[f][1].items():
+                    if blockConditions.issubset(defined):
+                        unitTokens |= blockTokens
+        names = sorted(name for name, identifiers in changedSymbols.items() if unitTokens is None or not identifiers.isdisjoint(unitTokens))
+        if len(names) > 0:
+            referencing[unit] = names
+    return referencing
+
+
+# Returns why a unit must be rebuilt, or None if it's up-to-date.
+# dirtyFiles -- result of propagateModification
+# isFullCheck -- False in watch mode, then stale units are rebuilt only when their files are changed
+# referencedSymbols -- result of getUnitsReferencingSymbols
+def getRebuildReason(state, options, unit, dirtyFiles, isFullCheck, referencedSymbols={}):
+    if unit not in state.dependencyMap:
+        return "new"
+    if isFullCheck and unit in state.staleUnits:
+        return "left outdated by an earlier build"
+    if state.cachedToolchainFingerprint != state.toolchainFingerprint:
+        return "glslc version or flags changed"
+
+    # spirv-opt needs glslc output, and optimized output
+    # must be replaced, when optimization is disabled
+    if options.optimizerArgs is not None and not os.path.exists(getUnoptimizedPath(unit)):
+        return "optimization was enabled"
+    if options.optimizerArgs is None and unit in state.optimizedKeys:
+        return "optimization was disabled"
+
+    if unit in dirtyFiles:
+        cause = dirtyFiles[unit]
+        if cause == getUnitSource(unit):
+            return "outdated"
+        reason = "header " + os.path.relpath(cause).replace('\\', '/') + " changed"
+        if unit in referencedSymbols:
+            reason += ": " + ", ".join(referencedSymbols[unit])
+        return reason
+
+    return None
+
+
+# "RtRaygen*" matches "RtRaygenPrimary.rgen", and a name without an extension, e.g. "CmFsrEasu",
+# matches all stages with that name. Variants are matched by their names, e.g. "CmSVGFAtrous_Box3".
+def isTargeted(unit, targets):
+    if len(targets) == 0:
+        return True
+    name = getUnitName(unit)
+    stem, _ = os.path.splitext(name)
+    return any(fnmatch.fnmatch(name, t) or fnmatch.fnmatch(stem, t) for t in targets)
+
+
+# Check files and find units that must be rebuilt. If changedFiles is None, all shaders
+# and their dependencies are checked; otherwise, only the given files (e.g. reported
+# by a file watcher) are checked, and the rest is assumed to be up-to-date.
+# fileIndex -- FileIndex of the dependency folders, if it was already scanned
+# assumedChanged -- files to treat as modified, to see what a change would cause
+# Returns (list of (unit, rebuild reason), modified files, checked files).
+def findShadersToBuild(state, options, changedFiles, fileIndex, assumedChanged=()):
+    if changedFiles is None:
+        if len(state.cache) > 0:
+            print("> Checking dependency files")
+
+        if fileIndex is None:
+            with PROFILER.measure("Scan folders", "scan"):
+                fileIndex = FileIndex(DEPENDENCY_FOLDERS, DEPENDENCY_FOLDERS_IGNORE)
+
+        state.shaderFiles = getShaderFiles(fileIndex)
+
+        # only files that were reported in depfiles by glslc are checked,
+        # new units don't have a depfile yet, but they are built anyway
+        dpdsToCheck = state.reverseDependencyMap.keys()
+    else:
+        for filename in changedFiles:
+            if isShaderFile(filename) and os.path.dirname(filename) == abspath("."):
+                if os.path.exists(filename):
+                    state.shaderFiles.add(filename)
                 else:
-                    print(r.stdout)
+                    state.shaderFiles.discard(filename)
+
+        dpdsToCheck = [ f for f in changedFiles if f in state.reverseDependencyMap ]
+        fileIndex = None
+
+    state.shaderUnits = getShaderUnits(state.shaderFiles)
+
+    if changedFiles is None:
+        for target in options.targets:
+            if not any(isTargeted(unit, [ target ]) for unit in state.shaderUnits):
+                print("> No shaders match \"" + target + "\"")
+
+    headerPath = abspath(GENERATED_GLSL_HEADER_PATH)
+    lastHeaderHash = state.cache[headerPath][2] if headerPath in state.cache else None
+
+    with PROFILER.measure("Check dependencies", "dependencies"):
+        modifiedFiles = checkDependencies(state, dpdsToCheck, fileIndex)
+        checkedFiles = set(dpdsToCheck)
+
+    changedSymbols = None
+    if headerPath in state.reverseDependencyMap and (headerPath in checkedFiles or state.symbolManifest is None):
+        changedSymbols = getChangedSymbols(state, lastHeaderHash)
+
+    # if only some symbols of the generated header were changed, its dependents
+    # are rebuilt only if they reference them, see getChangedSymbols
+    filteredFiles = { headerPath } if changedSymbols is not None and headerPath in modifiedFiles and headerPath not in assumedChanged else set()
+    with PROFILER.measure("Propagate modifications", "dependencies"):
+        dirtyFiles = propagateModification(state.reverseDependencyMap, modifiedFiles.union(assumedChanged) - filteredFiles)
+
+    referencedSymbols = {}
+    if len(filteredFiles) > 0:
+        with PROFILER.measure("Check changed symbols", "dependencies"):
+            candidates = [ unit for unit in state.reverseDependencyMap[headerPath] if unit not in dirtyFiles and unit in state.shaderUnits ]
+            referencedSymbols = getUnitsReferencingSymbols(state, candidates, changedSymbols)
+        for unit in referencedSymbols:
+            dirtyFiles[unit] = headerPath
+        PROFILER.count("shadersSkippedBySymbols", len(candidates) - len(referencedSymbols))
+
+    shadersToBuild = []
+    for unit in sorted(state.shaderUnits):
+        reason = getRebuildReason(state, options, unit, dirtyFiles, changedFiles is None, referencedSymbols)
+        if reason is not None:
+            shadersToBuild.append((unit, reason))
+
+    return shadersToBuild, modifiedFiles, checkedFiles
+
+
+# Print which shaders would be rebuilt and why, without building them.
+def printRebuildPlan(state, options, fileIndex, assumedChanged):
+    outdated, _, _ = findShadersToBuild(state, options, None, fileIndex, assumedChanged)
+    outdated = [ (unit, reason) for unit, reason in outdated if isTargeted(unit, options.targets) ]
+
+    for unit, reason in outdated:
+        print("> " + getUnitName(unit) + ": " + reason)
+
+    targetCount = sum(1 for unit in state.shaderUnits if isTargeted(unit, options.targets))
+    print("> " + str(len(outdated)) + " of " + str(targetCount) + " shaders would be rebuilt")
+
+
+# e.g. '#include "RaygenCommon.h"'
+INCLUDE_PATTERN             = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+
+# Returns a dict: file -> set of files it includes directly. Dependency maps are taken
+# from depfiles, so they're already transitive, and the direct includes are parsed from
+# the sources, only to show the structure; includes under "#if" are taken too.
+def getDirectIncludes(files):
+    def readIncludedNames(f):
+        try:
+            with open(f, "r", errors="replace") as source:
+                return INCLUDE_PATTERN.findall(source.read())
+        except OSError:
+            return []
+
+    includes = {}
+    for f, names in mapFilesConcurrently(readIncludedNames, files).items():
+        includes[f] = set()
+        for name in names:
+            # the same order as glslc: folder of the including file, then "-I" folders
+            for folder in [ os.path.dirname(f) ] + sorted(abspath(p) for p in DEPENDENCY_FOLDERS if p != ""):
+                candidate = abspath(os.path.join(folder, name))
+                if candidate in files:
+                    includes[f].add(candidate)
+                    break
+    return includes
+
 
-                msgErrorCount += 1
-                if filename in cache:
-                    del cache[filename]
+# Returns (dict: header -> set of units that depend on it, dict: unit -> expected glslc seconds),
+# for targeted units that were built at least once
+def getIncludeFanOut(state, options):
+    units = [ unit for unit in state.shaderUnits if unit in state.dependencyMap and isTargeted(unit, options.targets) ]
+    sources = { getUnitSource(unit) for unit in units }
+
+    fanOut = {}
+    for unit in units:
+        for f in state.dependencyMap[unit]:
+            if f not in sources:
+                fanOut.setdefault(f, set()).add(unit)
+    return fanOut, getExpectedDurations(state, units)
+
+
+# For each header, print how many shaders a change in it rebuilds, and their glslc time.
+# Headers that cost the most are the first candidates to be split.
+def printIncludeCosts(state, options):
+    fanOut, durations = getIncludeFanOut(state, options)
+    if len(durations) == 0:
+        print("> No dependency information, build the shaders first")
+        return
+
+    totalSeconds = sum(durations.values())
+    unknownCount = sum(1 for unit in durations if unit not in state.compileHistory)
+    costs = sorted(((sum(durations[u] for u in units), len(units), f) for f, units in fanOut.items()), key=lambda c: (-c[0], -c[1], c[2]))
+
+    print("%-48s %8s %10s %7s" % ("Header", "Shaders", "Seconds", "Share"))
+    for seconds, count, f in costs:
+        print("%-48s %8d %10.2f %6.0f%%" % (os.path.relpath(f), count, seconds, seconds * 100 / totalSeconds))
+    print("> A full build of " + str(len(durations)) + " shaders takes %.2fs of glslc time" % totalSeconds)
+    if unknownCount > 0:
+        print("> " + str(unknownCount) + " shaders have no recorded compile time, their time is estimated from the size")
+
+
+# Write the include graph with compile costs: ".dot" for Graphviz, or ".json".
+# Edges are direct includes, the costs are of all shaders that depend on a file.
+def writeIncludeGraph(state, options, path):
+    fanOut, durations = getIncludeFanOut(state, options)
+    sources = {}
+    for unit in durations:
+        sources.setdefault(getUnitSource(unit), set()).add(unit)
+
+    files = { f: units for f, units in fanOut.items() }
+    files.update(sources)
+    includes = getDirectIncludes(set(files))
+    totalSeconds = max(sum(durations.values()), 0.0001)
+
+    nodes = {}
+    for f, units in files.items():
+        nodes[os.path.relpath(f).replace("\\", "/")] = {
+            "isShader": f in sources,
+            "shaders": sorted(getUnitName(u) for u in units),
+            "seconds": round(sum(durations[u] for u in units), 3),
+            "includes": sorted(os.path.relpath(i).replace("\\", "/") for i in includes[f]),
+        }
+
+    try:
+        with open(path, "w") as out:
+            if path.endswith(".json"):
+                json.dump({ "totalSeconds": round(totalSeconds, 3), "files": nodes }, out, indent=1, sort_keys=True)
             else:
-                cache[filename] = lastModifTime
+                out.write("digraph includes {\n")
+                out.write("    rankdir=LR;\n")
+                out.write("    node [style=filled, fontname=\"sans-serif\"];\n")
+                for name, node in sorted(nodes.items()):
+                    # the more time a change of the file costs, the redder it is
+                    share = node["seconds"] / totalSeconds
+                    label = "%s\\n%d shaders, %.2fs" % (name, len(node["shaders"]), node["seconds"])
+                    out.write("    \"%s\" [label=\"%s\", shape=%s, fillcolor=\"0.0 %.3f 1.0\"];\n"
+                              % (name, label, "box" if node["isShader"] else "ellipse", share))
+                for name, node in sorted(nodes.items()):
+                    for included in node["includes"]:
+                        out.write("    \"%s\" -> \"%s\";\n" % (name, included))
+                out.write("}\n")
+    except OSError:
+        print("> Couldn't write \"" + path + "\"")
+        return
+
+    print("> Include graph of " + str(len(nodes)) + " files is written to \"" + path + "\"")
+
+
+# reports -- dict: unit -> (messages, list of Diagnostic)
+def printCompileReports(reports, options):
+    for unit in sorted(reports, key=getUnitName):
+        messages, diagnostics = reports[unit]
+        print(messages[0])
+        printDiagnostics(diagnostics, options)
+        for message in messages[1:]:
+            print(message)
+
 
-            msgWasAnyShaderRebuilt = True
+# One incremental build pass, see findShadersToBuild for the arguments.
+# Returns (was any shader rebuilt, error count).
+def buildShaders(state, options, changedFiles=None, fileIndex=None):
+    outdated, modifiedFiles, checkedFiles = findShadersToBuild(state, options, changedFiles, fileIndex)
 
-    with open(CACHE_FOLDER_PATH + CACHE_FILE_NAME, "w") as cacheFile:
-        for name, tm in cache.items():
-            cacheFile.write(name + " " + str(tm) + "\n")
-        cacheFile.write(CACHE_FILE_DEPENDENCY_MAP_SEPARATOR_LINE)
-        for name, arr in dependencyMap.items():
-            arrStr = " ".join(arr)
-            cacheFile.write(name + " " + arrStr + "\n")
+    shadersToBuild = []
+    skippedUnits = []
+    for unit, reason in outdated:
+        if isTargeted(unit, options.targets):
+            shadersToBuild.append(unit)
+            PROFILER.setShaderInfo(getUnitName(unit), reason=reason)
+        else:
+            skippedUnits.append(unit)
+
+    PROFILER.count("shadersUpToDate", len(state.shaderUnits) - len(outdated))
+
+    # units must be marked as stale before new hashes of modified files are
+    # saved, otherwise an interrupted build would consider them up-to-date;
+    # outdated units that are not targeted stay stale until they're built
+    writeJournal(state,
+        [ [ CACHE_RECORD_STALE, unit ] for unit, _ in outdated ] +
+        [ [ CACHE_RECORD_TOOLCHAIN, state.toolchainFingerprint ] ] +
+        (getCacheRecordsSymbols(state) if abspath(GENERATED_GLSL_HEADER_PATH) in modifiedFiles else []) +
+        [ getCacheRecordFile(f, state.cache[f]) for f in sorted(modifiedFiles) if f in state.cache ])
+
+    for unit in skippedUnits:
+        state.dependencyMap.setdefault(unit, { getUnitSource(unit) })
+        state.staleUnits.add(unit)
+        state.preprocessedKeys.pop(unit, None)
+    if len(skippedUnits) > 0:
+        print("> " + str(len(skippedUnits)) + (" shader is" if len(skippedUnits) == 1 else " shaders are") + " outdated, but not targeted")
+
+    errorCount = 0
+    artifactHitCount = 0
+    unchangedCount = 0
+    compiledUnits = set()
+
+    # glslc invocations run concurrently, but results are processed
+    # in the same order as batches were queued to keep the output stable
+    # with remote workers, threads also wait for them, and local glslc processes are limited by the pool
+    threadCount = options.jobCount + (options.workerPool.getRemoteCapacity() if options.workerPool is not None else 0)
+
+    with PROFILER.measure("Compile", "build"), concurrent.futures.ThreadPoolExecutor(max_workers=threadCount) as executor:
+        expectedDurations = getExpectedDurations(state, shadersToBuild)
+        batches = getCompileBatches(state, shadersToBuild, options, expectedDurations)
+        futures = [
+            executor.submit(runCompileJob, batch, options, state.toolchainFingerprint,
+                            { unit: state.preprocessedKeys.get(unit) for unit in batch })
+            for batch in batches
+        ]
+        jobs = []
+        # unit -> (messages, list of Diagnostic); batches are scheduled by expected
+        # duration that changes from build to build, so results are printed by name
+        reports = {}
+
+        for batch, future in zip(batches, futures):
+            try:
+                results, threadId, start, end = future.result()
+            except KeyboardInterrupt:
+                # don't start queued glslc processes, finished ones are in the journal
+                for f in futures:
+                    f.cancel()
+                printCompileReports(reports, options)
+                raise
+            jobs.append((batch, threadId, start, end))
+
+            for unit, (diagnostics, status, preprocessedKey, seconds) in zip(batch, results):
+                failed = hasErrors(diagnostics)
+                if seconds is not None:
+                    state.compileHistory[unit] = (seconds, failed)
+
+                statusName = "failed" if failed else COMPILE_STATUS_NAMES[status]
+                PROFILER.setShaderInfo(getUnitName(unit), status=statusName)
+                PROFILER.count("shaders" + statusName[0].upper() + statusName[1:])
+
+                if status == COMPILE_STATUS_UNCHANGED:
+                    message = "> Skipping " + getUnitName(unit) + " (preprocessed source is unchanged)"
+                    unchangedCount += 1
+                elif status == COMPILE_STATUS_FROM_ARTIFACT_STORE:
+                    message = "> Building " + getUnitName(unit) + " (from artifact store)"
+                    artifactHitCount += 1
+                else:
+                    message = "> Building " + getUnitName(unit)
+                reports[unit] = ([ message ], diagnostics)
+
+                if failed:
+                    errorCount += 1
+                    state.staleUnits.add(unit)
+                    state.dependencyMap.setdefault(unit, { getUnitSource(unit) })
+                    state.preprocessedKeys.pop(unit, None)
+                    writeJournal(state, [ getCacheRecordCompile(state, unit) ])
+                else:
+                    if preprocessedKey is not None:
+                        state.preprocessedKeys[unit] = preprocessedKey
+                    else:
+                        state.preprocessedKeys.pop(unit, None)
 
-    #if wereDependentModified:
-    #    print()
+                    compiledUnits.add(unit)
+                    if options.optimizerArgs is None:
+                        state.optimizedKeys.pop(unit, None)
 
-    msg = ""
-    color = ""
+                    try:
+                        with PROFILER.measure("Parse depfiles", "dependencies"):
+                            state.dependencyMap[unit] = parseDepfile(unit)
+                        state.staleUnits.discard(unit)
 
-    if msgErrorCount > 0:
-        msg = "> " + str(msgErrorCount) + (" shader build failed." if msgErrorCount == 1 else " shader builds failed.")
+                        # start tracking newly included files, and refresh the ones that
+                        # weren't checked, e.g. if the unit is new or it failed last time
+                        records = []
+                        for dpd in sorted(state.dependencyMap[unit] - checkedFiles):
+                            st = getStat(dpd)
+                            if st is not None:
+                                state.cache[dpd] = getCacheEntry(dpd, state.cache, st)
+                                checkedFiles.add(dpd)
+                                records.append(getCacheRecordFile(dpd, state.cache[dpd]))
+
+                        records.append(getCacheRecordUnit(state, unit))
+                        if unit in state.compileHistory:
+                            records.append(getCacheRecordCompile(state, unit))
+                        writeJournal(state, records)
+                    except (OSError, ValueError):
+                        # without dependencies, staleness can't be checked, so build it again next time
+                        reports[unit][0].append("> Couldn't read depfile of " + getUnitName(unit))
+                        state.staleUnits.add(unit)
+                        state.dependencyMap.setdefault(unit, { getUnitSource(unit) })
+
+    printCompileReports(reports, options)
+    PROFILER.criticalPath = getCriticalPath(jobs)
+    if options.jobCount > 1 and len(jobs) > 1:
+        printCriticalPath(PROFILER.criticalPath)
+
+    if options.artifactStore is not None and len(shadersToBuild) > 0:
+        print("> " + str(artifactHitCount) + " of " + str(len(shadersToBuild)) + " shaders were taken from artifact store")
+
+    optimizedCount = 0
+    if options.optimizerArgs is not None:
+        with PROFILER.measure("Optimize", "build"):
+            optimizedCount, optimizationErrorCount = optimizeShaders(state, options, compiledUnits)
+        errorCount += optimizationErrorCount
+    state.cachedOptimizerFingerprint = options.optimizerFingerprint
+
+    state.cachedToolchainFingerprint = state.toolchainFingerprint
+    # saveCache forgets them, but their modules must be removed from the outputs
+    removedCount = sum(1 for unit in state.dependencyMap if unit not in state.shaderUnits)
+    with PROFILER.measure("Save cache", "cache"):
+        saveCache(state)
+    state.reverseDependencyMap = getReverseDependencyMap(state.dependencyMap)
+
+    if len(PERMUTATIONS) > 0 or os.path.exists(SPIRV_FOLDER_PATH + PERMUTATION_MANIFEST_NAME):
+        with PROFILER.measure("Write permutations", "output"):
+            writePermutationOutputs(state)
+
+    # outputs are changed only by builds and removed shaders, so they're not even read otherwise
+    if len(shadersToBuild) > 0 or optimizedCount > 0 or removedCount > 0 or \
+            not os.path.exists(SPIRV_FOLDER_PATH + ARCHIVE_NAME) or not os.path.exists(SPIRV_FOLDER_PATH + RELOAD_MANIFEST_NAME) or \
+            not os.path.exists(CACHE_FOLDER_PATH + STATS_FILE_NAME):
+        blobs = readShaderOutputs(state)
+        with PROFILER.measure("Write archive", "output"):
+            writeShaderArchive(blobs)
+        with PROFILER.measure("Write reload manifest", "output"):
+            writeReloadManifest(blobs)
+        with PROFILER.measure("Reflect", "output"):
+            printDiagnostics(writeShaderStats(blobs, options), options)
+
+    return len(shadersToBuild) > unchangedCount or optimizedCount > 0, errorCount
+
+
+def printSummary(wasAnyShaderRebuilt, errorCount, coloredOutput):
+    if errorCount > 0:
+        msg = "> " + str(errorCount) + (" shader build failed." if errorCount == 1 else " shader builds failed.")
         color = "DarkRed"
-    elif not msgWasAnyShaderRebuilt:
+    elif not wasAnyShaderRebuilt:
         msg = "> Everything is up-to-date."
         color = "Green"
     else:
         msg = "> Done."
         color = "Green"
 
-    if powerShellOutput:
-        printInPowerShell(msg, color)
-    else:
-        print(msg)
+    printMessage(msg, color, coloredOutput)
+
+
+# --------------------------------------------------------------------------------------------- #
+# Watch mode
+# --------------------------------------------------------------------------------------------- #
+
+WATCH_POLL_INTERVAL = 0.25  # in seconds
+WATCH_SETTLE_TIME   = 0.05  # editors can save a file in several steps, wait for them to finish
+
+
+# Uses Linux inotify through libc, so no additional packages are required
+class InotifyWatcher:
+    IN_CLOSE_WRITE  = 0x00000008
+    IN_MOVED_FROM   = 0x00000040
+    IN_MOVED_TO     = 0x00000080
+    IN_CREATE       = 0x00000100
+    IN_DELETE       = 0x00000200
+    EVENT_HEADER    = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+
+    def addFolders(self, folders):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        watched = set(self.folders.values())
+        for folder in folders:
+            if folder in watched or not os.path.isdir(folder):
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, folder.encode(), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for \"" + folder + "\"")
+            self.folders[wd] = folder
+
+    # Blocks until some files were changed, returns their absolute paths
+    def wait(self):
+        changed = set()
+        timeout = None
+        while select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, _, _, nameLength = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + nameLength].rstrip(b"\0").decode()
+                offset += nameLength
+                if wd in self.folders and name != "":
+                    changed.add(abspath(os.path.join(self.folders[wd], name)))
+            timeout = WATCH_SETTLE_TIME
+        return changed
+
+
+# Fallback for systems without inotify: compares (st_mtime_ns, st_size)
+# of all files in the watched folders periodically
+class PollingWatcher:
+    def __init__(self):
+        self.folders = set()
+        self.snapshot = {}
+
+    def addFolders(self, folders):
+        newFolders = set(folders) - self.folders
+        self.folders.update(newFolders)
+        self.snapshot.update(self.scan(newFolders))
+
+    @staticmethod
+    def scan(folders):
+        snapshot = {}
+        for folder in folders:
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            st = entry.stat()
+                            snapshot[abspath(entry.path)] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        return snapshot
+
+    def wait(self):
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            snapshot = self.scan(self.folders)
+            changed = { f for f in snapshot.keys() | self.snapshot.keys() if snapshot.get(f) != self.snapshot.get(f) }
+            self.snapshot = snapshot
+            if len(changed) > 0:
+                time.sleep(WATCH_SETTLE_TIME)
+                self.snapshot = self.scan(self.folders)
+                return changed
+
+
+def createWatcher():
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            print("> inotify is not available, falling back to polling")
+    return PollingWatcher()
+
+
+def getWatchedFolders(state):
+    folders = { abspath(f if f != "" else ".") for f in DEPENDENCY_FOLDERS }
+    folders.update(os.path.dirname(dpd) for dpd in state.reverseDependencyMap)
+    return folders
+
+
+# Stay resident and rebuild only shaders affected by saved files.
+# Dependency graph and cache are kept in memory between the builds.
+def watchShaders(state, options):
+    watcher = createWatcher()
+    watcher.addFolders(getWatchedFolders(state))
+
+    print("> Watching for changes. Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            changed = watcher.wait()
+            relevant = { f for f in changed if isShaderFile(f) or f in state.reverseDependencyMap }
+            if len(relevant) == 0:
+                continue
+
+            resetProfiler()
+            startTime = time.perf_counter()
+            wasAnyShaderRebuilt, errorCount = buildShaders(state, options, relevant)
+            if wasAnyShaderRebuilt:
+                printSummary(wasAnyShaderRebuilt, errorCount, options.coloredOutput)
+                print("> Rebuilt in %.2f s" % (time.perf_counter() - startTime))
+                writeBuildTimings(options)
+
+            watcher.addFolders(getWatchedFolders(state))
+    except KeyboardInterrupt:
+        print("> Stopped watching.")
+
+
+def main():
+    if "--help" in sys.argv or "-help" in sys.argv or "-h" in sys.argv or "--h" in sys.argv:
+        print("-rebuild  : clear cache and rebuild all shaders")
+        print("-gencomm  : invoke GenerateShaderCommon.py script")
+        print("-color    : colored output, with ANSI escape codes")
+        print("-json     : print each glslc error and warning as a JSON object on its own line of stdout,")
+        print("            with \"file\", \"line\", \"severity\", \"message\" and \"shader\"; other output goes to stderr")
+        print("-j N      : run N glslc processes concurrently, default is the CPU count")
+        print("-watch    : after the build, stay resident and rebuild shaders on file changes")
+        print("-batch N  : compile up to N shaders with the same defines by one glslc process, default is " + str(COMPILE_BATCH_MAX_SIZE) + ";")
+        print("            1 starts a glslc process for each shader")
+        print("-workers <URL,URL,...>")
+        print("          : send preprocessed shaders to remote compile workers, see ShaderCompileWorker.py;")
+        print("            shaders are compiled locally, if all workers are busy or unreachable")
+        print("-failed-first")
+        print("          : compile shaders that failed last time before others, to see their errors sooner")
+        print("-ppcheck  : preprocess stale shaders first, and don't compile them if preprocessed")
+        print("            source is the same as in the last build, e.g. only comments were changed")
+        print("-artifacts <folder or URL>")
+        print("          : look up compiled SPIR-V in a shared content-addressed store before invoking glslc")
+        print("-artifacts-size MB")
+        print("          : size limit of a folder artifact store, least recently used are removed")
+        print("-opt <passes>")
+        print("          : run spirv-opt after glslc; \"O\" optimizes for performance, \"Os\" for size,")
+        print("            any other value is passed to spirv-opt as a list of arguments")
+        print("-strip    : strip debug info with spirv-opt, e.g. for release builds")
+        print("-report <file>")
+        print("          : write timings of build phases and shaders, cache counters and rebuild reasons to a JSON file")
+        print("-trace <file>")
+        print("          : write timings as a Chrome trace, to open in about:tracing")
+        print("-dry-run  : print which shaders would be rebuilt and the file that triggers each, don't build")
+        print("-assume-changed <file>")
+        print("          : with \"-dry-run\", treat the file as modified, e.g. to see what a header change costs")
+        print("-include-costs")
+        print("          : for each header, print how many shaders its change rebuilds and their compile time, don't build")
+        print("-include-graph <file>")
+        print("          : write the include graph with compile costs, as Graphviz \".dot\" or \".json\", don't build")
+        print("<pattern> : build only shaders that match, e.g. \"RtRaygen*\" or \"CmFsr*\"; other outdated")
+        print("            shaders stay outdated until they're built")
+        print("-r        : same as \"-rebuild\"")
+        print("-g        : same as \"-gencomm\"")
+        print("-psout    : same as \"-color\"")
+        print("-ps       : same as \"-color\"")
+        print("-w        : same as \"-watch\"")
+        print("-why      : same as \"-dry-run\"")
+        return
+
+    forceRebuild = False
+    watch = False
+    options = BuildOptions()
+    if "-json" in sys.argv or "--json" in sys.argv:
+        # stdout is only for diagnostics, so it can be parsed by IDE or CI
+        options.jsonOutput = sys.stdout
+        sys.stdout = sys.stderr
+    if "-rebuild" in sys.argv or "--rebuild" in sys.argv or "-r" in sys.argv or "--r" in sys.argv:
+        forceRebuild = True
+    if "-gencomm" in sys.argv or "--gencomm" in sys.argv or "-g" in sys.argv or "--g" in sys.argv:
+        subprocess.run(["python", "../Generated/GenerateShaderCommon.py", "--path", "../Generated/"], stdout=sys.stdout)
+    if "-color" in sys.argv or "--color" in sys.argv or "-psout" in sys.argv or "--psout" in sys.argv or "-ps" in sys.argv or "--ps" in sys.argv:
+        options.coloredOutput = True
+        enableAnsiColors()
+    if "-watch" in sys.argv or "--watch" in sys.argv or "-w" in sys.argv or "--w" in sys.argv:
+        watch = True
+    #elif len(sys.argv) > 1:
+    #    print("> Couldn't parse arguments")
+    #    return
+    if "-ppcheck" in sys.argv or "--ppcheck" in sys.argv:
+        options.checkPreprocessed = True
+    if "-failed-first" in sys.argv or "--failed-first" in sys.argv:
+        options.failedFirst = True
+    options.jobCount = getJobCount()
+
+    artifactStoreLocation = getArgValue(("-artifacts", "--artifacts"))
+    if artifactStoreLocation is not None:
+        artifactStoreSize = getArgValue(("-artifacts-size", "--artifacts-size"))
+        if artifactStoreSize is not None and not artifactStoreSize.isdigit():
+            print("> \"-artifacts-size\" expects a size in megabytes")
+            return
+        options.artifactStore = ShaderArtifactCache.createArtifactStore(artifactStoreLocation,
+            int(artifactStoreSize) if artifactStoreSize is not None else ShaderArtifactCache.DEFAULT_MAX_SIZE_MB)
+
+    optimizationPasses = getArgValue(("-opt", "--opt"))
+    if optimizationPasses is not None:
+        options.optimizerArgs = OPTIMIZATION_PRESETS.get(optimizationPasses, optimizationPasses.split())
+    if "-strip" in sys.argv or "--strip" in sys.argv:
+        options.optimizerArgs = (options.optimizerArgs or []) + [ "--strip-debug" ]
+    if options.optimizerArgs is not None:
+        options.optimizerFingerprint = getOptimizerFingerprint(options.optimizerArgs)
+        if options.optimizerFingerprint is None:
+            print("> Couldn't run spirv-opt, check that it's in PATH")
+            return
+
+    options.reportPath = getArgValue(("-report", "--report"))
+    options.tracePath = getArgValue(("-trace", "--trace"))
+    options.targets = getPositionalArgs()
+
+    batchSize = getArgValue(("-batch", "--batch"))
+    if batchSize is not None:
+        if not batchSize.isdigit() or int(batchSize) < 1:
+            print("> \"-batch\" expects a positive number of shaders")
+            return
+        options.batchSize = int(batchSize)
+
+    workerUrls = getArgValue(("-workers", "--workers"))
+    if workerUrls is not None:
+        with PROFILER.measure("Connect to workers", "setup"):
+            options.workerPool = ShaderCompileWorker.WorkerPool([ u for u in workerUrls.split(",") if u != "" ], options.jobCount)
+        if options.workerPool.getRemoteCapacity() == 0:
+            print("> No compile workers are available, compiling locally")
+            options.workerPool = None
+        else:
+            # each shader is dispatched separately, as a worker gets one preprocessed source
+            options.batchSize = 1
+
+    dryRun = "-dry-run" in sys.argv or "--dry-run" in sys.argv or "-why" in sys.argv or "--why" in sys.argv
+    assumedChanged = { abspath(f) for f in getArgValues(("-assume-changed", "--assume-changed")) }
+    for f in sorted(assumedChanged):
+        if not os.path.isfile(f):
+            print("> \"" + os.path.relpath(f) + "\" doesn't exist")
+            return
+    if len(assumedChanged) > 0 and not dryRun:
+        print("> \"-assume-changed\" can be used only with \"-dry-run\"")
+        return
+
+    includeCosts = "-include-costs" in sys.argv or "--include-costs" in sys.argv
+    includeGraphPath = getArgValue(("-include-graph", "--include-graph"))
+    if includeGraphPath is not None and not (includeGraphPath.endswith(".dot") or includeGraphPath.endswith(".json")):
+        print("> \"-include-graph\" expects a \".dot\" or \".json\" file")
+        return
+
+    # the same scan is used to find shader files and to check dependencies
+    with PROFILER.measure("Scan folders", "scan"):
+        fileIndex = FileIndex(DEPENDENCY_FOLDERS, DEPENDENCY_FOLDERS_IGNORE)
+    fillDependencyFolders(fileIndex)
+
+    # these modes only read the cache
+    readOnly = dryRun or includeCosts or includeGraphPath is not None
+
+    if not readOnly and not all(os.path.exists(f) for f in (DEPFILE_FOLDER_PATH, VARIANT_FOLDER_PATH, UNOPTIMIZED_FOLDER_PATH)):
+        try:
+            os.makedirs(DEPFILE_FOLDER_PATH, exist_ok=True)
+            os.makedirs(VARIANT_FOLDER_PATH, exist_ok=True)
+            os.makedirs(UNOPTIMIZED_FOLDER_PATH, exist_ok=True)
+        except OSError:
+            print("> Coudn't create cache folder")
+            return
+
+    if not readOnly and not os.path.exists(CACHE_FOLDER_PATH + CACHE_FILE_NAME):
+        try:
+            with open(CACHE_FOLDER_PATH + CACHE_FILE_NAME, "w"): pass
+        except OSError:
+            print("> Coudn't create cache file")
+            return
+
+    with PROFILER.measure("Toolchain fingerprint", "setup"):
+        state = BuildState(getToolchainFingerprint())
+    with PROFILER.measure("Load cache", "cache"):
+        loadCache(state, forceRebuild, readOnly)
+
+    if dryRun:
+        printRebuildPlan(state, options, fileIndex, assumedChanged)
+        return
+
+    if includeCosts or includeGraphPath is not None:
+        # dependencies of the last build are used as they are, nothing is checked
+        state.shaderFiles = getShaderFiles(fileIndex)
+        state.shaderUnits = getShaderUnits(state.shaderFiles)
+        if includeCosts:
+            printIncludeCosts(state, options)
+        if includeGraphPath is not None:
+            writeIncludeGraph(state, options, includeGraphPath)
+        return
+
+    if state.cachedToolchainFingerprint not in (None, state.toolchainFingerprint):
+        print("> glslc version or flags were changed. Rebuilding all...")
+
+    try:
+        wasAnyShaderRebuilt, errorCount = buildShaders(state, options, fileIndex=fileIndex)
+    except KeyboardInterrupt:
+        # if nothing was journaled yet, there's nothing to continue from
+        if state.journalFile is not None:
+            print("> Interrupted. Built shaders are saved, the next build continues from there.")
+        else:
+            print("> Interrupted.")
+        return
+    printSummary(wasAnyShaderRebuilt, errorCount, options.coloredOutput)
+    writeBuildTimings(options)
+
+    if watch:
+        watchShaders(state, options)
 
 
 # main
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
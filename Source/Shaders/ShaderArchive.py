@@ -0,0 +1,196 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Packs all compiled shaders into one file, so the engine can open and
+# map one file instead of each "*.spv" separately. Used by GenerateShaders.py.
+# To print the contents of an archive:
+#   ShaderArchive.py <archive>
+#
+# Layout, all values are little-endian uint32:
+#   header      : magic "RSPA", version, entry count, index offset, names offset, names size, 8 reserved bytes
+#   blobs       : SPIR-V modules, each starts at a 4-byte aligned offset
+#   names       : zero-terminated UTF-8 file names, e.g. "CmComposition.comp.spv"
+#   index       : entries sorted by name (byte-wise, as strcmp), each entry is
+#                 name offset (relative to names), name length, blob offset, blob size in bytes, SHA-256 of the blob
+#
+# Entries with the same content share one blob. If only some shaders were
+# changed, the archive is updated in place: new blobs, names and index are
+# appended, and the header is overwritten last, so the previous version is
+# still valid until then. Unreferenced blobs are dropped, when the archive
+# is rewritten from scratch, after it grows twice as large as its content.
+
+import sys
+import os
+import struct
+import hashlib
+import tempfile
+
+
+ARCHIVE_MAGIC               = b"RSPA"
+ARCHIVE_VERSION             = 1
+ALIGNMENT                   = 4
+HEADER                      = struct.Struct("<4sIIIII8x")
+INDEX_ENTRY                 = struct.Struct("<IIII32s")
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Returns a dict: name -> (blob offset, blob size, SHA-256 digest), or None if the archive is missing or invalid
+def readIndex(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version, entryCount, indexOffset, namesOffset, namesSize = HEADER.unpack_from(data)
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        return None
+    if indexOffset + entryCount * INDEX_ENTRY.size > len(data) or namesOffset + namesSize > len(data):
+        return None
+
+    index = {}
+    for i in range(entryCount):
+        nameOffset, nameLength, offset, size, digest = INDEX_ENTRY.unpack_from(data, indexOffset + i * INDEX_ENTRY.size)
+        if nameOffset + nameLength > namesSize or offset + size > len(data):
+            return None
+        name = data[namesOffset + nameOffset:namesOffset + nameOffset + nameLength].decode()
+        index[name] = (offset, size, digest)
+    return index
+
+
+# Write names and index, starting at the current position of f.
+# Returns the header that references them.
+def writeIndex(f, entries):
+    names = bytearray()
+    indexEntries = []
+    for name, (offset, size, digest) in sorted(entries.items(), key=lambda e: e[0].encode()):
+        encoded = name.encode()
+        indexEntries.append(INDEX_ENTRY.pack(len(names), len(encoded), offset, size, digest))
+        names += encoded + b"\0"
+    names += b"\0" * (align(len(names)) - len(names))
+
+    namesOffset = f.tell()
+    f.write(names)
+    indexOffset = f.tell()
+    f.write(b"".join(indexEntries))
+
+    return HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(entries), indexOffset, namesOffset, len(names))
+
+
+def writeBlob(f, data):
+    f.write(b"\0" * (align(f.tell()) - f.tell()))
+    offset = f.tell()
+    f.write(data)
+    return offset
+
+
+def rewriteArchive(path, blobs):
+    folder = os.path.dirname(path) or "."
+    fd, tmpPath = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        # mkstemp creates a file that is readable only by the owner
+        os.chmod(tmpPath, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+
+            locations = {}
+            entries = {}
+            for name, data in sorted(blobs.items()):
+                digest = hashlib.sha256(data).digest()
+                if digest not in locations:
+                    locations[digest] = writeBlob(f, data)
+                entries[name] = (locations[digest], len(data), digest)
+
+            header = writeIndex(f, entries)
+            f.seek(0)
+            f.write(header)
+        os.replace(tmpPath, path)
+    except OSError:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+# blobs -- dict: name -> SPIR-V bytes, all entries of the archive.
+# Returns a count of blobs that were changed, or of all blobs if the archive was missing
+# or invalid; 0 if archive is up-to-date.
+def updateArchive(path, blobs):
+    digests = { name: hashlib.sha256(data).digest() for name, data in blobs.items() }
+    index = readIndex(path)
+
+    if index is None:
+        rewriteArchive(path, blobs)
+        return len(set(digests.values()))
+
+    if { name: entry[2] for name, entry in index.items() } == digests:
+        return 0
+
+    locations = { digest: (offset, size) for offset, size, digest in index.values() }
+    changed = { digest: blobs[name] for name, digest in digests.items() if digest not in locations }
+
+    # size of the archive, if it was written from scratch
+    indexSize = align(sum(len(name.encode()) + 1 for name in blobs)) + len(blobs) * INDEX_ENTRY.size
+    liveSize = HEADER.size + sum({ digest: len(blobs[name]) for name, digest in digests.items() }.values()) + indexSize
+
+    # compaction writes all blobs, but only the changed ones are reported
+    if os.path.getsize(path) + sum(len(data) for data in changed.values()) + indexSize > 2 * liveSize:
+        rewriteArchive(path, blobs)
+        return len(changed)
+
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        for digest, data in sorted(changed.items()):
+            locations[digest] = (writeBlob(f, data), len(data))
+
+        header = writeIndex(f, { name: (locations[digest][0], len(blobs[name]), digest) for name, digest in digests.items() })
+        f.flush()
+        os.fsync(f.fileno())
+
+        # previous version stays valid until the header is replaced
+        f.seek(0)
+        f.write(header)
+
+    return len(changed)
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] in ("--help", "-help", "-h", "--h"):
+        print("Usage: ShaderArchive.py <archive>")
+        print("")
+        print("  Prints the index of a shader archive, written by GenerateShaders.py.")
+        return
+
+    index = readIndex(sys.argv[1])
+    if index is None:
+        print("> \"" + sys.argv[1] + "\" is not a valid shader archive")
+        return
+
+    for name, (offset, size, digest) in sorted(index.items(), key=lambda e: e[0].encode()):
+        print("%-48s offset %8d  size %8d  %s" % (name, offset, size, digest.hex()[:16]))
+    print("> " + str(len(index)) + " entries, " + str(len({ e[2] for e in index.values() })) + " distinct blobs")
+
+
+if __name__ == "__main__":
+    main()
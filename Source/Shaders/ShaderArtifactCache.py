@@ -0,0 +1,259 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Content-addressed storage for compiled SPIR-V, shared between
+# developer machines and CI runners. Used by GenerateShaders.py.
+#
+# A store is either a folder (e.g. on a network share) or an HTTP endpoint
+# that answers "GET <url>/<key>" and accepts "PUT <url>/<key>".
+# This script can also serve a folder store over HTTP:
+#   ShaderArtifactCache.py --serve <folder> [--port N] [--max-size MB]
+
+import sys
+import os
+import re
+import struct
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+import http.server
+
+
+ARTIFACT_EXTENSION          = ".spv"
+DEFAULT_MAX_SIZE_MB         = 1024
+EVICTION_TARGET             = 0.9   # part of the size limit that is left after eviction
+DEFAULT_PORT                = 8765
+HTTP_TIMEOUT                = 5     # in seconds
+SPIRV_MAGIC                 = 0x07230203
+KEY_PATTERN                 = re.compile("^[0-9a-f]{64}$")
+
+
+def isValidKey(key):
+    return KEY_PATTERN.match(key) is not None
+
+
+def isValidSpirv(data):
+    return len(data) >= 20 and len(data) % 4 == 0 and struct.unpack_from("<I", data)[0] == SPIRV_MAGIC
+
+
+# Folder with "<key>.spv" files. Least recently used files are removed,
+# when the total size exceeds the limit. Access time is tracked with mtime,
+# as atime is often disabled on build machines.
+# The folder is scanned only once, and then when the total size, that is tracked
+# by adding the written artifacts, exceeds the limit. So artifacts written by other
+# processes are noticed only by the next scan, and the limit can be exceeded until then.
+class FolderArtifactStore:
+    def __init__(self, folder, maxSizeMB=DEFAULT_MAX_SIZE_MB):
+        self.folder = folder
+        self.maxSize = maxSizeMB * 1024 * 1024
+        self.evictionLock = threading.Lock()
+        # None, until the folder is scanned
+        self.totalSize = None
+        os.makedirs(folder, exist_ok=True)
+
+    def getPath(self, key):
+        return os.path.join(self.folder, key + ARTIFACT_EXTENSION)
+
+    def get(self, key):
+        if not isValidKey(key):
+            return None
+        path = self.getPath(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return data if isValidSpirv(data) else None
+
+    def put(self, key, data):
+        if not isValidKey(key) or not isValidSpirv(data):
+            return
+        path = self.getPath(key)
+        if os.path.exists(path):
+            return
+
+        # write to a temporary file in the same folder and rename it,
+        # so readers never see a partially written artifact
+        fd, tmpPath = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmpPath, path)
+        except OSError:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            return
+
+        with self.evictionLock:
+            if self.totalSize is None:
+                self.totalSize = self.getFolderSize()
+            else:
+                self.totalSize += len(data)
+            if self.totalSize > self.maxSize:
+                self.evict()
+
+    def getFolderSize(self):
+        size = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name.endswith(ARTIFACT_EXTENSION):
+                    try:
+                        size += entry.stat().st_size
+                    except OSError:
+                        pass
+        return size
+
+    # Remove least recently used artifacts, until the size is below EVICTION_TARGET of the limit,
+    # so the folder is not scanned again on the next put. Must be called under evictionLock.
+    def evict(self):
+        entries = []
+        totalSize = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith(ARTIFACT_EXTENSION):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                totalSize += st.st_size
+
+        for _, size, path in sorted(entries):
+            if totalSize <= self.maxSize * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+                totalSize -= size
+            except OSError:
+                # could be already removed by other process
+                pass
+        self.totalSize = totalSize
+
+
+class HttpArtifactStore:
+    def __init__(self, url):
+        self.url = url.rstrip("/") + "/"
+        # don't wait for timeouts on each shader, if the server is unreachable
+        self.isAvailable = True
+
+    def get(self, key):
+        if not self.isAvailable or not isValidKey(key):
+            return None
+        try:
+            with urllib.request.urlopen(self.url + key, timeout=HTTP_TIMEOUT) as r:
+                data = r.read()
+        except urllib.error.HTTPError:
+            return None
+        except (urllib.error.URLError, OSError):
+            self.isAvailable = False
+            return None
+        return data if isValidSpirv(data) else None
+
+    def put(self, key, data):
+        if not self.isAvailable or not isValidKey(key) or not isValidSpirv(data):
+            return
+        request = urllib.request.Request(self.url + key, data=data, method="PUT",
+                                         headers={ "Content-Type": "application/octet-stream" })
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT):
+                pass
+        except urllib.error.HTTPError:
+            pass
+        except (urllib.error.URLError, OSError):
+            self.isAvailable = False
+
+
+def createArtifactStore(location, maxSizeMB=DEFAULT_MAX_SIZE_MB):
+    if location.startswith("http://") or location.startswith("https://"):
+        return HttpArtifactStore(location)
+    return FolderArtifactStore(location, maxSizeMB)
+
+
+def createRequestHandler(store):
+    class ArtifactRequestHandler(http.server.BaseHTTPRequestHandler):
+        def getKey(self):
+            return self.path.strip("/")
+
+        def do_GET(self):
+            data = store.get(self.getKey())
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_PUT(self):
+            key = self.getKey()
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not isValidKey(key) or not isValidSpirv(data):
+                self.send_error(400)
+                return
+            store.put(key, data)
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return ArtifactRequestHandler
+
+
+def main():
+    if "--help" in sys.argv or "-help" in sys.argv or "-h" in sys.argv or "--h" in sys.argv or "--serve" not in sys.argv:
+        print("Usage: ShaderArtifactCache.py --serve <folder> [--port N] [--max-size MB]")
+        print("")
+        print("  Serves a folder of compiled SPIR-V over HTTP, so it can be used")
+        print("  by GenerateShaders.py as \"-artifacts http://<host>:<port>\".")
+        return
+
+    folder = None
+    port = DEFAULT_PORT
+    maxSizeMB = DEFAULT_MAX_SIZE_MB
+
+    for i in range(len(sys.argv) - 1):
+        if sys.argv[i] == "--serve":
+            folder = sys.argv[i + 1]
+        elif sys.argv[i] == "--port":
+            port = int(sys.argv[i + 1])
+        elif sys.argv[i] == "--max-size":
+            maxSizeMB = int(sys.argv[i + 1])
+
+    if folder is None:
+        print("--serve expects folder path in the next argument.")
+        return
+
+    server = http.server.ThreadingHTTPServer(("", port), createRequestHandler(FolderArtifactStore(folder, maxSizeMB)))
+    print("> Serving \"" + folder + "\" on port " + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Remote compile workers for GenerateShaders.py. A worker compiles preprocessed
+# shaders, so it doesn't need the source tree, only glslc of the same version.
+#   ShaderCompileWorker.py --serve [--port N] [--jobs N]
+#
+# HTTP interface of a worker:
+#   GET  <url>/info                                 : JSON { "capacity": N, "compiler": SHA-256 of "glslc --version" }
+#   POST <url>/compile?stage=<ext>&targetEnv=<env>  : body is a preprocessed source, "X-Source-Sha256" is its hash;
+#                                                     answers with SPIR-V, and "X-Source-Sha256" of the source it
+#                                                     compiled and "X-Spirv-Sha256" of the SPIR-V, or 422 on errors
+#
+# The hashes only detect a damaged transfer. To check that a worker compiles the same
+# SPIR-V as this machine, its first result is compared with a local compilation
+# of the same source, and the worker is not used anymore if they differ.
+#
+# A worker on the same machine can stand in for a remote one, e.g. for testing.
+
+import sys
+import os
+import re
+import hashlib
+import json
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+import urllib.request
+import urllib.error
+import http.server
+
+from ShaderArtifactCache import isValidSpirv
+
+
+DEFAULT_PORT                = 8766
+INFO_TIMEOUT                = 2     # in seconds
+COMPILE_TIMEOUT             = 120   # in seconds
+STAGE_PATTERN               = re.compile(r"^\.(comp|vert|frag|geom|tesc|tese|rgen|rahit|rchit|rmiss|rint|rcall|mesh|task)$")
+TARGET_ENV_PATTERN          = re.compile(r"^--target-env=[a-z0-9.]+$")
+
+
+def getSha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Hash of glslc version, workers with a different glslc are not used,
+# as their SPIR-V would be different from a local build
+def getCompilerVersionHash():
+    try:
+        r = subprocess.run(["glslc", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError:
+        return None
+    return getSha256(r.stdout.encode())
+
+
+# Compile a preprocessed source in a temporary folder, the same way on a worker and locally.
+# stage -- extension of the source file, e.g. ".comp"
+# Returns (SPIR-V, or None if compilation failed; glslc output).
+def compilePreprocessed(stage, targetEnv, data):
+    with tempfile.TemporaryDirectory() as folder:
+        sourcePath = os.path.join(folder, "shader" + stage)
+        outputPath = sourcePath + ".spv"
+        with open(sourcePath, "wb") as f:
+            f.write(data)
+        r = subprocess.run([ "glslc", targetEnv, sourcePath, "-o", outputPath ],
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if r.returncode != 0 or not os.path.exists(outputPath):
+            return None, r.stdout
+        with open(outputPath, "rb") as f:
+            return f.read(), r.stdout
+
+
+class RemoteWorker:
+    def __init__(self, url, capacity):
+        self.url = url
+        self.capacity = capacity
+        self.busy = 0
+        # don't wait for timeouts on each shader, if the worker is unreachable
+        self.isAvailable = True
+        # if its first result was the same as a local compilation
+        self.isVerified = False
+        self.verifyLock = threading.Lock()
+
+
+# Slots for compilations: "capacity" ones on each worker, and localSlots on this machine.
+# Remote slots are taken first, local ones are used when all workers are busy or unavailable.
+class WorkerPool:
+    def __init__(self, urls, localSlots):
+        self.workers = []
+        self.localSlots = localSlots
+        self.localBusy = 0
+        self.condition = threading.Condition()
+
+        compilerVersion = getCompilerVersionHash()
+        for url in urls:
+            url = url.rstrip("/") + "/"
+            try:
+                with urllib.request.urlopen(url + "info", timeout=INFO_TIMEOUT) as r:
+                    info = json.loads(r.read())
+                capacity = int(info["capacity"])
+            except (urllib.error.URLError, OSError, ValueError, KeyError, TypeError):
+                print("> Compile worker " + url + " is unreachable")
+                continue
+            if info.get("compiler") != compilerVersion:
+                print("> Compile worker " + url + " has a different glslc version, it's not used")
+                continue
+            if capacity > 0:
+                self.workers.append(RemoteWorker(url, capacity))
+
+    def getRemoteCapacity(self):
+        return sum(w.capacity for w in self.workers)
+
+    # Wait for a free slot. Returns a RemoteWorker, or None if a local slot was taken.
+    # allowRemote -- False, if a compilation must run locally, e.g. a worker failed
+    def acquire(self, allowRemote=True):
+        with self.condition:
+            while True:
+                if allowRemote:
+                    free = [ w for w in self.workers if w.isAvailable and w.busy < w.capacity ]
+                    if len(free) > 0:
+                        worker = min(free, key=lambda w: w.busy / w.capacity)
+                        worker.busy += 1
+                        return worker
+                if self.localBusy < self.localSlots:
+                    self.localBusy += 1
+                    return None
+                self.condition.wait()
+
+    def release(self, worker):
+        with self.condition:
+            if worker is not None:
+                worker.busy -= 1
+            else:
+                self.localBusy -= 1
+            self.condition.notify_all()
+
+    # stage -- extension of the source file, e.g. ".comp"
+    # source -- preprocessed text, as "glslc -E" printed it
+    # Returns SPIR-V, or None if it must be compiled locally.
+    def compile(self, worker, stage, targetEnv, source):
+        data = source.encode()
+        sourceHash = getSha256(data)
+        query = urllib.parse.urlencode({ "stage": stage, "targetEnv": targetEnv })
+        request = urllib.request.Request(worker.url + "compile?" + query, data=data, method="POST",
+                                         headers={ "Content-Type": "text/plain; charset=utf-8", "X-Source-Sha256": sourceHash })
+        try:
+            with urllib.request.urlopen(request, timeout=COMPILE_TIMEOUT) as r:
+                spirv = r.read()
+                spirvHash = r.headers.get("X-Spirv-Sha256")
+                compiledSourceHash = r.headers.get("X-Source-Sha256")
+        except urllib.error.HTTPError:
+            # e.g. compilation errors, they're reported by the local glslc
+            return None
+        except (urllib.error.URLError, OSError):
+            self.disable(worker, "is unreachable, its shaders are compiled locally")
+            return None
+
+        if compiledSourceHash != sourceHash or spirvHash != getSha256(spirv) or not isValidSpirv(spirv):
+            self.disable(worker, "sent a result that doesn't match its hash, it's not used anymore")
+            return None
+
+        # the hashes can't show that the worker's glslc produces the same SPIR-V,
+        # e.g. if it's built differently, so compare with a local compilation once
+        with worker.verifyLock:
+            if not worker.isVerified and worker.isAvailable:
+                localSpirv, _ = compilePreprocessed(stage, targetEnv, data)
+                if localSpirv != spirv:
+                    self.disable(worker, "compiled SPIR-V that differs from a local compilation, it's not used anymore")
+                    return None
+                worker.isVerified = True
+            if not worker.isAvailable:
+                return None
+
+        return spirv
+
+    def disable(self, worker, reason):
+        with self.condition:
+            wasAvailable = worker.isAvailable
+            worker.isAvailable = False
+            self.condition.notify_all()
+        # other compilations on the worker could fail at the same time
+        if wasAvailable:
+            print("> Compile worker " + worker.url + " " + reason)
+
+
+def createRequestHandler(capacity):
+    compilerVersion = getCompilerVersionHash()
+    # one glslc process for each slot
+    slots = threading.Semaphore(capacity)
+
+    class CompileRequestHandler(http.server.BaseHTTPRequestHandler):
+        def sendBody(self, code, body, contentType, headers={}):
+            self.send_response(code)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.strip("/") != "info":
+                self.send_error(404)
+                return
+            self.sendBody(200, json.dumps({ "capacity": capacity, "compiler": compilerVersion }).encode(), "application/json")
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            stage = query.get("stage", [ "" ])[0]
+            targetEnv = query.get("targetEnv", [ "" ])[0]
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            if url.path.strip("/") != "compile" or not STAGE_PATTERN.match(stage) or not TARGET_ENV_PATTERN.match(targetEnv):
+                self.send_error(400)
+                return
+            sourceHash = getSha256(data)
+            if self.headers.get("X-Source-Sha256") != sourceHash:
+                self.send_error(400, "Source doesn't match its hash")
+                return
+
+            with slots:
+                spirv, output = compilePreprocessed(stage, targetEnv, data)
+            if spirv is None:
+                self.sendBody(422, output, "text/plain; charset=utf-8")
+                return
+
+            self.sendBody(200, spirv, "application/octet-stream",
+                          { "X-Source-Sha256": sourceHash, "X-Spirv-Sha256": getSha256(spirv) })
+
+        def log_message(self, format, *args):
+            pass
+
+    return CompileRequestHandler
+
+
+def main():
+    if "--help" in sys.argv or "-help" in sys.argv or "-h" in sys.argv or "--h" in sys.argv or "--serve" not in sys.argv:
+        print("Usage: ShaderCompileWorker.py --serve [--port N] [--jobs N]")
+        print("")
+        print("  Compiles preprocessed shaders sent by GenerateShaders.py, that is started")
+        print("  with \"-workers http://<host>:<port>\". glslc must be in PATH.")
+        return
+
+    port = DEFAULT_PORT
+    capacity = os.cpu_count() or 1
+
+    for i in range(len(sys.argv) - 1):
+        if sys.argv[i] == "--port":
+            port = int(sys.argv[i + 1])
+        elif sys.argv[i] == "--jobs":
+            capacity = int(sys.argv[i + 1])
+
+    if getCompilerVersionHash() is None:
+        print("> Couldn't run glslc, check that it's in PATH")
+        return
+
+    server = http.server.ThreadingHTTPServer(("", port), createRequestHandler(capacity))
+    print("> Compiling shaders with " + str(capacity) + " jobs on port " + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Reads descriptor bindings and cost statistics from SPIR-V modules,
+# without external tools. Used by GenerateShaders.py. To print them:
+#   ShaderReflection.py <file.spv> [<file.spv> ...]
+#
+# Statistics are rough estimates of shader cost, they're meant to be
+# compared between builds of the same shader, not between shaders:
+#   instructions        : instructions in function bodies, without debug ones
+#   branches, loops     : conditional branches and switches; loop headers
+#   heavyOps            : transcendental functions, divisions and matrix products
+#   textureOps          : image samples, fetches, gathers, reads and writes
+#   locals              : function-scope variables
+#   traceRays           : trace ray and ray query calls
+#   pushConstantSize    : in bytes
+
+import sys
+import re
+import struct
+
+
+SPIRV_MAGIC                 = 0x07230203
+SPIRV_HEADER_WORDS          = 5
+
+# opcodes
+OP_NAME                     = 5
+OP_LINE                     = 8
+OP_EXT_INST_IMPORT          = 11
+OP_EXT_INST                 = 12
+OP_TYPE_BOOL                = 20
+OP_TYPE_INT                 = 21
+OP_TYPE_FLOAT               = 22
+OP_TYPE_VECTOR              = 23
+OP_TYPE_MATRIX              = 24
+OP_TYPE_IMAGE               = 25
+OP_TYPE_SAMPLER             = 26
+OP_TYPE_SAMPLED_IMAGE       = 27
+OP_TYPE_ARRAY               = 28
+OP_TYPE_RUNTIME_ARRAY       = 29
+OP_TYPE_STRUCT              = 30
+OP_TYPE_POINTER             = 32
+OP_CONSTANT                 = 43
+OP_FUNCTION                 = 54
+OP_FUNCTION_END             = 56
+OP_VARIABLE                 = 59
+OP_DECORATE                 = 71
+OP_MEMBER_DECORATE          = 72
+OP_LOOP_MERGE               = 246
+OP_LABEL                    = 248
+OP_BRANCH_CONDITIONAL       = 250
+OP_SWITCH                   = 251
+OP_NO_LINE                  = 317
+OP_TRACE_RAY_KHR            = 4445
+OP_RAY_QUERY_INITIALIZE_KHR = 4473
+OP_TYPE_ACCELERATION_STRUCTURE_KHR = 5341
+
+OPS_HEAVY                   = { 134, 135, 136, 137, 138, 139, 140, 141, 144, 145, 146, 147 }
+OPS_TEXTURE                 = set(range(87, 100)) | set(range(305, 316)) | { 320 }
+OPS_TRACE_RAY               = { OP_TRACE_RAY_KHR, OP_RAY_QUERY_INITIALIZE_KHR }
+OPS_DEBUG                   = { OP_LINE, OP_NO_LINE, OP_LABEL }
+# GLSL.std.450: trigonometry, exp, log, pow, sqrt, inverse, length, distance, normalize, refract
+GLSL_STD_450_HEAVY          = set(range(13, 35)) | { 66, 67, 69, 72 }
+
+# decorations
+DECORATION_BUFFER_BLOCK     = 3
+DECORATION_ARRAY_STRIDE     = 6
+DECORATION_MATRIX_STRIDE    = 7
+DECORATION_BINDING          = 33
+DECORATION_DESCRIPTOR_SET   = 34
+DECORATION_OFFSET           = 35
+
+# storage classes
+STORAGE_UNIFORM_CONSTANT    = 0
+STORAGE_UNIFORM             = 2
+STORAGE_FUNCTION            = 7
+STORAGE_PUSH_CONSTANT       = 9
+STORAGE_STORAGE_BUFFER      = 12
+
+IMAGE_DIM_BUFFER            = 5
+IMAGE_SAMPLED_STORAGE       = 2
+
+STAT_NAMES                  = [ "instructions", "branches", "loops", "heavyOps", "textureOps", "locals", "traceRays", "pushConstantSize" ]
+
+# e.g. "layout(set = DESC_SET_FRAMEBUFFERS, binding = 3, r32ui) uniform uimage2D framebufNormal_Prev;"
+FRAMEBUF_DECLARATION_PATTERN = re.compile(r"layout\(set\s*=\s*DESC_SET_FRAMEBUFFERS,\s*binding\s*=\s*(\d+)[^)]*\)\s*uniform\s+\w+\s+(\w+)\s*;")
+
+
+def decodeString(words):
+    data = struct.pack("<%dI" % len(words), *words)
+    return data.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+# Returns a list of (opcode, operand words), or None if it's not a valid SPIR-V module
+def getInstructions(data):
+    if len(data) < SPIRV_HEADER_WORDS * 4 or len(data) % 4 != 0:
+        return None
+    words = struct.unpack("<%dI" % (len(data) // 4), data)
+    if words[0] != SPIRV_MAGIC:
+        return None
+
+    instructions = []
+    i = SPIRV_HEADER_WORDS
+    while i < len(words):
+        wordCount, opcode = words[i] >> 16, words[i] & 0xFFFF
+        if wordCount == 0 or i + wordCount > len(words):
+            return None
+        instructions.append((opcode, words[i + 1:i + wordCount]))
+        i += wordCount
+    return instructions
+
+
+class Module:
+    def __init__(self, instructions):
+        self.names = {}
+        self.types = {}
+        self.constants = {}
+        self.decorations = {}
+        self.memberDecorations = {}
+        self.variables = []
+        self.glslStd450 = None
+
+        for opcode, ops in instructions:
+            if opcode == OP_NAME and len(ops) >= 2:
+                self.names[ops[0]] = decodeString(ops[1:])
+            elif opcode == OP_EXT_INST_IMPORT and len(ops) >= 2 and decodeString(ops[1:]) == "GLSL.std.450":
+                self.glslStd450 = ops[0]
+            elif opcode == OP_DECORATE and len(ops) >= 2:
+                self.decorations.setdefault(ops[0], {})[ops[1]] = ops[2] if len(ops) > 2 else None
+            elif opcode == OP_MEMBER_DECORATE and len(ops) >= 3:
+                self.memberDecorations.setdefault((ops[0], ops[1]), {})[ops[2]] = ops[3] if len(ops) > 3 else None
+            elif opcode == OP_CONSTANT and len(ops) >= 3:
+                self.constants[ops[1]] = ops[2]
+            elif OP_TYPE_BOOL <= opcode <= OP_TYPE_POINTER or opcode == OP_TYPE_ACCELERATION_STRUCTURE_KHR:
+                if len(ops) >= 1:
+                    self.types[ops[0]] = (opcode, ops[1:])
+            elif opcode == OP_VARIABLE and len(ops) >= 3:
+                self.variables.append((ops[0], ops[1], ops[2]))
+
+    def getDecoration(self, id, decoration):
+        return self.decorations.get(id, {}).get(decoration)
+
+    # Size in bytes, as laid out by explicit offsets and strides
+    def getTypeSize(self, typeId, depth=0):
+        opcode, ops = self.types.get(typeId, (None, ()))
+        if depth > 32 or opcode is None:
+            return 0
+        if opcode in (OP_TYPE_INT, OP_TYPE_FLOAT):
+            return ops[0] // 8
+        if opcode == OP_TYPE_BOOL:
+            return 4
+        if opcode == OP_TYPE_VECTOR:
+            return self.getTypeSize(ops[0], depth + 1) * ops[1]
+        if opcode == OP_TYPE_MATRIX:
+            return self.getTypeSize(ops[0], depth + 1) * ops[1]
+        if opcode == OP_TYPE_ARRAY:
+            length = self.constants.get(ops[1], 0)
+            stride = self.getDecoration(typeId, DECORATION_ARRAY_STRIDE)
+            return length * (stride if stride is not None else self.getTypeSize(ops[0], depth + 1))
+        if opcode == OP_TYPE_STRUCT:
+            size = 0
+            for index, memberType in enumerate(ops):
+                decorations = self.memberDecorations.get((typeId, index), {})
+                offset = decorations.get(DECORATION_OFFSET) or 0
+                memberSize = self.getTypeSize(memberType, depth + 1)
+                matrixStride = decorations.get(DECORATION_MATRIX_STRIDE)
+                if matrixStride is not None and self.types.get(memberType, (None,))[0] == OP_TYPE_MATRIX:
+                    memberSize = matrixStride * self.types[memberType][1][1]
+                size = max(size, offset + memberSize)
+            return size
+        # runtime arrays, pointers, opaque types
+        return 0
+
+    # Returns (descriptor type name, descriptor count), count is 0 for unbounded arrays
+    def getDescriptorType(self, typeId, storageClass):
+        count = 1
+        opcode, ops = self.types.get(typeId, (None, ()))
+        while opcode in (OP_TYPE_ARRAY, OP_TYPE_RUNTIME_ARRAY):
+            count = count * self.constants.get(ops[1], 0) if opcode == OP_TYPE_ARRAY else 0
+            typeId = ops[0]
+            opcode, ops = self.types.get(typeId, (None, ()))
+
+        if opcode == OP_TYPE_IMAGE and len(ops) >= 6:
+            isBuffer = ops[1] == IMAGE_DIM_BUFFER
+            if ops[5] == IMAGE_SAMPLED_STORAGE:
+                return ("storageTexelBuffer" if isBuffer else "storageImage"), count
+            return ("uniformTexelBuffer" if isBuffer else "sampledImage"), count
+        if opcode == OP_TYPE_SAMPLER:
+            return "sampler", count
+        if opcode == OP_TYPE_SAMPLED_IMAGE:
+            return "combinedImageSampler", count
+        if opcode == OP_TYPE_ACCELERATION_STRUCTURE_KHR:
+            return "accelerationStructure", count
+        if opcode == OP_TYPE_STRUCT:
+            if storageClass == STORAGE_STORAGE_BUFFER or DECORATION_BUFFER_BLOCK in self.decorations.get(typeId, {}):
+                return "storageBuffer", count
+            return "uniformBuffer", count
+        return "unknown", count
+
+    # Returns (pointee type, storage class) of a pointer type
+    def getPointee(self, pointerTypeId):
+        opcode, ops = self.types.get(pointerTypeId, (None, ()))
+        if opcode != OP_TYPE_POINTER or len(ops) < 2:
+            return None, None
+        return ops[1], ops[0]
+
+    # usedIds -- ids that are referenced in function bodies, a binding is "used",
+    # if its variable is, as declared but unused ones don't need to match the layout
+    def getBindings(self, usedIds):
+        bindings = []
+        for typeId, id, storageClass in self.variables:
+            if storageClass not in (STORAGE_UNIFORM_CONSTANT, STORAGE_UNIFORM, STORAGE_STORAGE_BUFFER):
+                continue
+            descriptorSet = self.getDecoration(id, DECORATION_DESCRIPTOR_SET)
+            binding = self.getDecoration(id, DECORATION_BINDING)
+            if descriptorSet is None or binding is None:
+                continue
+            pointee, _ = self.getPointee(typeId)
+            descriptorType, count = self.getDescriptorType(pointee, storageClass)
+            # blocks without an instance name are named by their type
+            name = self.names.get(id) or self.names.get(pointee, "")
+            bindings.append({ "set": descriptorSet, "binding": binding, "type": descriptorType, "name": name, "count": count,
+                              "used": id in usedIds })
+        return sorted(bindings, key=lambda b: (b["set"], b["binding"], b["name"]))
+
+    def getPushConstantSize(self):
+        size = 0
+        for typeId, _, storageClass in self.variables:
+            if storageClass == STORAGE_PUSH_CONSTANT:
+                pointee, _ = self.getPointee(typeId)
+                size = max(size, self.getTypeSize(pointee))
+        return size
+
+
+# Returns a dict with bindings and STAT_NAMES counters, or None if data is not a valid SPIR-V module
+def reflect(data):
+    instructions = getInstructions(data)
+    if instructions is None:
+        return None
+    try:
+        module = Module(instructions)
+
+        stats = dict.fromkeys(STAT_NAMES, 0)
+        # operands are not decoded, so a literal can be taken for an id, then a binding is considered used, which is safe
+        usedIds = set()
+        isInFunction = False
+        for opcode, ops in instructions:
+            if opcode == OP_FUNCTION:
+                isInFunction = True
+                continue
+            if opcode == OP_FUNCTION_END:
+                isInFunction = False
+                continue
+            if not isInFunction or opcode in OPS_DEBUG:
+                continue
+            usedIds.update(ops)
+
+            stats["instructions"] += 1
+            if opcode in (OP_BRANCH_CONDITIONAL, OP_SWITCH):
+                stats["branches"] += 1
+            elif opcode == OP_LOOP_MERGE:
+                stats["loops"] += 1
+            elif opcode in OPS_HEAVY:
+                stats["heavyOps"] += 1
+            elif opcode == OP_EXT_INST and len(ops) >= 4 and ops[2] == module.glslStd450 and ops[3] in GLSL_STD_450_HEAVY:
+                stats["heavyOps"] += 1
+            elif opcode in OPS_TEXTURE:
+                stats["textureOps"] += 1
+            elif opcode in OPS_TRACE_RAY:
+                stats["traceRays"] += 1
+            elif opcode == OP_VARIABLE and len(ops) >= 3 and ops[2] == STORAGE_FUNCTION:
+                stats["locals"] += 1
+
+        stats["pushConstantSize"] = module.getPushConstantSize()
+        stats["bindings"] = module.getBindings(usedIds)
+    except (IndexError, KeyError, TypeError, struct.error):
+        # malformed, but with a valid header
+        return None
+    return stats
+
+
+def getBindingsWithoutUse(stats):
+    return [ { key: value for key, value in b.items() if key != "used" } for b in stats.get("bindings") or [] ]
+
+
+# Returns a dict: metric -> (old, new), for the metrics that differ;
+# "bindings" is in the dict, if descriptor bindings were changed
+def getStatsDiff(old, new):
+    diff = {}
+    for name in STAT_NAMES:
+        if old.get(name) != new.get(name):
+            diff[name] = (old.get(name), new.get(name))
+    # statistics of older builds don't have "used"
+    if getBindingsWithoutUse(old) != getBindingsWithoutUse(new):
+        diff["bindings"] = (len(old.get("bindings") or []), len(new.get("bindings") or []))
+    return diff
+
+
+# Returns a dict: framebuffer variable name -> binding in DESC_SET_FRAMEBUFFERS,
+# as GenerateShaderCommon.py assigned them in the generated GLSL header
+def readFramebufferBindings(glslHeaderPath):
+    try:
+        with open(glslHeaderPath, "r") as f:
+            text = f.read()
+    except OSError:
+        return {}
+    return { m.group(2): int(m.group(1)) for m in FRAMEBUF_DECLARATION_PATTERN.finditer(text) }
+
+
+# Returns a list of messages for framebuffer bindings that don't match the expected ones,
+# and for framebuffers that are not in one descriptor set. Only used framebuffers are checked:
+# e.g. GenerateShaders.py doesn't rebuild a shader, if it doesn't reference a changed framebuffer,
+# so its SPIR-V keeps the old declaration.
+def checkFramebufferBindings(stats, expectedBindings):
+    messages = []
+    framebufs = [ b for b in stats["bindings"] if b["name"] in expectedBindings and b.get("used", True) ]
+    for b in framebufs:
+        if b["binding"] != expectedBindings[b["name"]]:
+            messages.append("\"" + b["name"] + "\" is at binding " + str(b["binding"]) + ", but GenerateShaderCommon.py assigned "
+                            + str(expectedBindings[b["name"]]) + " in DESC_SET_FRAMEBUFFERS")
+    if len({ b["set"] for b in framebufs }) > 1:
+        messages.append("framebuffers are in different descriptor sets: " + ", ".join(sorted({ str(b["set"]) for b in framebufs })))
+    return messages
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("--help", "-help", "-h", "--h"):
+        print("Usage: ShaderReflection.py <file.spv> [<file.spv> ...]")
+        print("")
+        print("  Prints descriptor bindings and cost statistics of SPIR-V modules.")
+        return
+
+    for path in sys.argv[1:]:
+        try:
+            with open(path, "rb") as f:
+                stats = reflect(f.read())
+        except OSError:
+            stats = None
+        if stats is None:
+            print("> \"" + path + "\" is not a valid SPIR-V module")
+            continue
+
+        print(path)
+        print("  " + ", ".join(name + " " + str(stats[name]) for name in STAT_NAMES))
+        for b in stats["bindings"]:
+            print("  set %d binding %-3d %-22s %s%s%s" % (b["set"], b["binding"], b["type"], b["name"],
+                                                         "" if b["count"] == 1 else "[" + (str(b["count"]) if b["count"] > 0 else "") + "]",
+                                                         "" if b["used"] else " (unused)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#   python -m unittest discover Source/Shaders/Tests
+
+import sys
+import os
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+import http.server
+import unittest
+import unittest.mock
+
+SHADERS_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SHADERS_FOLDER)
+
+from ShaderArtifactCache import FolderArtifactStore, HttpArtifactStore, createArtifactStore, createRequestHandler, SPIRV_MAGIC
+
+
+# SPIR-V header and "size" bytes of a body, that is different for each seed
+def makeSpirv(seed, size=16):
+    return struct.pack("<5I", SPIRV_MAGIC, 0x00010500, 0, 1, 0) + bytes([ seed % 256 ]) * size
+
+
+def makeKey(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+class FolderArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempFolder = tempfile.TemporaryDirectory()
+        self.folder = self.tempFolder.name
+
+    def tearDown(self):
+        self.tempFolder.cleanup()
+
+    def test_putGet(self):
+        store = FolderArtifactStore(self.folder)
+        store.put(makeKey("a"), makeSpirv(1))
+
+        self.assertEqual(store.get(makeKey("a")), makeSpirv(1))
+        self.assertIsNone(store.get(makeKey("b")))
+        # a new store on the same folder sees the artifact
+        self.assertEqual(FolderArtifactStore(self.folder).get(makeKey("a")), makeSpirv(1))
+
+    def test_invalidArtifacts(self):
+        store = FolderArtifactStore(self.folder)
+        store.put("../" + makeKey("a")[3:], makeSpirv(1))
+        store.put(makeKey("b"), b"not a SPIR-V")
+        store.put(makeKey("c"), makeSpirv(1)[:-1])
+
+        self.assertEqual(os.listdir(self.folder), [])
+        self.assertIsNone(store.get("../" + makeKey("a")[3:]))
+
+    def test_evictLeastRecentlyUsed(self):
+        store = FolderArtifactStore(self.folder)
+        size = len(makeSpirv(0))
+        # only two artifacts fit, and two are left after eviction
+        store.maxSize = size * 5 // 2
+
+        store.put(makeKey("a"), makeSpirv(1))
+        store.put(makeKey("b"), makeSpirv(2))
+        # "a" is older, but it's read after "b" was written
+        os.utime(store.getPath(makeKey("a")), (1000, 1000))
+        os.utime(store.getPath(makeKey("b")), (2000, 2000))
+        self.assertIsNotNone(store.get(makeKey("a")))
+
+        store.put(makeKey("c"), makeSpirv(3))
+
+        self.assertIsNotNone(store.get(makeKey("a")))
+        self.assertIsNone(store.get(makeKey("b")))
+        self.assertIsNotNone(store.get(makeKey("c")))
+
+    def test_scanOnlyOverLimit(self):
+        store = FolderArtifactStore(self.folder)
+        size = len(makeSpirv(0))
+        store.maxSize = size * 4
+
+        with unittest.mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            for i in range(4):
+                store.put(makeKey(str(i)), makeSpirv(i))
+            self.assertEqual(scandir.call_count, 1)
+
+            store.put(makeKey("4"), makeSpirv(4))
+            self.assertEqual(scandir.call_count, 2)
+
+        self.assertEqual(store.totalSize, size * 3)
+        self.assertEqual(len(os.listdir(self.folder)), 3)
+
+
+class HttpArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempFolder = tempfile.TemporaryDirectory()
+        self.folderStore = FolderArtifactStore(self.tempFolder.name)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), createRequestHandler(self.folderStore))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tempFolder.cleanup()
+
+    def test_putGet(self):
+        store = createArtifactStore(self.url)
+        self.assertIsInstance(store, HttpArtifactStore)
+
+        store.put(makeKey("a"), makeSpirv(1))
+
+        self.assertEqual(store.get(makeKey("a")), makeSpirv(1))
+        self.assertEqual(self.folderStore.get(makeKey("a")), makeSpirv(1))
+        # a missing artifact doesn't disable the store
+        self.assertIsNone(store.get(makeKey("b")))
+        self.assertTrue(store.isAvailable)
+
+    def test_invalidArtifact(self):
+        store = HttpArtifactStore(self.url)
+        store.put(makeKey("a"), b"not a SPIR-V")
+
+        self.assertIsNone(store.get(makeKey("a")))
+        self.assertEqual(os.listdir(self.tempFolder.name), [])
+
+
+class UnreachableArtifactStoreTest(unittest.TestCase):
+    def test_fallback(self):
+        # a port that nothing listens on
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        store = HttpArtifactStore("http://127.0.0.1:" + str(port))
+
+        self.assertIsNone(store.get(makeKey("a")))
+        self.assertFalse(store.isAvailable)
+        # builds go on without the store
+        store.put(makeKey("a"), makeSpirv(1))
+        self.assertIsNone(store.get(makeKey("a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
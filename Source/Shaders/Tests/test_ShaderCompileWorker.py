@@ -0,0 +1,140 @@
+# Copyright (c) 2021 Sultim Tsyrendashiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A worker on this machine stands in for a remote one.
+#   python -m unittest discover Source/Shaders/Tests
+
+import sys
+import os
+import re
+import shutil
+import socket
+import subprocess
+import unittest
+import unittest.mock
+
+SHADERS_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SHADERS_FOLDER)
+
+import ShaderCompileWorker
+from ShaderCompileWorker import WorkerPool, RemoteWorker, compilePreprocessed
+from ShaderArtifactCache import isValidSpirv
+
+
+TARGET_ENV      = "--target-env=vulkan1.2"
+SOURCE          = "#version 460\nlayout(local_size_x = 1) in;\nvoid main() {}\n"
+SOURCE_ERROR    = "#version 460\nlayout(local_size_x = 1) in;\nvoid main() { FAKE_ERROR; }\n"
+
+
+@unittest.skipIf(shutil.which("glslc") is None, "glslc is not in PATH")
+class CompileWorkerTest(unittest.TestCase):
+    def setUp(self):
+        # -u: the port is printed before serving, it must not stay in a buffer
+        self.server = subprocess.Popen([ sys.executable, "-u", os.path.join(SHADERS_FOLDER, "ShaderCompileWorker.py"),
+                                         "--serve", "--port", "0", "--jobs", "2" ],
+                                       stdout=subprocess.PIPE, text=True)
+        line = self.server.stdout.readline()
+        m = re.search(r"on port (\d+)", line)
+        if m is None:
+            self.server.kill()
+            self.server.wait()
+            self.fail("Worker didn't start: " + line)
+        self.url = "http://127.0.0.1:" + m.group(1)
+
+    def tearDown(self):
+        self.server.kill()
+        self.server.wait()
+        self.server.stdout.close()
+
+    def test_roundTrip(self):
+        pool = WorkerPool([ self.url ], 1)
+        self.assertEqual(pool.getRemoteCapacity(), 2)
+
+        worker = pool.acquire()
+        self.assertIsNotNone(worker)
+        try:
+            spirv = pool.compile(worker, ".comp", TARGET_ENV, SOURCE)
+        finally:
+            pool.release(worker)
+
+        self.assertTrue(isValidSpirv(spirv))
+        self.assertTrue(worker.isVerified)
+        localSpirv, _ = compilePreprocessed(".comp", TARGET_ENV, SOURCE.encode())
+        self.assertEqual(spirv, localSpirv)
+
+    def test_differentSpirv(self):
+        pool = WorkerPool([ self.url ], 1)
+        worker = pool.acquire()
+        # as if this machine's glslc compiled something else
+        with unittest.mock.patch.object(ShaderCompileWorker, "compilePreprocessed", return_value=(b"\0" * 20, b"")):
+            try:
+                spirv = pool.compile(worker, ".comp", TARGET_ENV, SOURCE)
+            finally:
+                pool.release(worker)
+
+        self.assertIsNone(spirv)
+        self.assertFalse(worker.isAvailable)
+        self.assertIsNone(pool.acquire())
+
+    def test_compilationError(self):
+        pool = WorkerPool([ self.url ], 1)
+        worker = pool.acquire()
+        try:
+            spirv = pool.compile(worker, ".comp", TARGET_ENV, SOURCE_ERROR)
+        finally:
+            pool.release(worker)
+
+        # errors are reported by the local glslc, the worker stays in use
+        self.assertIsNone(spirv)
+        self.assertTrue(worker.isAvailable)
+
+
+# glslc is not needed, nothing is compiled
+class UnreachableWorkerTest(unittest.TestCase):
+    def setUp(self):
+        # a port that nothing listens on
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.url = "http://127.0.0.1:" + str(s.getsockname()[1]) + "/"
+
+    def test_unreachableAtStart(self):
+        pool = WorkerPool([ self.url ], 1)
+        self.assertEqual(pool.getRemoteCapacity(), 0)
+        self.assertIsNone(pool.acquire())
+
+    def test_unreachableDuringBuild(self):
+        pool = WorkerPool([], 1)
+        worker = RemoteWorker(self.url, 2)
+        pool.workers.append(worker)
+
+        self.assertIs(pool.acquire(), worker)
+        try:
+            spirv = pool.compile(worker, ".comp", TARGET_ENV, SOURCE)
+        finally:
+            pool.release(worker)
+
+        # the shader is compiled locally, and so are the next ones
+        self.assertIsNone(spirv)
+        self.assertFalse(worker.isAvailable)
+        self.assertIsNone(pool.acquire())
+
+
+if __name__ == "__main__":
+    unittest.main()